@@ -1,13 +1,147 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context, g, has_request_context, before_render_template, template_rendered, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from flask.sessions import SecureCookieSessionInterface
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+import click
+import gc
+import hashlib
+import io
 import json
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import date, datetime, timedelta, timezone
 import uuid
+import threading
+from collections import namedtuple
+from library.storage import open_storage, BOOK_SORTS, AVAILABILITY_FILTERS, ISSUE_STATUS_FILTERS, \
+    BOOK_FIELDS, STUDENT_FIELDS, ISSUE_FIELDS
+from library.index import IndexedStorage
+from library.pagination import Page, page_size
+from library import analytics, bulk, circulation, jobs, journal
+from library.credentials import PasswordHasher, RateLimiter, is_hashed
+from library.cache import ResponseCache
+from library.outbox import open_outbox
+from library.overdue import sweep_overdue, deliver_reminders
+from library.scheduler import Scheduler
+from library.metrics import Metrics, TimedStorage, SlowRequestProfiler, SIZE_BUCKETS
+from library.records import DEFAULT_BRANCH, Record, Status, loan_dates
+try:
+    import orjson
+except ImportError:
+    orjson = None
    
+
+class RecordJSONProvider(DefaultJSONProvider):
+    # Index records serialize as the row dicts they stand in for. With
+    # orjson installed and FAST_JSON on, compact output is encoded by orjson;
+    # pretty-printed (debug) output, other json options and anything orjson
+    # rejects go through the standard json module as before.
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        if isinstance(o, Status):
+            return o.value
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or not self._app.config.get('FAST_JSON') \
+                or kwargs.keys() - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME \
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default, option=options).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+
 app = Flask(__name__) 
-app.secret_key = 'library-management-system-secret-key'
-app.config['SESSION_TYPE'] = 'filesystem'
+app.json = RecordJSONProvider(app)
+# Sessions are signed cookies, so every worker needs the same key. The
+# default is for development; create_app(production=True) refuses it.
+DEV_SECRET_KEY = 'library-management-system-secret-key'
+app.secret_key = os.environ.get('LIBRARY_SECRET_KEY', DEV_SECRET_KEY)
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['SESSION_COOKIE_SECURE'] = os.environ.get('LIBRARY_SECURE_COOKIES', '0') == '1'
+# Reverse proxies in front of the app whose X-Forwarded-* headers are trusted
+app.config['PROXY_COUNT'] = int(os.environ.get('LIBRARY_PROXY_COUNT', '0'))
+app.config['STORAGE_URL'] = os.environ.get(
+    'LIBRARY_STORAGE_URL',
+    'sqlite:///' + os.path.join(app.instance_path, 'library.db')
+)
+app.config['STORAGE_INDEX'] = os.environ.get('LIBRARY_STORAGE_INDEX', '1') == '1'
+app.config['FAST_JSON'] = os.environ.get('LIBRARY_FAST_JSON', '1') == '1'
+app.config['CACHE_ENABLED'] = os.environ.get('LIBRARY_CACHE', '1') == '1'
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('LIBRARY_CACHE_MAX_ENTRIES', '512'))
+app.config['CACHE_TTL'] = int(os.environ.get('LIBRARY_CACHE_TTL', '60'))
+app.config['PASSWORD_HASH'] = os.environ.get('LIBRARY_PASSWORD_HASH', 'scrypt')
+app.config['SCRYPT_N'] = int(os.environ.get('LIBRARY_SCRYPT_N', str(2 ** 14)))
+app.config['PBKDF2_ITERATIONS'] = int(os.environ.get('LIBRARY_PBKDF2_ITERATIONS', '600000'))
+# admin/123 is the development login. In production set
+# LIBRARY_ADMIN_PASSWORD_HASH to the output of `flask hash-password`.
+app.config['ADMIN_USERNAME'] = os.environ.get('LIBRARY_ADMIN_USERNAME', 'admin')
+app.config['ADMIN_PASSWORD'] = os.environ.get('LIBRARY_ADMIN_PASSWORD', '123')
+app.config['ADMIN_PASSWORD_HASH'] = os.environ.get('LIBRARY_ADMIN_PASSWORD_HASH') or None
+# Failed logins allowed per account and per client address in LOGIN_PERIOD seconds
+app.config['LOGIN_ATTEMPTS'] = int(os.environ.get('LIBRARY_LOGIN_ATTEMPTS', '5'))
+app.config['LOGIN_IP_ATTEMPTS'] = int(os.environ.get('LIBRARY_LOGIN_IP_ATTEMPTS', '50'))
+app.config['LOGIN_PERIOD'] = int(os.environ.get('LIBRARY_LOGIN_PERIOD', '60'))
+app.config['SCHEDULER_ENABLED'] = os.environ.get('LIBRARY_SCHEDULER', '1') == '1'
+app.config['SCHEDULER_INTERVAL'] = int(os.environ.get('LIBRARY_SCHEDULER_INTERVAL', '300'))
+# Index snapshots for fast startup; the default path is the database's
+# path plus '.snapshot'. An interval of 0 leaves snapshots to the CLI.
+app.config['SNAPSHOT_PATH'] = os.environ.get('LIBRARY_SNAPSHOT_PATH') or None
+app.config['SNAPSHOT_INTERVAL'] = int(os.environ.get('LIBRARY_SNAPSHOT_INTERVAL', '3600'))
+# Journal events kept behind the latest snapshot; older ones are pruned
+app.config['JOURNAL_RETAIN'] = int(os.environ.get('LIBRARY_JOURNAL_RETAIN', '1000000'))
+# Reports may lag writes by up to this many seconds, so busy periods do not
+# reload the loan columns on every view
+app.config['ANALYTICS_MAX_AGE'] = int(os.environ.get('LIBRARY_ANALYTICS_MAX_AGE', '60'))
+# Snapshot of the report columns; the default path is the database's path
+# plus '.analytics'
+app.config['ANALYTICS_PATH'] = os.environ.get('LIBRARY_ANALYTICS_PATH') or None
+# Background jobs (exports, statements, sweeps): their table and output
+# files live in JOBS_DIR. JOB_WORKERS processes run them; 0 means one per
+# core. Finished jobs and their files are removed after JOBS_RETAIN seconds.
+app.config['JOBS_DIR'] = os.environ.get('LIBRARY_JOBS_DIR', os.path.join(app.instance_path, 'jobs'))
+app.config['JOB_WORKERS'] = int(os.environ.get('LIBRARY_JOB_WORKERS', '0'))
+app.config['JOBS_RETAIN'] = int(os.environ.get('LIBRARY_JOBS_RETAIN', str(7 * 24 * 3600)))
+app.config['FINE_PER_DAY'] = int(os.environ.get('LIBRARY_FINE_PER_DAY', '5'))
+# 0 means fines are not capped
+app.config['FINE_MAX'] = int(os.environ.get('LIBRARY_FINE_MAX', '500')) or None
+app.config['REMINDER_DAYS'] = int(os.environ.get('LIBRARY_REMINDER_DAYS', '1'))
+app.config['OUTBOX_URL'] = os.environ.get(
+    'LIBRARY_OUTBOX_URL',
+    'jsonl:///' + os.path.join(app.instance_path, 'outbox.jsonl')
+)
+# Opt-in instrumentation, exposed on /metrics
+app.config['METRICS_ENABLED'] = os.environ.get('LIBRARY_METRICS', '0') == '1'
+# Opt-in cProfile of a sample of requests; profiles of slow ones are kept
+app.config['PROFILE_ENABLED'] = os.environ.get('LIBRARY_PROFILE', '0') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('LIBRARY_PROFILE_SAMPLE_RATE', '0.01'))
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('LIBRARY_PROFILE_SLOW_MS', '500'))
+app.config['PROFILE_DIR'] = os.environ.get(
+    'LIBRARY_PROFILE_DIR',
+    os.path.join(app.instance_path, 'profiles')
+)
+# The sample books are seeded into an empty store on first use; 0 starts empty
+app.config['SEED_SAMPLE_DATA'] = os.environ.get('LIBRARY_SEED_DATA', '1') == '1'
+# Compiled templates are cached here as bytecode, so a new worker loads
+# them instead of compiling each one on its first render. Set it to an
+# empty value to switch the cache off.
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get(
+    'LIBRARY_TEMPLATE_CACHE',
+    os.path.join(app.instance_path, 'template-cache')
+) or None
+
+_storage_lock = threading.Lock()
 
 # Sample books data
 SAMPLE_BOOKS = [
@@ -118,34 +252,470 @@ SAMPLE_BOOKS = [
     }
 ]
 
+# Storage
+def get_storage():
+    storage = app.extensions.get('library_storage')
+    if storage is None:
+        with _storage_lock:
+            storage = app.extensions.get('library_storage')
+            if storage is None:
+                storage = open_storage(app.config['STORAGE_URL'])
+                init_data(storage)
+                if app.config['STORAGE_INDEX']:
+                    snapshot_path = app.config['SNAPSHOT_PATH']
+                    if snapshot_path is None and getattr(storage, 'path', None):
+                        snapshot_path = storage.path + '.snapshot'
+                    storage = IndexedStorage(storage, snapshot_path)
+                if app.config['METRICS_ENABLED']:
+                    storage = TimedStorage(storage, record_storage_call)
+                app.extensions['library_storage'] = storage
+    return storage
+
+def get_cache():
+    cache = app.extensions.get('library_cache')
+    if cache is None:
+        with _storage_lock:
+            cache = app.extensions.get('library_cache')
+            if cache is None:
+                cache = ResponseCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_TTL'])
+                app.extensions['library_cache'] = cache
+    return cache
+
+def get_jobs():
+    runner = app.extensions.get('library_jobs')
+    if runner is None:
+        with _storage_lock:
+            runner = app.extensions.get('library_jobs')
+            if runner is None:
+                directory = app.config['JOBS_DIR']
+                table = jobs.JobTable(os.path.join(directory, 'jobs.db'))
+                table.fail_orphans()
+                runner = jobs.JobRunner(table, app.config['STORAGE_URL'], directory,
+                                   app.config['JOB_WORKERS'] or None)
+                app.extensions['library_jobs'] = runner
+    return runner
+
+# Analytics
+def analytics_path():
+    path = app.config['ANALYTICS_PATH']
+    if path is None:
+        storage = get_storage()
+        database = getattr(getattr(storage, 'backend', storage), 'path', None)
+        path = database + '.analytics' if database else None
+    return path
+
+def get_analytics():
+    # None without numpy; the reports are switched off then
+    if not analytics.available():
+        return None
+    columns = app.extensions.get('library_analytics')
+    if columns is None:
+        path, database_id = analytics_path(), get_storage().journal_id()
+        with _storage_lock:
+            columns = app.extensions.get('library_analytics')
+            if columns is None:
+                columns = analytics.LoanColumns()
+                if path:
+                    columns.restore(path, database_id)
+                app.extensions['library_analytics'] = columns
+    return columns
+
+def save_analytics(columns):
+    # Writes the report columns' snapshot when it is behind them
+    path = analytics_path()
+    if not path or columns.saved_after == columns.after:
+        return False
+    columns.save(path, get_storage().journal_id())
+    return True
+
+# Instrumentation
+def get_metrics():
+    metrics = app.extensions.get('library_metrics')
+    if metrics is None:
+        with _storage_lock:
+            metrics = app.extensions.get('library_metrics')
+            if metrics is None:
+                metrics = Metrics()
+                metrics.requests = metrics.counter(
+                    'library_requests_total', 'Requests by route and status.',
+                    ('endpoint', 'method', 'status'))
+                metrics.latency = metrics.histogram(
+                    'library_request_seconds', 'Request latency by route.', ('endpoint', 'method'))
+                metrics.templates = metrics.histogram(
+                    'library_template_render_seconds', 'render_template time by template.',
+                    ('template',))
+                metrics.storage = metrics.histogram(
+                    'library_storage_call_seconds', 'Storage call time by method.', ('method',))
+                metrics.request_storage = metrics.histogram(
+                    'library_request_storage_seconds', 'Storage time spent per request.',
+                    ('endpoint',))
+                metrics.response_size = metrics.histogram(
+                    'library_response_bytes', 'Response body size.', ('endpoint',), SIZE_BUCKETS)
+                metrics.session_size = metrics.histogram(
+                    'library_session_cookie_bytes', 'Serialized session cookie size.',
+                    ('endpoint',), SIZE_BUCKETS)
+                metrics.profiles = metrics.counter(
+                    'library_slow_request_profiles_total', 'Profiles saved for slow requests.',
+                    ('endpoint',))
+                metrics.gauge('library_cache_hits', 'Response cache hits.', lambda: get_cache().hits)
+                metrics.gauge('library_cache_misses', 'Response cache misses.',
+                              lambda: get_cache().misses)
+                app.extensions['library_metrics'] = metrics
+    return metrics
+
+def get_profiler():
+    profiler = app.extensions.get('library_profiler')
+    if profiler is None:
+        profiler = SlowRequestProfiler(app.config['PROFILE_DIR'], app.config['PROFILE_SAMPLE_RATE'],
+                                       app.config['PROFILE_SLOW_MS'] / 1000)
+        app.extensions['library_profiler'] = profiler
+    return profiler
+
+def endpoint_label():
+    # Route names, not paths, keep the number of series bounded
+    return request.endpoint or 'unmatched'
+
+def record_storage_call(method, seconds):
+    get_metrics().storage.observe(seconds, method)
+    if has_request_context() and 'storage_seconds' in g:
+        g.storage_seconds += seconds
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    if app.config['METRICS_ENABLED'] and has_request_context():
+        g.setdefault('template_starts', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    starts = g.get('template_starts') if has_request_context() else None
+    if starts:
+        get_metrics().templates.observe(time.perf_counter() - starts.pop(), template.name or '-')
+
+class MeasuredSessionInterface(SecureCookieSessionInterface):
+    # Records the size of the session cookie the response carries
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+        if not app.config['METRICS_ENABLED'] or not has_request_context():
+            return
+        prefix = self.get_cookie_name(app) + '='
+        for header in response.headers.getlist('Set-Cookie'):
+            if header.startswith(prefix):
+                size = len(header.split(';', 1)[0]) - len(prefix)
+                get_metrics().session_size.observe(size, endpoint_label())
+
+app.session_interface = MeasuredSessionInterface()
+
+@app.before_request
+def start_request_timer():
+    if app.config['METRICS_ENABLED'] or app.config['PROFILE_ENABLED']:
+        g.request_start = time.perf_counter()
+        g.storage_seconds = 0.0
+    if app.config['PROFILE_ENABLED']:
+        g.profiler = get_profiler().start()
+
+@app.after_request
+def record_request(response):
+    # Registered first, so it runs after every other after_request hook
+    if g.get('profiler') is not None:
+        seconds = time.perf_counter() - g.request_start
+        if get_profiler().stop(g.pop('profiler'), endpoint_label(), seconds):
+            get_metrics().profiles.inc(endpoint_label())
+    if app.config['METRICS_ENABLED'] and 'request_start' in g:
+        metrics = get_metrics()
+        endpoint = endpoint_label()
+        metrics.latency.observe(time.perf_counter() - g.request_start, endpoint, request.method)
+        metrics.requests.inc(endpoint, request.method, str(response.status_code))
+        metrics.request_storage.observe(g.storage_seconds, endpoint)
+        if not response.is_streamed:
+            metrics.response_size.observe(response.calculate_content_length() or 0, endpoint)
+    return response
+
+@app.teardown_request
+def stop_profiler(exc):
+    # A request that never reached after_request must not leave it running
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
+
+def get_hasher():
+    hasher = app.extensions.get('library_hasher')
+    if hasher is None:
+        hasher = PasswordHasher(app.config['PASSWORD_HASH'], scrypt_n=app.config['SCRYPT_N'],
+                                pbkdf2_iterations=app.config['PBKDF2_ITERATIONS'])
+        app.extensions['library_hasher'] = hasher
+    return hasher
+
+def admin_password_hash():
+    # Hashed on first use rather than at import
+    if app.config['ADMIN_PASSWORD_HASH'] is None:
+        app.config['ADMIN_PASSWORD_HASH'] = get_hasher().hash(app.config['ADMIN_PASSWORD'])
+    return app.config['ADMIN_PASSWORD_HASH']
+
+def get_login_limiters():
+    limiters = app.extensions.get('library_login_limiters')
+    if limiters is None:
+        with _storage_lock:
+            limiters = app.extensions.get('library_login_limiters')
+            if limiters is None:
+                limiters = (RateLimiter(app.config['LOGIN_ATTEMPTS'], app.config['LOGIN_PERIOD']),
+                            RateLimiter(app.config['LOGIN_IP_ATTEMPTS'], app.config['LOGIN_PERIOD']))
+                app.extensions['library_login_limiters'] = limiters
+    return limiters
+
+def take_login_attempt(username):
+    # Every attempt costs a token for the account and one for the client
+    # address, refunded on success, so only failures are limited. A spent
+    # bucket turns the attempt away before any password is hashed.
+    accounts, addresses = get_login_limiters()
+    if not addresses.take(request.remote_addr):
+        return False
+    if not accounts.take(username or ''):
+        addresses.give_back(request.remote_addr)
+        return False
+    return True
+
+def refund_login_attempt(username):
+    accounts, addresses = get_login_limiters()
+    accounts.give_back(username or '')
+    addresses.give_back(request.remote_addr)
+
+def run_overdue_sweep():
+    return sweep_overdue(get_storage(), fine_per_day=app.config['FINE_PER_DAY'],
+                         fine_max=app.config['FINE_MAX'],
+                         remind_days=app.config['REMINDER_DAYS'])
+
+def run_reminder_delivery():
+    return deliver_reminders(get_storage(), open_outbox(app.config['OUTBOX_URL']))
+
+def snapshot_is_fresh(path):
+    try:
+        return time.time() - os.path.getmtime(path) < app.config['SNAPSHOT_INTERVAL']
+    except OSError:
+        return False
+
+def run_snapshot(force=False):
+    # Snapshots the index and prunes the journal behind it, once per
+    # SNAPSHOT_INTERVAL across every worker: the snapshot file's age says
+    # when one is due, and its lock lets one worker write it while the
+    # others skip. Returns False when another process holds the lock.
+    storage = get_storage()
+    path = getattr(storage, 'snapshot_path', None)
+    if not path:
+        return None
+    if not force and (not app.config['SNAPSHOT_INTERVAL'] or snapshot_is_fresh(path)):
+        return None
+    with journal.snapshot_lock(path) as claimed:
+        if not claimed:
+            return False
+        # Another worker may have written it since the check above
+        if not force and snapshot_is_fresh(path):
+            return None
+        seq = storage.snapshot()
+        through = seq - app.config['JOURNAL_RETAIN']
+        return {'seq': seq, 'pruned': storage.prune_journal(through) if through > 0 else 0}
+
+def run_analytics_refresh():
+    # Keeps the report columns current between views, so a report rarely
+    # waits on a load, and their snapshot current for the next process.
+    # Workers that never served a report have none to keep.
+    columns = app.extensions.get('library_analytics')
+    if columns is None or columns.table is None:
+        return None
+    loans = len(columns.refresh(get_storage()))
+    return {'loans': loans, 'saved': save_analytics(columns)}
+
+def run_job_cleanup():
+    return {'pruned': get_jobs().prune(app.config['JOBS_RETAIN'])}
+
+def get_scheduler():
+    scheduler = app.extensions.get('library_scheduler')
+    if scheduler is None:
+        with _storage_lock:
+            scheduler = app.extensions.get('library_scheduler')
+            if scheduler is None:
+                scheduler = Scheduler(app.config['SCHEDULER_INTERVAL'])
+                scheduler.add('overdue', run_overdue_sweep)
+                scheduler.add('reminders', run_reminder_delivery)
+                scheduler.add('snapshot', run_snapshot)
+                scheduler.add('analytics', run_analytics_refresh)
+                scheduler.add('jobs', run_job_cleanup)
+                app.extensions['library_scheduler'] = scheduler
+    return scheduler
+
+@app.before_request
+def start_scheduler():
+    # Started on the first request so each worker process runs its own
+    # thread; the sweeps are idempotent, so concurrent workers are harmless
+    if request.endpoint in HEALTH_ENDPOINTS:
+        return
+    if app.config['SCHEDULER_ENABLED'] and not get_scheduler().running:
+        get_scheduler().start()
+
+# Probes answer without touching the request pipeline
+HEALTH_ENDPOINTS = ('healthz', 'readyz')
+
+@app.before_request
+def refresh_storage():
+    # Pick up writes made by other worker processes
+    if request.endpoint in HEALTH_ENDPOINTS:
+        return
+    storage = get_storage()
+    refresh = getattr(storage, 'refresh', None)
+    if refresh is not None:
+        refresh()
+    if app.config['CACHE_ENABLED']:
+        get_cache().sync(storage.generations())
+
 # Initialize data
-def init_data():
-    if 'books' not in session:
-        session['books'] = SAMPLE_BOOKS
-    if 'students' not in session:
-        session['students'] = []
-    if 'issued_books' not in session:
-        session['issued_books'] = []
+def init_data(storage):
+    # Sample books are seeded once into the shared store, and only into an
+    # empty one. get_storage() runs this on the backend before the index
+    # loads, so nothing later pays for it.
+    if not app.config['SEED_SAMPLE_DATA'] or storage.get_meta('seeded') is not None:
+        return
+    with storage.transaction():
+        if storage.get_meta('seeded') is None:
+            if not storage.count_books():
+                storage.seed_books(SAMPLE_BOOKS)
+            storage.set_meta('seeded', '1')
 
 # Helper functions
 def get_book_by_id(book_id):
-    for book in session['books']:
-        if book['id'] == book_id:
-            return book
-    return None
+    return get_storage().get_book(book_id)
 
 def get_student_by_id(student_id):
-    for student in session['students']:
-        if student['id'] == student_id:
-            return student
-    return None
+    return get_storage().get_student(student_id)
 
 def get_available_books():
-    issued_book_ids = [issue['bookId'] for issue in session['issued_books']]
-    return [book for book in session['books'] if book['id'] not in issued_book_ids]
+    return get_storage().available_books()
+
+def is_book_available(book_id):
+    return get_storage().is_book_available(book_id)
+
+def book_items(storage, books):
+    # JSON view of books with their copy counts
+    stock = storage.book_inventory([book['id'] for book in books])
+    return [dict(book, available=stock[book['id']]['available'] > 0, copies=stock[book['id']])
+            for book in books]
 
 def get_student_issued_books(student_id):
-    return [issue for issue in session['issued_books'] if issue['studentId'] == student_id]
+    return get_storage().issues_for_student(student_id)
+
+def api_branch(args):
+    # ?branch= for the JSON API: the branch id, or None for every branch
+    branch_id = args.get('branch', '').strip()
+    if branch_id and get_storage().get_branch(branch_id) is None:
+        raise ValueError(f'Unknown branch: {branch_id}')
+    return branch_id or None
+
+def book_listing_args(args):
+    sort = args.get('sort', 'title')
+    availability = args.get('availability', '')
+    return {
+        'sort': sort if sort in BOOK_SORTS else 'title',
+        'descending': args.get('order') == 'desc',
+        'filters': {
+            'title': args.get('title', '').strip(),
+            'author': args.get('author', '').strip(),
+            'genre': args.get('genre', '').strip(),
+            'availability': availability if availability in AVAILABILITY_FILTERS else '',
+            'branch': args.get('branch', '').strip(),
+        },
+        'after': args.get('after') or None,
+        'before': args.get('before') or None,
+        'limit': page_size(args.get('limit')),
+    }
+
+# Batch API: ?ids=a,b,c (or repeated ids=) and ?fields=id,title
+API_MAX_IDS = 500
+BOOK_API_FIELDS = BOOK_FIELDS + ('available', 'copies')
+STUDENT_API_FIELDS = tuple(field for field in STUDENT_FIELDS if field != 'password')
+
+def api_list_arg(args, name):
+    # Comma-separated and repeated values, deduplicated in order; None when absent
+    values = args.getlist(name)
+    if not values:
+        return None
+    return list(dict.fromkeys(part.strip() for value in values
+                              for part in value.split(',') if part.strip()))
+
+def api_ids(args, name='ids'):
+    ids = api_list_arg(args, name)
+    if ids is not None and len(ids) > API_MAX_IDS:
+        raise ValueError(f'At most {API_MAX_IDS} ids per request')
+    return ids
+
+def api_fields(args, allowed):
+    fields = api_list_arg(args, 'fields')
+    if fields:
+        unknown = [field for field in fields if field not in allowed]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    return fields or None
+
+def select_fields(items, fields):
+    if fields is None:
+        return items
+    return [{field: item.get(field) for field in fields} for item in items]
+
+def student_items(students):
+    return [{key: value for key, value in student.items() if key != 'password'}
+            for student in students]
+
+def batch_result(ids, found, fields):
+    # found maps id -> item; items come back in the order they were asked for
+    return {
+        'items': select_fields([found[item_id] for item_id in ids if item_id in found], fields),
+        'missing': [item_id for item_id in ids if item_id not in found],
+    }
+
+def issue_matches(issue, status, today):
+    # The status filter page_issues applies in SQL
+    if status == 'requested':
+        return issue['status'] == 'requested'
+    if status == 'issued':
+        return issue['status'] in ('issued', 'overdue')
+    if status == 'overdue':
+        return issue['status'] == 'overdue' or (issue['status'] == 'issued'
+                                                and issue['returnDate'] < today)
+    return True
+
+UNKNOWN_BOOK = {'title': 'Unknown Book', 'author': 'Unknown Author'}
+UNKNOWN_STUDENT = {'name': 'Unknown Student', 'rollNo': 'N/A'}
+
+IssueRow = namedtuple('IssueRow', 'id bookId studentId issueDate returnDate status fine book student')
+
+def issue_rows(issues):
+    # One batched lookup each for the referenced books and students
+    storage = get_storage()
+    books = storage.get_books(issue['bookId'] for issue in issues)
+    students = storage.get_students(issue['studentId'] for issue in issues)
+    return [
+        IssueRow(
+            issue['id'], issue['bookId'], issue['studentId'],
+            issue['issueDate'], issue['returnDate'], issue['status'], issue.get('fine'),
+            books.get(issue['bookId'], UNKNOWN_BOOK),
+            students.get(issue['studentId'], UNKNOWN_STUDENT)
+        )
+        for issue in issues
+    ]
+
+def student_row(student, counts):
+    return {
+        'id': student['id'],
+        'name': student['name'],
+        'username': student['username'],
+        'rollNo': student['rollNo'],
+        'issued_count': counts['issues'],
+        'has_requests': counts['requests'] > 0,
+    }
 
 def is_admin():
     return session.get('user_role') == 'admin'
@@ -170,10 +740,89 @@ def admin_required(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def branch_scoped(f):
+    # For pages also routed under /branches/<branch_id>/: the view gets the
+    # branch row, or None on the library-wide route
+    def decorated_function(*args, branch_id=None, **kwargs):
+        branch = None
+        if branch_id is not None:
+            branch = get_storage().get_branch(branch_id)
+            if branch is None:
+                flash('Branch not found.', 'error')
+                return redirect(url_for(f.__name__))
+        return f(*args, branch=branch, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+@app.context_processor
+def branch_context():
+    # The sidebar's branch switcher; branch_id is the branch the current
+    # page is scoped to, if any
+    if 'user_id' not in session:
+        return {}
+    return {'branches': get_storage().branches(),
+            'branch_id': (request.view_args or {}).get('branch_id')}
+
+def api_login_required(f):
+    # For JSON endpoints: 401 instead of the redirect pages get
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Login required'}), 401
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+def cached(*tags, per_user=True):
+    # Serves GET responses from the response cache. Entries are keyed by
+    # endpoint, role, user (for pages showing per-user data) and the full
+    # query string, and dropped when any of the tagged collections change.
+    # Pages are not cached while flash messages are pending, since the
+    # layout renders them into the body.
+    def decorator(f):
+        def decorated_function(*args, **kwargs):
+            cache = get_cache()
+            cacheable = (app.config['CACHE_ENABLED'] and request.method == 'GET'
+                         and not (per_user and '_flashes' in session))
+            key = (request.endpoint, session.get('user_role'),
+                   session.get('user_id') if per_user else None, request.full_path)
+            entry = cache.get(key) if cacheable else None
+            if entry is None:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                generations = get_storage().generations()
+                modified = max(generations[tag][1] for tag in tags)
+                body = response.get_data()
+                entry = cache.entry(body, response.status_code, response.mimetype,
+                                    hashlib.sha1(body).hexdigest(),
+                                    datetime.fromtimestamp(modified, timezone.utc) if modified else None,
+                                    tags)
+                if cacheable:
+                    cache.set(key, entry)
+            response = Response(entry.body, entry.status, mimetype=entry.mimetype)
+            response.set_etag(entry.etag)
+            if entry.last_modified is not None:
+                response.last_modified = entry.last_modified
+            return response.make_conditional(request)
+        decorated_function.__name__ = f.__name__
+        return decorated_function
+    return decorator
+
+def invalidates(*tags):
+    # Drops cached responses built from these collections after a write
+    def decorator(f):
+        def decorated_function(*args, **kwargs):
+            response = f(*args, **kwargs)
+            if request.method == 'POST':
+                get_cache().invalidate(*tags)
+            return response
+        decorated_function.__name__ = f.__name__
+        return decorated_function
+    return decorator
+
 # Routes
 @app.route('/')
 def index():
-    init_data()
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
     return render_template('index.html')
@@ -184,18 +833,28 @@ def admin_login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        if username == 'admin' and password == '123':
+        if not take_login_attempt(username):
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('login/admin.html'), 429
+        
+        hasher = get_hasher()
+        if username != app.config['ADMIN_USERNAME']:
+            # As slow as a wrong password, so timing does not give away the username
+            hasher.verify_dummy(password)
+        elif hasher.verify(password, admin_password_hash()):
+            refund_login_attempt(username)
             session['user_id'] = 'admin'
             session['user_name'] = 'Admin'
             session['user_role'] = 'admin'
             flash('Welcome back, Admin!', 'success')
             return redirect(url_for('dashboard'))
-        else:
-            flash('Invalid credentials. Please try again.', 'error')
+        
+        flash('Invalid credentials. Please try again.', 'error')
     
     return render_template('login/admin.html')
 
 @app.route('/login/student', methods=['GET', 'POST'])
+@invalidates('students')
 def student_login():
     if request.method == 'POST':
         action = request.form.get('action')
@@ -204,24 +863,39 @@ def student_login():
             username = request.form.get('username')
             password = request.form.get('password')
             
-            for student in session['students']:
-                if student['username'] == username and student['password'] == password:
-                    session['user_id'] = student['id']
-                    session['user_name'] = student['name']
-                    session['user_role'] = 'student'
-                    flash(f'Welcome back, {student["name"]}!', 'success')
-                    return redirect(url_for('dashboard'))
+            if not take_login_attempt(username):
+                flash('Too many login attempts. Please wait a minute and try again.', 'error')
+                return render_template('login/student.html'), 429
+            
+            hasher = get_hasher()
+            student = get_storage().find_student_by_username(username)
+            if student is None:
+                hasher.verify_dummy(password)
+            elif hasher.verify(password, student['password']):
+                refund_login_attempt(username)
+                if hasher.needs_rehash(student['password']):
+                    # Plaintext or an older cost setting
+                    get_storage().update_student(dict(student, password=hasher.hash(password)))
+                session['user_id'] = student['id']
+                session['user_name'] = student['name']
+                session['user_role'] = 'student'
+                flash(f'Welcome back, {student["name"]}!', 'success')
+                return redirect(url_for('dashboard'))
             
             flash('Invalid credentials. Please try again.', 'error')
         
         elif action == 'register':
-            name = request.form.get('name')
-            username = request.form.get('username')
+            name = (request.form.get('name') or '').strip()
+            username = (request.form.get('username') or '').strip()
             password = request.form.get('password')
             roll_no = request.form.get('roll_no')
             
+            if not name or not username or not password:
+                flash('Name, username and password are required.', 'error')
+                return redirect(url_for('student_login'))
+            
             # Check if username already exists
-            if any(s['username'] == username for s in session['students']):
+            if get_storage().find_student_by_username(username):
                 flash('Username already exists. Please choose another.', 'error')
                 return redirect(url_for('student_login'))
             
@@ -229,13 +903,11 @@ def student_login():
                 'id': f'student-{uuid.uuid4()}',
                 'name': name,
                 'username': username,
-                'password': password,
+                'password': get_hasher().hash(password),
                 'rollNo': roll_no
             }
             
-            students = session['students']
-            students.append(new_student)
-            session['students'] = students
+            get_storage().add_student(new_student)
             
             flash('Registration successful! You can now login.', 'success')
             return redirect(url_for('student_login'))
@@ -251,28 +923,42 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
+@app.route('/branches/<branch_id>/dashboard')
 @login_required
-def dashboard():
+@branch_scoped
+@cached('books', 'students', 'issues')
+def dashboard(branch=None):
     user = {
         'id': session.get('user_id'),
         'name': session.get('user_name'),
         'role': session.get('user_role')
     }
     
-    total_books = len(session['books'])
-    total_students = len(session['students'])
-    total_issued = len(session['issued_books'])
+    storage = get_storage()
+    totals = storage.counters()
+    total_students = totals['students']
+    if branch is not None:
+        total_books = storage.count_books(branch['id'])
+        total_issued = storage.count_issues(branch['id'])
+    else:
+        total_books = totals['books']
+        total_issued = totals['issues']
     
     if is_student():
-        user_issued = len(get_student_issued_books(user['id']))
+        if branch is not None:
+            user_issued = sum(1 for issue in storage.issues_for_student(user['id'])
+                              if issue['branch'] == branch['id'])
+        else:
+            user_issued = storage.student_counters([user['id']])[user['id']]['issues']
     else:
         user_issued = total_issued
     
-    available_books = total_books - total_issued
+    available_books = storage.count_available_books(branch['id'] if branch else None)
     
     return render_template(
         'dashboard/index.html',
         user=user,
+        branch=branch,
         total_books=total_books,
         total_students=total_students,
         total_issued=total_issued,
@@ -281,37 +967,80 @@ def dashboard():
     )
 
 @app.route('/dashboard/books')
+@app.route('/branches/<branch_id>/books')
 @login_required
-def books():
+@branch_scoped
+@cached('books', 'issues')
+def books(branch=None):
     user = {
         'id': session.get('user_id'),
         'name': session.get('user_name'),
         'role': session.get('user_role')
     }
     
-    books_list = session['books']
-    issued_book_ids = [issue['bookId'] for issue in session['issued_books']]
+    storage = get_storage()
+    listing = book_listing_args(request.args)
+    if branch is not None:
+        listing['filters']['branch'] = branch['id']
+    query = request.args.get('q', '').strip()
+    try:
+        if query:
+            # Ranked search results come back as a single page; the
+            # library-wide page searches every branch
+            page = Page(storage.search_books(query, listing['limit'],
+                                             listing['filters']['branch'] or None))
+        else:
+            page = storage.page_books(**listing)
+    except ValueError:
+        flash('Invalid page link. Showing the first page.', 'error')
+        return redirect(url_for('books', branch_id=branch['id'] if branch else None))
+    
+    # Query parameters to carry over into the pagination links
+    page_args = {key: value for key, value in request.args.items()
+                 if key not in ('after', 'before') and value}
+    if branch is not None:
+        page_args['branch_id'] = branch['id']
     
     return render_template(
         'dashboard/books.html',
         user=user,
-        books=books_list,
-        issued_book_ids=issued_book_ids
+        branch=branch,
+        books=page.items,
+        page=page,
+        page_args=page_args,
+        query=query,
+        filters=listing['filters'],
+        sort=listing['sort'],
+        order='desc' if listing['descending'] else 'asc',
+        genres=storage.book_genres(),
+        inventory=storage.book_inventory([book['id'] for book in page.items]),
+        today=datetime.now().strftime('%Y-%m-%d')
     )
 
 @app.route('/dashboard/books/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
+@invalidates('books')
 def add_book():
     if request.method == 'POST':
         title = request.form.get('title')
         author = request.form.get('author')
         isbn = request.form.get('isbn')
         genre = request.form.get('genre')
+        branch_id = request.form.get('branch') or DEFAULT_BRANCH
+        copies = request.form.get('copies', 1, type=int)
         
-        # Check if ISBN already exists
-        if any(book['isbn'] == isbn for book in session['books']):
-            flash('A book with this ISBN already exists.', 'error')
+        if copies is None or copies < 1:
+            flash('A book needs at least one copy.', 'error')
+            return redirect(url_for('add_book'))
+        
+        if get_storage().get_branch(branch_id) is None:
+            flash('Branch not found.', 'error')
+            return redirect(url_for('add_book'))
+        
+        # Check if ISBN already exists at this branch
+        if get_storage().find_book_by_isbn(isbn, branch_id):
+            flash('A book with this ISBN already exists at this branch.', 'error')
             return redirect(url_for('add_book'))
         
         new_book = {
@@ -319,12 +1048,14 @@ def add_book():
             'title': title,
             'author': author,
             'isbn': isbn,
-            'genre': genre
+            'genre': genre,
+            'branch': branch_id
         }
         
-        books = session['books']
-        books.append(new_book)
-        session['books'] = books
+        storage = get_storage()
+        with storage.transaction():
+            storage.add_book(new_book)
+            storage.add_copies(new_book['id'], copies - 1)
         
         flash('Book added successfully!', 'success')
         return redirect(url_for('books'))
@@ -341,6 +1072,7 @@ def add_book():
 @app.route('/dashboard/books/edit/<book_id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
+@invalidates('books', 'issues')
 def edit_book(book_id):
     book = get_book_by_id(book_id)
     
@@ -348,30 +1080,43 @@ def edit_book(book_id):
         flash('Book not found.', 'error')
         return redirect(url_for('books'))
     
+    stock = get_storage().book_inventory([book_id])[book_id]
+    
     if request.method == 'POST':
         title = request.form.get('title')
         author = request.form.get('author')
         isbn = request.form.get('isbn')
         genre = request.form.get('genre')
+        copies = request.form.get('copies', stock['total'], type=int)
+        
+        if copies is None or copies < 1:
+            flash('A book needs at least one copy.', 'error')
+            return redirect(url_for('edit_book', book_id=book_id))
         
-        # Check if ISBN already exists and is not the current book
-        if any(b['isbn'] == isbn and b['id'] != book_id for b in session['books']):
-            flash('A book with this ISBN already exists.', 'error')
+        # Check if ISBN already exists at this branch and is not the current book
+        existing = get_storage().find_book_by_isbn(isbn, book['branch'])
+        if existing and existing['id'] != book_id:
+            flash('A book with this ISBN already exists at this branch.', 'error')
             return redirect(url_for('edit_book', book_id=book_id))
         
-        books = session['books']
-        for i, b in enumerate(books):
-            if b['id'] == book_id:
-                books[i] = {
-                    'id': book_id,
-                    'title': title,
-                    'author': author,
-                    'isbn': isbn,
-                    'genre': genre
-                }
-                break
+        storage = get_storage()
+        with storage.transaction():
+            # Read again under the write lock; a loan may have gone out since
+            stock = storage.book_inventory([book_id])[book_id]
+            storage.update_book({
+                'id': book_id,
+                'title': title,
+                'author': author,
+                'isbn': isbn,
+                'genre': genre
+            })
+            if copies > stock['total']:
+                storage.add_copies(book_id, copies - stock['total'])
+            elif copies < stock['total']:
+                kept = stock['total'] - storage.remove_copies(book_id, stock['total'] - copies)
+                if kept > copies:
+                    flash(f'Kept {kept} copies: copies on loan or set aside cannot be removed.', 'error')
         
-        session['books'] = books
         flash('Book updated successfully!', 'success')
         return redirect(url_for('books'))
     
@@ -382,32 +1127,62 @@ def edit_book(book_id):
             'name': session.get('user_name'),
             'role': session.get('user_role')
         },
-        book=book
+        book=book,
+        stock=stock
     )
 
-@app.route('/dashboard/books/delete/<book_id>', methods=['POST'])
+@app.route('/dashboard/books/<book_id>/transfer', methods=['POST'])
 @login_required
 @admin_required
-def delete_book(book_id):
-    # Check if book is issued
-    if any(issue['bookId'] == book_id for issue in session['issued_books']):
-        flash('Cannot delete book. It is currently issued to a student.', 'error')
+@invalidates('books', 'issues')
+def transfer_book(book_id):
+    branch_id = request.form.get('branch')
+    count = request.form.get('copies', 1, type=int)
+    if count is None or count < 1:
+        flash('Transfer at least one copy.', 'error')
+        return redirect(url_for('edit_book', book_id=book_id))
+    
+    result = get_storage().transfer_copies(book_id, branch_id, count)
+    if result is None:
+        flash('Book or branch not found.', 'error')
         return redirect(url_for('books'))
     
-    books = session['books']
-    books = [book for book in books if book['id'] != book_id]
-    session['books'] = books
+    target_id, moved = result
+    if moved < count:
+        flash(f'Moved {moved} of {count} copies: copies on loan or set aside stay here.', 'error')
+    else:
+        flash(f'Moved {moved} copies.', 'success')
+    return redirect(url_for('edit_book', book_id=book_id))
+
+@app.route('/dashboard/books/delete/<book_id>', methods=['POST'])
+@login_required
+@admin_required
+@invalidates('books', 'issues')
+def delete_book(book_id):
+    storage = get_storage()
+    with storage.transaction():
+        # Check if any copy is issued or set aside for a request, or if
+        # students are queued for one; deleting would drop their holds
+        stock = storage.book_inventory([book_id])[book_id]
+        if stock['available'] < stock['total']:
+            flash('Cannot delete book. It is currently issued to a student.', 'error')
+            return redirect(url_for('books'))
+        if stock['queued'] > 0:
+            flash('Cannot delete book. Students are waiting in its hold queue.', 'error')
+            return redirect(url_for('books'))
+        storage.delete_book(book_id)
     
     flash('Book deleted successfully!', 'success')
     return redirect(url_for('books'))
 
 @app.route('/dashboard/issue-book', methods=['GET', 'POST'])
+@app.route('/branches/<branch_id>/issue-book', methods=['GET', 'POST'])
 @login_required
 @admin_required
-def issue_book():
-    available_books = get_available_books()
-    students_list = session['students']
-    
+@branch_scoped
+@invalidates('issues')
+def issue_book(branch=None):
+    here = url_for('issue_book', branch_id=branch['id'] if branch else None)
     if request.method == 'POST':
         book_id = request.form.get('book')
         student_id = request.form.get('student')
@@ -415,12 +1190,14 @@ def issue_book():
         
         if not book_id or not student_id or not issue_date_str:
             flash('Please select both a book and a student.', 'error')
-            return redirect(url_for('issue_book'))
+            return redirect(here)
         
-        # Parse issue date
-        issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
-        # Calculate return date (7 days later)
-        return_date = (datetime.strptime(issue_date_str, '%Y-%m-%d') + timedelta(days=7)).strftime('%Y-%m-%d')
+        # Return date is 7 days later
+        dates = loan_dates(issue_date_str)
+        if dates is None:
+            flash('Invalid issue date.', 'error')
+            return redirect(here)
+        issue_date, return_date = dates
         
         new_issue = {
             'id': f'issue-{uuid.uuid4()}',
@@ -431,12 +1208,18 @@ def issue_book():
             'status': 'issued'
         }
         
-        issued_books = session['issued_books']
-        issued_books.append(new_issue)
-        session['issued_books'] = issued_books
+        book = get_book_by_id(book_id)
+        if not book or not get_student_by_id(student_id) or (branch and book['branch'] != branch['id']):
+            flash('Book or student not found.', 'error')
+            return redirect(here)
+        
+        # Atomic check-and-insert: fails if another desk got the last copy
+        if not get_storage().reserve_book(new_issue):
+            flash('No copy of this book is available.', 'error')
+            return redirect(here)
         
         flash('Book issued successfully!', 'success')
-        return redirect(url_for('issued_books'))
+        return redirect(url_for('issued_books', branch_id=branch['id'] if branch else None))
     
     return render_template(
         'dashboard/issue_book.html',
@@ -445,12 +1228,14 @@ def issue_book():
             'name': session.get('user_name'),
             'role': session.get('user_role')
         },
-        books=available_books,
-        students=students_list
+        branch=branch,
+        books=get_storage().available_books(branch['id'] if branch else None),
+        students=get_storage().all_students()
     )
 
 @app.route('/dashboard/request-book', methods=['GET', 'POST'])
 @login_required
+@invalidates('issues')
 def request_book():
     if not is_student():
         return redirect(url_for('issue_book'))
@@ -465,10 +1250,12 @@ def request_book():
             flash('Please select a book.', 'error')
             return redirect(url_for('request_book'))
         
-        # Parse issue date
-        issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d').strftime('%Y-%m-%d')
-        # Calculate return date (7 days later)
-        return_date = (datetime.strptime(issue_date_str, '%Y-%m-%d') + timedelta(days=7)).strftime('%Y-%m-%d')
+        # Return date is 7 days later
+        dates = loan_dates(issue_date_str)
+        if dates is None:
+            flash('Invalid issue date.', 'error')
+            return redirect(url_for('request_book'))
+        issue_date, return_date = dates
         
         new_request = {
             'id': f'request-{uuid.uuid4()}',
@@ -479,11 +1266,23 @@ def request_book():
             'status': 'requested'
         }
         
-        issued_books = session['issued_books']
-        issued_books.append(new_request)
-        session['issued_books'] = issued_books
+        if not get_book_by_id(book_id):
+            flash('Book not found.', 'error')
+            return redirect(url_for('request_book'))
         
-        flash('Book request submitted successfully!', 'success')
+        # Takes a free copy if there is one, otherwise joins the hold queue
+        outcome = get_storage().request_book(new_request)
+        if outcome is None:
+            flash('You have already requested or borrowed this book.', 'error')
+            return redirect(url_for('request_book'))
+        if outcome == 'unavailable':
+            flash('This book has no copies to lend.', 'error')
+            return redirect(url_for('request_book'))
+        
+        if outcome == 'queued':
+            flash('All copies are on loan. You have been added to the hold queue.', 'success')
+        else:
+            flash('Book request submitted successfully!', 'success')
         return redirect(url_for('issued_books'))
     
     return render_template(
@@ -497,77 +1296,192 @@ def request_book():
     )
 
 @app.route('/dashboard/issued-books')
+@app.route('/branches/<branch_id>/issued-books')
 @login_required
-def issued_books():
+@branch_scoped
+def issued_books(branch=None):
     user = {
         'id': session.get('user_id'),
         'name': session.get('user_name'),
         'role': session.get('user_role')
     }
     
-    if is_student():
-        issues = get_student_issued_books(user['id'])
-    else:
-        issues = session['issued_books']
+    today = datetime.now().strftime('%Y-%m-%d')
+    status = request.args.get('status', '')
+    if status not in ISSUE_STATUS_FILTERS:
+        status = ''
     
-    # Add book and student details to each issue
-    for issue in issues:
-        book = get_book_by_id(issue['bookId'])
-        student = get_student_by_id(issue['studentId'])
-        
-        if book:
-            issue['book'] = book
-        else:
-            issue['book'] = {'title': 'Unknown Book', 'author': 'Unknown Author'}
-        
-        if student:
-            issue['student'] = student
-        else:
-            issue['student'] = {'name': 'Unknown Student', 'rollNo': 'N/A'}
+    try:
+        page = get_storage().page_issues(
+            student_id=user['id'] if is_student() else None,
+            status=status or None,
+            today=today,
+            after=request.args.get('after') or None,
+            before=request.args.get('before') or None,
+            limit=page_size(request.args.get('limit')),
+            branch=branch['id'] if branch else None
+        )
+    except ValueError:
+        flash('Invalid page link. Showing the first page.', 'error')
+        return redirect(url_for('issued_books', branch_id=branch['id'] if branch else None))
+    
+    page_args = {key: value for key, value in request.args.items()
+                 if key not in ('after', 'before') and value}
+    if branch is not None:
+        page_args['branch_id'] = branch['id']
+    
+    holds = []
+    if is_student():
+        holds = get_storage().holds_for_student(user['id'])
+        books_by_id = get_storage().get_books(hold['bookId'] for hold in holds)
+        holds = [dict(hold, book=books_by_id.get(hold['bookId'], UNKNOWN_BOOK)) for hold in holds]
     
     return render_template(
         'dashboard/issued_books.html',
         user=user,
-        issues=issues,
-        today=datetime.now().strftime('%Y-%m-%d')
+        branch=branch,
+        issues=issue_rows(page.items),
+        page=page,
+        page_args=page_args,
+        status=status,
+        today=today,
+        holds=holds
     )
 
 @app.route('/dashboard/return-book/<issue_id>', methods=['POST'])
 @login_required
+@invalidates('issues')
 def return_book(issue_id):
-    issued_books = session['issued_books']
-    issued_books = [issue for issue in issued_books if issue['id'] != issue_id]
-    session['issued_books'] = issued_books
+    storage = get_storage()
+    issue = storage.get_issue(issue_id)
+    if issue and is_student() and issue['studentId'] != session.get('user_id'):
+        flash('Loan not found.', 'error')
+        return redirect(url_for('issued_books'))
+    if not issue or not storage.delete_issue(issue_id):
+        flash('This book has already been returned.', 'error')
+        return redirect(url_for('issued_books'))
     
     flash('Book returned successfully!', 'success')
     return redirect(url_for('issued_books'))
 
+@app.route('/dashboard/cancel-hold/<hold_id>', methods=['POST'])
+@login_required
+@invalidates('issues')
+def cancel_hold(hold_id):
+    hold = get_storage().get_hold(hold_id)
+    if not hold or (is_student() and hold['studentId'] != session.get('user_id')):
+        flash('Hold not found.', 'error')
+        return redirect(url_for('issued_books'))
+    
+    get_storage().delete_hold(hold_id)
+    
+    flash('You have left the hold queue.', 'success')
+    return redirect(url_for('issued_books'))
+
 @app.route('/dashboard/approve-request/<request_id>', methods=['POST'])
 @login_required
 @admin_required
+@invalidates('issues')
 def approve_request(request_id):
-    issued_books = session['issued_books']
-    
-    for i, issue in enumerate(issued_books):
-        if issue['id'] == request_id:
-            issued_books[i]['status'] = 'issued'
-            break
+    # Only a pending request is approved; an issued or overdue loan is left alone
+    storage = get_storage()
+    if not storage.approve_requests([request_id])[0]:
+        if storage.get_issue(request_id) is None:
+            flash('Request not found.', 'error')
+        else:
+            flash('This request has already been handled.', 'error')
+        return redirect(url_for('issued_books'))
     
-    session['issued_books'] = issued_books
     flash('Book request approved!', 'success')
     return redirect(url_for('issued_books'))
 
+REPORT_NAMES = ('mostBorrowed', 'genreWeeks', 'loanDuration', 'mostOverdue')
+REPORT_MAX_LIMIT = 100
+REPORT_MAX_WEEKS = 104
+
+def report_params(args):
+    # (since, until, limit, weeks) from the query string; ValueError when invalid
+    since, until = (date.fromisoformat(args[name]) if args.get(name) else None
+                    for name in ('since', 'until'))
+    limit = int(args.get('limit') or 10)
+    weeks = int(args.get('weeks') or 12)
+    if not 0 < limit <= REPORT_MAX_LIMIT or not 0 < weeks <= REPORT_MAX_WEEKS:
+        raise ValueError('limit or weeks out of range')
+    return since, until, limit, weeks
+
+def build_reports(table, names, since=None, until=None, limit=10, weeks=12):
+    storage = get_storage()
+    result = {'asOf': datetime.fromtimestamp(table.as_of, timezone.utc).isoformat(),
+              'loans': len(table)}
+    if 'mostBorrowed' in names:
+        items = analytics.most_borrowed(table, limit, since, until)
+        books = storage.get_books(item['bookId'] for item in items)
+        for item in items:
+            book = books.get(item['bookId'], UNKNOWN_BOOK)
+            item['title'], item['author'] = book['title'], book['author']
+        result['mostBorrowed'] = items
+    if 'genreWeeks' in names:
+        result['genreWeeks'] = analytics.loans_per_genre_per_week(table, weeks, until)
+    if 'loanDuration' in names:
+        result['loanDuration'] = analytics.loan_duration(table, since, until)
+    if 'mostOverdue' in names:
+        items = analytics.most_overdue(table, limit, since, until)
+        students = storage.get_students(item['studentId'] for item in items)
+        for item in items:
+            student = students.get(item['studentId'], UNKNOWN_STUDENT)
+            item['name'], item['rollNo'] = student['name'], student['rollNo']
+        result['mostOverdue'] = items
+    return result
+
+def loan_table():
+    columns = get_analytics()
+    if columns is None:
+        return None
+    return columns.refresh(get_storage(), app.config['ANALYTICS_MAX_AGE'])
+
+@app.route('/dashboard/reports')
+@login_required
+@admin_required
+@cached('books', 'issues')
+def reports():
+    try:
+        since, until, limit, weeks = report_params(request.args)
+    except ValueError:
+        flash('Invalid report filters. Showing all loans.', 'error')
+        return redirect(url_for('reports'))
+    table = loan_table()
+    return render_template(
+        'dashboard/reports.html',
+        reports=build_reports(table, REPORT_NAMES, since, until, limit, weeks) if table else None,
+        since=since,
+        until=until,
+        limit=limit,
+        weeks=weeks
+    )
+
 @app.route('/dashboard/users')
 @login_required
 @admin_required
 def users():
-    students_list = session['students']
+    storage = get_storage()
+    query = request.args.get('q', '').strip()
+    try:
+        page = storage.page_students(
+            query=query or None,
+            after=request.args.get('after') or None,
+            before=request.args.get('before') or None,
+            limit=page_size(request.args.get('limit'))
+        )
+    except ValueError:
+        flash('Invalid page link. Showing the first page.', 'error')
+        return redirect(url_for('users'))
     
-    # Add issued books count to each student
-    for student in students_list:
-        student_issues = get_student_issued_books(student['id'])
-        student['issued_count'] = len(student_issues)
-        student['has_requests'] = any(issue['status'] == 'requested' for issue in student_issues)
+    # Issued counts come from the maintained per-student counters, one
+    # batched lookup for the page; rows are view models, not stored records
+    student_counts = storage.student_counters([student['id'] for student in page.items])
+    students_list = [student_row(student, student_counts[student['id']]) for student in page.items]
+    page_args = {key: value for key, value in request.args.items()
+                 if key not in ('after', 'before') and value}
     
     return render_template(
         'dashboard/users.html',
@@ -576,12 +1490,16 @@ def users():
             'name': session.get('user_name'),
             'role': session.get('user_role')
         },
-        students=students_list
+        students=students_list,
+        page=page,
+        page_args=page_args,
+        query=query
     )
 
 @app.route('/dashboard/users/edit/<student_id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
+@invalidates('students')
 def edit_user(student_id):
     student = get_student_by_id(student_id)
     
@@ -596,23 +1514,20 @@ def edit_user(student_id):
         password = request.form.get('password')
         
         # Check if username already exists and is not the current student
-        if any(s['username'] == username and s['id'] != student_id for s in session['students']):
+        existing = get_storage().find_student_by_username(username)
+        if existing and existing['id'] != student_id:
             flash('Username already exists. Please choose another.', 'error')
             return redirect(url_for('edit_user', student_id=student_id))
         
-        students = session['students']
-        for i, s in enumerate(students):
-            if s['id'] == student_id:
-                students[i] = {
-                    'id': student_id,
-                    'name': name,
-                    'username': username,
-                    'rollNo': roll_no,
-                    'password': password
-                }
-                break
+        get_storage().update_student({
+            'id': student_id,
+            'name': name,
+            'username': username,
+            'rollNo': roll_no,
+            # Left blank, the current password is kept
+            'password': get_hasher().hash(password) if password else student['password']
+        })
         
-        session['students'] = students
         flash('Student updated successfully!', 'success')
         return redirect(url_for('users'))
     
@@ -629,33 +1544,596 @@ def edit_user(student_id):
 @app.route('/dashboard/users/delete/<student_id>', methods=['POST'])
 @login_required
 @admin_required
+@invalidates('students')
 def delete_user(student_id):
     # Check if student has issued books
-    if any(issue['studentId'] == student_id for issue in session['issued_books']):
+    if get_storage().issues_for_student(student_id):
         flash('Cannot delete student. They have issued books.', 'error')
         return redirect(url_for('users'))
     
-    students = session['students']
-    students = [student for student in students if student['id'] != student_id]
-    session['students'] = students
+    get_storage().delete_student(student_id)
     
     flash('Student deleted successfully!', 'success')
     return redirect(url_for('users'))
 
+# Health checks
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is up and serving
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: storage answers and the catalog index is current
+    checks = {}
+    try:
+        storage = get_storage()
+        refresh = getattr(storage, 'refresh', None)
+        if refresh is not None:
+            refresh()
+        storage.get_meta('seeded')
+        checks['storage'] = 'ok'
+    except Exception as e:
+        app.logger.exception('Readiness check failed')
+        checks['storage'] = type(e).__name__
+    if not app.config['SCHEDULER_ENABLED']:
+        checks['scheduler'] = 'disabled'
+    else:
+        scheduler = app.extensions.get('library_scheduler')
+        checks['scheduler'] = 'running' if scheduler is not None and scheduler.running else 'idle'
+    ready = checks['storage'] == 'ok'
+    return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), \
+        200 if ready else 503
+
 # API routes for AJAX
+@app.route('/api/books')
+@api_login_required
+@cached('books', 'issues', per_user=False)
+def api_list_books():
+    storage = get_storage()
+    try:
+        fields = api_fields(request.args, BOOK_API_FIELDS)
+        ids = api_ids(request.args)
+        if ids is not None:
+            found = {book['id']: book for book in book_items(storage, storage.get_books(ids).values())}
+            return jsonify(batch_result(ids, found, fields))
+        api_branch(request.args)
+        page = storage.page_books(**book_listing_args(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page.to_dict(select_fields(book_items(storage, page.items), fields)))
+
+@app.route('/api/books/search')
+@api_login_required
+@cached('books', 'issues', per_user=False)
+def api_search_books():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+    try:
+        fields = api_fields(request.args, BOOK_API_FIELDS)
+        branch_id = api_branch(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    storage = get_storage()
+    # Without ?branch= the search covers every branch
+    results = storage.search_books(query, page_size(request.args.get('limit')), branch_id)
+    return jsonify({
+        'query': query,
+        'items': select_fields(book_items(storage, results), fields)
+    })
+
+@app.route('/api/students')
+@api_login_required
+@cached('students', per_user=True)
+def api_list_students():
+    storage = get_storage()
+    try:
+        fields = api_fields(request.args, STUDENT_API_FIELDS)
+        ids = api_ids(request.args)
+        if ids is None and not is_admin():
+            return jsonify({'error': 'Admin privileges required'}), 403
+        if ids is not None:
+            # Students may look up only themselves
+            if not is_admin() and any(student_id != session['user_id'] for student_id in ids):
+                return jsonify({'error': 'Admin privileges required'}), 403
+            found = {student['id']: student
+                     for student in student_items(storage.get_students(ids).values())}
+            return jsonify(batch_result(ids, found, fields))
+        page = storage.page_students(
+            query=request.args.get('q', '').strip() or None,
+            after=request.args.get('after') or None,
+            before=request.args.get('before') or None,
+            limit=page_size(request.args.get('limit'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page.to_dict(select_fields(student_items(page.items), fields)))
+
+@app.route('/api/issues')
+@api_login_required
+@cached('issues', 'books', per_user=True)
+def api_list_issues():
+    # ?studentId= (one or more) returns every matching loan of those
+    # students; admins may leave it out to page through all loans.
+    # ?branch= keeps the loans at one branch. include=books adds the
+    # referenced books, keyed by id.
+    storage = get_storage()
+    status = request.args.get('status', '')
+    if status and status not in ISSUE_STATUS_FILTERS:
+        return jsonify({'error': f'Unknown status: {status}'}), 400
+    today = datetime.now().strftime('%Y-%m-%d')
+    try:
+        fields = api_fields(request.args, ISSUE_FIELDS)
+        branch_id = api_branch(request.args)
+        student_ids = api_ids(request.args, 'studentId')
+        if student_ids is None and not is_admin():
+            student_ids = [session['user_id']]
+        if student_ids is not None:
+            if not is_admin() and student_ids != [session['user_id']]:
+                return jsonify({'error': 'Admin privileges required'}), 403
+            issues = sorted(
+                (issue for student_id in student_ids
+                 for issue in storage.issues_for_student(student_id)
+                 if issue_matches(issue, status, today)
+                 and (branch_id is None or issue['branch'] == branch_id)),
+                key=lambda issue: (issue['issueDate'], issue['id']))
+            result = {'items': issues}
+        else:
+            page = storage.page_issues(
+                status=status or None,
+                today=today,
+                after=request.args.get('after') or None,
+                before=request.args.get('before') or None,
+                limit=page_size(request.args.get('limit')),
+                branch=branch_id
+            )
+            issues = page.items
+            result = page.to_dict()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if 'books' in (api_list_arg(request.args, 'include') or ()):
+        result['books'] = storage.get_books(issue['bookId'] for issue in issues)
+    result['items'] = select_fields(issues, fields)
+    return jsonify(result)
+
+@app.route('/api/history')
+@api_login_required
+@cached('issues', per_user=True)
+def api_loan_history():
+    # Returned loans and closed requests, newest first
+    student_id = request.args.get('studentId') or None
+    if not is_admin():
+        if student_id not in (None, session['user_id']):
+            return jsonify({'error': 'Admin privileges required'}), 403
+        student_id = session['user_id']
+    items = get_storage().loan_history(student_id, request.args.get('bookId') or None,
+                                       page_size(request.args.get('limit')))
+    return jsonify({'items': items})
+
+@app.route('/api/reports')
+@api_login_required
+@cached('books', 'issues', per_user=False)
+def api_reports():
+    # ?include=mostBorrowed,genreWeeks,loanDuration,mostOverdue (default all)
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    names = api_list_arg(request.args, 'include') or REPORT_NAMES
+    unknown = [name for name in names if name not in REPORT_NAMES]
+    if unknown:
+        return jsonify({'error': f'Unknown reports: {", ".join(unknown)}'}), 400
+    try:
+        since, until, limit, weeks = report_params(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid since, until, limit or weeks'}), 400
+    table = loan_table()
+    if table is None:
+        return jsonify({'error': 'Reports need numpy installed'}), 503
+    return jsonify(build_reports(table, names, since, until, limit, weeks))
+
+def job_item(job):
+    if job['result'] and job['result'].get('file'):
+        job = dict(job, download=url_for('api_job_file', job_id=job['id']))
+    return job
+
+def job_params(kind, params):
+    # Sweeps default to the configured fines, as the scheduled one uses
+    if kind == 'overdue':
+        params = dict({'finePerDay': app.config['FINE_PER_DAY'], 'fineMax': app.config['FINE_MAX'],
+                       'remindDays': app.config['REMINDER_DAYS']}, **params)
+    return params
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@api_login_required
+def api_jobs():
+    # POST {"kind": "export", "params": {"entity": "books", "format": "csv"}}
+    # starts a job and answers 202 straight away; poll the job's URL.
+    # Kinds: export (entity, format), statements (format) and overdue
+    # (today, finePerDay, fineMax, remindDays).
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    runner = get_jobs()
+    if request.method == 'GET':
+        return jsonify({'items': [job_item(job) for job in
+                                  runner.table.recent(page_size(request.args.get('limit')))]})
+    payload = request.get_json(silent=True)
+    params = payload.get('params') or {} if isinstance(payload, dict) else None
+    if not isinstance(params, dict) or not payload.get('kind'):
+        return jsonify({'error': 'Expected a JSON object with a "kind" and optional "params"'}), 400
+    kind = str(payload['kind'])
+    try:
+        job_id = runner.submit(get_storage(), kind, job_params(kind, params), session['user_id'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(job_item(runner.table.get(job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_job', job_id=job_id)
+    return response
+
+@app.route('/api/jobs/<job_id>')
+@api_login_required
+def api_job(job_id):
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    job = get_jobs().table.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_item(job))
+
+@app.route('/api/jobs/<job_id>/file')
+@api_login_required
+def api_job_file(job_id):
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    runner = get_jobs()
+    job = runner.table.get(job_id)
+    if job is None or not (job['result'] or {}).get('file'):
+        return jsonify({'error': 'Job not found or not finished'}), 404
+    name = job['result']['file']
+    label = job['params'].get('entity') or job['kind']
+    return send_from_directory(runner.directory, name, as_attachment=True,
+                               download_name=f'{label}.{name.rsplit(".", 1)[-1]}')
+
+@app.route('/api/import/books', methods=['POST'])
+@login_required
+@admin_required
+@invalidates('books')
+def api_import_books():
+    upload = request.files.get('file')
+    if upload is not None:
+        fmt = request.args.get('format') or bulk.detect_format(upload.filename, upload.mimetype)
+        raw = upload.stream
+    else:
+        fmt = request.args.get('format') or bulk.detect_format(mimetype=request.mimetype)
+        raw = request.stream
+    if fmt not in bulk.FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    
+    stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    batch_size = request.args.get('batch_size', bulk.DEFAULT_BATCH_SIZE, type=int)
+    report = bulk.import_books(get_storage(), bulk.read_rows(stream, fmt), max(1, batch_size))
+    return jsonify(report.to_dict())
+
+def circulation_items():
+    # Batch payload: {"items": [...], "atomic": false}. Returns (items, error).
+    payload = request.get_json(silent=True)
+    items = payload.get('items') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, 'Expected a JSON object with a non-empty "items" list'
+    if len(items) > circulation.MAX_BATCH_SIZE:
+        return None, f'At most {circulation.MAX_BATCH_SIZE} items per batch'
+    return items, None
+
+@app.route('/api/circulation/issue', methods=['POST'])
+@login_required
+@admin_required
+@invalidates('issues')
+def api_issue_books():
+    items, error = circulation_items()
+    if error:
+        return jsonify({'error': error}), 400
+    payload = request.get_json()
+    try:
+        issue_date = datetime.strptime(payload['issueDate'], '%Y-%m-%d').date() \
+            if payload.get('issueDate') else None
+        loan_days = int(payload.get('loanDays', circulation.DEFAULT_LOAN_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid issueDate or loanDays'}), 400
+    if not 1 <= loan_days <= circulation.MAX_LOAN_DAYS:
+        return jsonify({'error': f'loanDays must be between 1 and {circulation.MAX_LOAN_DAYS}'}), 400
+    try:
+        report = circulation.issue_books(get_storage(), items, issue_date, loan_days,
+                                         bool(payload.get('atomic')))
+    except OverflowError:
+        return jsonify({'error': 'The return date would be past the last supported date'}), 400
+    return jsonify(report.to_dict())
+
+@app.route('/api/circulation/return', methods=['POST'])
+@login_required
+@admin_required
+@invalidates('issues')
+def api_return_books():
+    items, error = circulation_items()
+    if error:
+        return jsonify({'error': error}), 400
+    report = circulation.return_books(get_storage(), items, bool(request.get_json().get('atomic')))
+    return jsonify(report.to_dict())
+
+@app.route('/api/circulation/approve', methods=['POST'])
+@login_required
+@admin_required
+@invalidates('issues')
+def api_approve_requests():
+    items, error = circulation_items()
+    if error:
+        return jsonify({'error': error}), 400
+    report = circulation.approve_requests(get_storage(), items,
+                                          bool(request.get_json().get('atomic')))
+    return jsonify(report.to_dict())
+
+@app.route('/api/export/<entity>.<fmt>')
+@login_required
+@admin_required
+def api_export(entity, fmt):
+    if entity not in bulk.EXPORT_FIELDS or fmt not in bulk.FORMATS:
+        return jsonify({'error': 'Unknown export'}), 404
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(bulk.export_rows(get_storage(), entity, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={entity}.{fmt}'}
+    )
+
 @app.route('/api/books/<book_id>')
+@api_login_required
+@cached('books', per_user=False)
 def api_get_book(book_id):
+    try:
+        fields = api_fields(request.args, BOOK_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     book = get_book_by_id(book_id)
     if book:
-        return jsonify(book)
+        return jsonify(select_fields([book], fields)[0])
     return jsonify({'error': 'Book not found'}), 404
 
+@app.route('/api/books/<book_id>/transfer', methods=['POST'])
+@login_required
+@admin_required
+@invalidates('books', 'issues')
+def api_transfer_book(book_id):
+    # {"branch": "north", "copies": 2}: moves free copies to the same title
+    # at another branch
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not payload.get('branch'):
+        return jsonify({'error': 'Expected a JSON object with a "branch"'}), 400
+    try:
+        count = int(payload.get('copies', 1))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid copies'}), 400
+    if count < 1:
+        return jsonify({'error': 'copies must be at least 1'}), 400
+    result = get_storage().transfer_copies(book_id, str(payload['branch']), count)
+    if result is None:
+        return jsonify({'error': 'Book or branch not found, or the book is already there'}), 404
+    return jsonify({'bookId': result[0], 'moved': result[1], 'requested': count})
+
+@app.route('/api/branches', methods=['GET', 'POST'])
+@api_login_required
+@invalidates('books')
+def api_branches():
+    storage = get_storage()
+    if request.method == 'GET':
+        return jsonify({'items': storage.branches()})
+    if not is_admin():
+        return jsonify({'error': 'Admin privileges required'}), 403
+    payload = request.get_json(silent=True)
+    branch_id = str(payload.get('id') or '').strip() if isinstance(payload, dict) else ''
+    name = str(payload.get('name') or '').strip() if isinstance(payload, dict) else ''
+    if not branch_id or not name:
+        return jsonify({'error': 'Expected a JSON object with an "id" and a "name"'}), 400
+    if storage.get_branch(branch_id) is not None:
+        return jsonify({'error': 'A branch with this id already exists'}), 409
+    return jsonify(storage.add_branch({'id': branch_id, 'name': name})), 201
+
 @app.route('/api/students/<student_id>')
+@api_login_required
+@cached('students', per_user=True)
 def api_get_student(student_id):
+    if not is_admin() and student_id != session['user_id']:
+        return jsonify({'error': 'Admin privileges required'}), 403
+    try:
+        fields = api_fields(request.args, STUDENT_API_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     student = get_student_by_id(student_id)
     if student:
-        return jsonify(student)
+        return jsonify(select_fields(student_items([student]), fields)[0])
     return jsonify({'error': 'Student not found'}), 404
 
+# Templates
+def install_template_cache():
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    cache = app.jinja_env.bytecode_cache
+    if directory is None:
+        app.jinja_env.bytecode_cache = None
+    elif cache is None or cache.directory != directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+install_template_cache()
+
+def compile_templates():
+    # Loads every template, which compiles and caches any the bytecode
+    # cache does not hold yet; returns how many there are
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+# Serving
+# Importing the app opens nothing: the store (and its seeding), index,
+# cache, scheduler, job pool and report columns start on first use. The
+# server calls preload() instead, to have them ready before the first request.
+def preload():
+    # Builds what every worker needs before the server forks, so workers
+    # share the catalog index and compiled templates copy-on-write instead
+    # of each building their own
+    storage = get_storage()
+    get_cache()
+    compile_templates()
+    # Connections must not cross a fork; each worker opens its own
+    storage.close()
+    # Keeps the collector from touching, and so copying, the shared objects
+    gc.freeze()
+
+def create_app(overrides=None, production=False, preload_data=True):
+    # The app is a module-level singleton configured from the environment.
+    # This applies overrides, checks production settings, wraps the app for
+    # reverse proxies and preloads it.
+    if overrides:
+        app.config.update(overrides)
+        if 'SECRET_KEY' in overrides:
+            app.secret_key = overrides['SECRET_KEY']
+    if production and app.secret_key == DEV_SECRET_KEY:
+        raise RuntimeError('Set LIBRARY_SECRET_KEY to a long random value for production.')
+    install_template_cache()
+    proxies = app.config['PROXY_COUNT']
+    if proxies and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+    if preload_data:
+        preload()
+    return app
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    # Run at build time to ship the bytecode cache with the app. Cache entries
+    # are keyed on the templates' paths, so build where the app will run.
+    if app.config['TEMPLATE_CACHE_DIR'] is None:
+        raise click.ClickException('The template cache is off; set LIBRARY_TEMPLATE_CACHE.')
+    print(f'Compiled {compile_templates()} templates into {app.config["TEMPLATE_CACHE_DIR"]}.')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    get_storage().rebuild_search_index()
+    print('Search index rebuilt.')
+
+@app.cli.command('check-counters')
+@click.option('--repair', is_flag=True, help='Rebuild the counters if any are wrong.')
+def check_counters_command(repair):
+    storage = get_storage()
+    mismatches = storage.check_counters()
+    for name, stored, expected in mismatches:
+        click.echo(f'{name}: stored {stored}, expected {expected}')
+    if not mismatches:
+        click.echo('Counters are consistent.')
+    elif repair:
+        storage.rebuild_counters()
+        click.echo('Counters rebuilt.')
+    else:
+        raise SystemExit(1)
+
+@app.cli.command('hash-password')
+@click.password_option()
+def hash_password_command(password):
+    # For LIBRARY_ADMIN_PASSWORD_HASH
+    click.echo(get_hasher().hash(password))
+
+@app.cli.command('hash-passwords')
+def hash_passwords_command():
+    # Hashes passwords stored before hashing was added. They are also
+    # rehashed one by one as students log in.
+    storage = get_storage()
+    hasher = get_hasher()
+    plaintext = [student['id'] for student in storage.iter_students()
+                 if not is_hashed(student['password'])]
+    for done, student_id in enumerate(plaintext, start=1):
+        student = storage.get_student(student_id)
+        if student is not None and not is_hashed(student['password']):
+            storage.update_student(dict(student, password=hasher.hash(student['password'])))
+        if done % 1000 == 0:
+            click.echo(f'{done} of {len(plaintext)}')
+    click.echo(f'Hashed {len(plaintext)} passwords.')
+
+@app.cli.command('sweep-overdue')
+@click.option('--deliver/--no-deliver', default=True, help='Send queued reminders to the outbox.')
+def sweep_overdue_command(deliver):
+    stats = run_overdue_sweep()
+    click.echo(f"Marked {stats['overdue']} loans overdue, updated {stats['fines']} fines, "
+               f"queued {stats['reminders']} due reminders.")
+    if deliver:
+        click.echo(f'Delivered {run_reminder_delivery()} reminders.')
+
+@app.cli.command('snapshot')
+def snapshot_command():
+    result = run_snapshot(force=True)
+    if result is False:
+        click.echo('Another process is writing the snapshot; try again shortly.')
+        raise SystemExit(1)
+    if result is None:
+        click.echo('Snapshots need the catalog index (LIBRARY_STORAGE_INDEX=1).')
+        raise SystemExit(1)
+    click.echo(f"Snapshot written at journal seq {result['seq']}; "
+               f"pruned {result['pruned']} journal events.")
+
+@app.cli.command('reports-snapshot')
+def reports_snapshot_command():
+    # Builds the report columns and saves them, so no worker has to read
+    # the whole loan history on its first report
+    columns = get_analytics()
+    if columns is None:
+        click.echo('Reports need numpy installed.')
+        raise SystemExit(1)
+    if not analytics_path():
+        click.echo('No snapshot path; set LIBRARY_ANALYTICS_PATH.')
+        raise SystemExit(1)
+    table = columns.refresh(get_storage())
+    save_analytics(columns)
+    click.echo(f'Report columns saved with {len(table)} loans.')
+
+@app.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default=None)
+@click.option('--batch-size', default=bulk.DEFAULT_BATCH_SIZE, show_default=True)
+def import_books_command(path, fmt, batch_size):
+    fmt = fmt or bulk.detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        report = bulk.import_books(get_storage(), bulk.read_rows(stream, fmt), batch_size)
+    for error in report.errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f'Imported {report.imported} books, {report.failed} rows failed.')
+
+@app.cli.command('job')
+@click.argument('kind', type=click.Choice(sorted(jobs.PLANNERS)))
+@click.option('--param', '-p', 'params', multiple=True, metavar='KEY=VALUE')
+def job_command(kind, params):
+    # Runs a background job in the process pool and waits for it
+    runner = get_jobs()
+    params = dict(param.partition('=')[::2] for param in params)
+    try:
+        job_id = runner.submit(get_storage(), kind, job_params(kind, params))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    while True:
+        job = runner.table.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.2)
+    if job['status'] == 'failed':
+        raise click.ClickException(job['error'])
+    result = job['result']
+    if result.get('file'):
+        click.echo(runner.path(result['file']))
+    click.echo(json.dumps(result['counts']))
+
+@app.cli.command('export')
+@click.argument('entity', type=click.Choice(list(bulk.EXPORT_FIELDS)))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-')
+def export_command(entity, fmt, output):
+    for chunk in bulk.export_rows(get_storage(), entity, fmt):
+        output.write(chunk)
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server; see wsgi.py for production
+    create_app(preload_data=False).run(debug=os.environ.get('LIBRARY_DEBUG', '1') == '1')
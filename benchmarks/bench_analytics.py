@@ -0,0 +1,127 @@
+"""Report latency over the columnar loan table, and load throughput.
+
+Builds a LoanTable of --loans synthetic loans directly in numpy (skewed
+book popularity, two years of issue dates, a tenth still out) and times
+each report and the full set the reports page and /api/reports compute.
+
+Then writes --load returned loans to a SQLite loan_history and times the
+first LoanColumns load from it, an incremental load after --append more,
+and saving and resuming from a snapshot of the columns.
+
+    python benchmarks/bench_analytics.py --loans 10000000 --load 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library import analytics
+from library.storage import SQLiteStorage
+
+if not analytics.available():
+    sys.exit('numpy is required for this benchmark')
+np = analytics.np
+
+
+def synthetic_table(n_loans, n_books, n_students, n_genres, today, seed=1):
+    rng = np.random.default_rng(seed)
+    issued = (today - rng.integers(0, 730, n_loans)).astype(np.int32)
+    due = issued + 7
+    closed = issued + rng.integers(1, 30, n_loans, dtype=np.int32)
+    closed[rng.random(n_loans) < 0.1] = analytics.OPEN
+    # A few books account for most loans
+    book = (n_books * rng.random(n_loans) ** 3).astype(np.int32)
+    student = rng.integers(0, n_students, n_loans, dtype=np.int32)
+    columns = dict(zip(analytics.COLUMNS, (issued, due, np.minimum(closed, today), book, student)))
+    return analytics.LoanTable(
+        columns, [f'book-{i}' for i in range(n_books)], [f'student-{i}' for i in range(n_students)],
+        [f'Genre {i}' for i in range(n_genres)],
+        rng.integers(0, n_genres, n_books, dtype=np.int32), time.time())
+
+
+def timed(fn, repeat=5):
+    # (result, best seconds of `repeat` runs)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def write_history(storage, start, count, n_books, n_students, batch=100000):
+    with storage.transaction() as conn:
+        for offset in range(start, start + count, batch):
+            conn.executemany(
+                'INSERT INTO loan_history (id, bookId, studentId, issueDate, returnDate, status, closedDate) '
+                "VALUES (?, ?, ?, date('2025-01-01', '+' || (? % 600) || ' days'), "
+                "date('2025-01-08', '+' || (? % 600) || ' days'), 'issued', "
+                "date('2025-01-10', '+' || (? % 600) || ' days'))",
+                ((f'loan-{i}', f'book-{i % n_books}', f'student-{i % n_students}', i, i, i)
+                 for i in range(offset, min(offset + batch, start + count))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--loans', type=int, default=10000000)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--genres', type=int, default=20)
+    parser.add_argument('--load', type=int, default=1000000, help='loans loaded from SQLite')
+    parser.add_argument('--append', type=int, default=10000, help='loans added before the incremental load')
+    args = parser.parse_args()
+
+    today = date.today()
+    table = synthetic_table(args.loans, args.books, args.students, args.genres, today.toordinal())
+    size = sum(getattr(table, name).nbytes for name in analytics.COLUMNS + ('genre',))
+    print(f'{len(table):,} loans, {args.books:,} books, {args.students:,} students '
+          f'({size / 2 ** 20:,.0f} MiB of columns)')
+    reports = (
+        ('most borrowed', lambda: analytics.most_borrowed(table)),
+        ('most borrowed, last 90 days',
+         lambda: analytics.most_borrowed(table, since=date.fromordinal(today.toordinal() - 90))),
+        ('loans per genre per week', lambda: analytics.loans_per_genre_per_week(table)),
+        ('loan duration', lambda: analytics.loan_duration(table)),
+        ('most overdue', lambda: analytics.most_overdue(table)),
+    )
+    total = 0.0
+    for name, report in reports:
+        _, seconds = timed(report)
+        if name != 'most borrowed, last 90 days':
+            total += seconds
+        print(f'  {name:<30} {seconds * 1000:8.1f} ms')
+    print(f'  {"all four reports":<30} {total * 1000:8.1f} ms')
+
+    if not args.load:
+        return
+    storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    write_history(storage, 0, args.load, args.books, args.students)
+    columns = analytics.LoanColumns()
+    table, seconds = timed(lambda: columns.refresh(storage), repeat=1)
+    print(f'\n  first load, {len(table):,} loans:  {seconds:8.2f} s '
+          f'({len(table) / seconds:,.0f} loans/s)')
+    write_history(storage, args.load, args.append, args.books, args.students)
+    # Written straight to loan_history, so no generation moved to show it
+    columns.generations = None
+    table, seconds = timed(lambda: columns.refresh(storage), repeat=1)
+    print(f'  incremental load, +{args.append:,}:   {seconds:8.2f} s')
+    assert len(table) == args.load + args.append
+
+    path = storage.path + '.analytics'
+    _, seconds = timed(lambda: columns.save(path, storage.journal_id()), repeat=1)
+    print(f'  snapshot write:                {seconds:8.2f} s '
+          f'({os.path.getsize(path) / 2 ** 20:,.0f} MiB)')
+    resumed = analytics.LoanColumns()
+    table, seconds = timed(lambda: resumed.restore(path, storage.journal_id()) and resumed.refresh(storage),
+                           repeat=1)
+    print(f'  resume from snapshot:          {seconds:8.2f} s')
+    assert len(table) == args.load + args.append
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Cost of branch-scoped reads as the other branches grow.
+
+Builds one small branch (--books titles, one loan on every other one) next
+to --others branches of --other-books titles each, then times the scoped
+counts, pages and searches the /branches/<id>/... pages run, against the
+SQLite backend and the catalog index. Run it with --others 0 and with a
+large --others: the scoped times should hardly move.
+
+Search matches across the whole full-text index before keeping the
+branch's rows, so it is timed with a selective query.
+
+    python benchmarks/bench_branches.py --books 2000 --others 10 --other-books 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+GENRES = ('Fiction', 'History', 'Science', 'Fantasy', 'Biography')
+
+
+def generate(storage, branch, n_books, start):
+    # Titles start..start+n_books at branch, one copy each and a loan on
+    # every other copy
+    ids = range(start, start + n_books)
+    with storage.transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO branches (id, name) VALUES (?, ?)', (branch, branch.title()))
+        conn.executemany(
+            'INSERT INTO books (id, title, author, isbn, genre, branch) VALUES (?, ?, ?, ?, ?, ?)',
+            ((f'book-{i}', f'Title {i}', f'Author {i % 997}', f'{9780000000000 + i}',
+              GENRES[i % len(GENRES)], branch) for i in ids))
+        conn.executemany('INSERT INTO copies (id, bookId, number, branch) VALUES (?, ?, 1, ?)',
+                         ((f'copy-{i}', f'book-{i}', branch) for i in ids))
+        conn.executemany(
+            'INSERT INTO issues (id, bookId, studentId, issueDate, returnDate, status, copyId, branch) '
+            "VALUES (?, ?, 'student-0', '2026-01-01', '2026-01-08', 'issued', ?, ?)",
+            ((f'issue-{i}', f'book-{i}', f'copy-{i}', branch) for i in ids if i % 2 == 0))
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=2000, help='titles at the measured branch')
+    parser.add_argument('--others', type=int, default=10, help='number of other branches')
+    parser.add_argument('--other-books', type=int, default=20000, help='titles at each other branch')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    backend = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    started = time.perf_counter()
+    generate(backend, 'east', args.books, 0)
+    for n in range(args.others):
+        generate(backend, f'branch{n}', args.other_books, args.books + n * args.other_books)
+    total = backend.count_books()
+    print(f'{args.books:,} titles at the measured branch, {total:,} in all '
+          f'({time.perf_counter() - started:.1f} s to generate)')
+
+    started = time.perf_counter()
+    indexed = IndexedStorage(backend)
+    print(f'index load:                      {(time.perf_counter() - started) * 1000:8.1f} ms')
+    started = time.perf_counter()
+    indexed.count_books('east')
+    print(f'first use of the branch index:   {(time.perf_counter() - started) * 1000:8.1f} ms')
+
+    for label, storage in (('sqlite', backend), ('index', indexed)):
+        print(f'\n{label}')
+        cases = (
+            ('count books', lambda: storage.count_books('east')),
+            ('count loans', lambda: storage.count_issues('east')),
+            ('count available', lambda: storage.count_available_books('east')),
+            ('first page of books', lambda: storage.page_books(filters={'branch': 'east'})),
+            ('available-only page', lambda: storage.page_books(
+                filters={'branch': 'east', 'availability': 'available'})),
+            ('first page of loans', lambda: storage.page_issues(branch='east')),
+            ('overdue loans page', lambda: storage.page_issues(
+                status='overdue', today='2026-02-01', branch='east')),
+            ('search', lambda: storage.search_books('1500', branch='east')),
+            ('all books', lambda: storage.all_books('east')),
+        )
+        for name, fn in cases:
+            print(f'  {name:<28} {timed(fn, args.repeat):8.2f} ms')
+    backend.close()
+
+
+if __name__ == '__main__':
+    main()
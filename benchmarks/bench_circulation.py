@@ -0,0 +1,84 @@
+"""Per-item cost of batch circulation as the number of loans grows.
+
+Checks out a batch of books by ISBN and roll number through the desk API,
+returns them by the same barcodes, and compares with posting the single
+issue form once per book. The per-item time should stay flat as the
+library grows.
+
+    python benchmarks/bench_circulation.py --issues 1000000 --batch 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LIBRARY_STORAGE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'app.db'))
+os.environ.setdefault('LIBRARY_SCHEDULER', '0')
+
+from bench_index import generate
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_scale(n_books, n_issues, batch):
+    n_students = max(1, n_books // 10)
+    backend = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    generate(backend, n_books, n_students, n_issues)
+    backend.rebuild_counters()
+
+    from app import app
+    app.extensions['library_storage'] = IndexedStorage(backend)
+    admin = app.test_client()
+    admin.post('/login/admin', data={'username': 'admin', 'password': '123'})
+
+    # Every book keeps its first copy free, so each item can be checked out
+    items = [{'isbn': f'{9780000000000 + i % n_books}', 'rollNo': f'R{i % n_students}'}
+             for i in range(batch)]
+    results = {}
+    response, ms = timed(lambda: admin.post('/api/circulation/issue', json={'items': items}))
+    assert response.get_json()['failed'] == 0, response.get_json()
+    results['batch issue'] = ms / batch
+    response, ms = timed(lambda: admin.post('/api/circulation/return', json={'items': items}))
+    assert response.get_json()['failed'] == 0, response.get_json()
+    results['batch return'] = ms / batch
+
+    def one_by_one():
+        for i in range(batch):
+            admin.post('/dashboard/issue-book', data={
+                'book': f'book-{i % n_books}', 'student': f'student-{i % n_students}',
+                'issue_date': '2026-01-01'})
+    _, ms = timed(one_by_one)
+    results['single issue form'] = ms / batch
+
+    app.extensions['library_storage'].close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--issues', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=3,
+                        help='number of 10x scale steps up to the given size')
+    args = parser.parse_args()
+
+    for step in reversed(range(args.steps)):
+        n_books = max(args.batch, args.books // 10 ** step)
+        n_issues = max(1, args.issues // 10 ** step)
+        results = bench_scale(n_books, n_issues, args.batch)
+        print(f'\n{n_books} books, {n_issues} issues, batches of {args.batch}')
+        for name, ms in results.items():
+            print(f'  {name:<24} {ms:8.3f} ms per item')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Page latency of id/ISBN/username lookups as the catalog grows.
+
+Compares the old linear scans over plain lists with the IndexedStorage
+lookups, then times a few routes through Flask's test client.
+
+    python benchmarks/bench_index.py --books 100000 --issues 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LIBRARY_STORAGE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'app.db'))
+
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+def generate(storage, n_books, n_students, n_issues, seed=1):
+    rng = random.Random(seed)
+    with storage.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO books (id, title, author, isbn, genre) VALUES (?, ?, ?, ?, ?)',
+            ((f'book-{i}', f'Title {i}', f'Author {i % 5000}', f'{9780000000000 + i}', 'Fiction')
+             for i in range(n_books)))
+        conn.executemany(
+            'INSERT INTO students (id, name, username, password, rollNo) VALUES (?, ?, ?, ?, ?)',
+            ((f'student-{i}', f'Student {i}', f'user{i}', 'pw', f'R{i}')
+             for i in range(n_students)))
+        # Every loan is on its own copy, on top of one copy per book
+        loans = [(f'issue-{i}', f'book-{rng.randrange(n_books)}') for i in range(n_issues)]
+        copy_numbers = {}
+        copies = []
+        for issue_id, book_id in loans:
+            copy_numbers[book_id] = copy_numbers.get(book_id, 1) + 1
+            copies.append((f'copy-{issue_id}', book_id, copy_numbers[book_id]))
+        conn.executemany('INSERT INTO copies (id, bookId, number) VALUES (?, ?, ?)',
+                         ((f'copy-book-{i}', f'book-{i}', 1) for i in range(n_books)))
+        conn.executemany('INSERT INTO copies (id, bookId, number) VALUES (?, ?, ?)', copies)
+        conn.executemany(
+            'INSERT INTO issues (id, bookId, studentId, issueDate, returnDate, status, copyId) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((issue_id, book_id, f'student-{rng.randrange(n_students)}',
+              '2026-01-01', '2026-01-08', 'issued', f'copy-{issue_id}')
+             for issue_id, book_id in loans))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded', '1')")
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_scale(n_books, n_issues, repeat):
+    n_students = max(1, n_books // 10)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    backend = SQLiteStorage(path)
+    generate(backend, n_books, n_students, n_issues)
+
+    start = time.perf_counter()
+    storage = IndexedStorage(backend)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    books = backend.all_books()
+    students = backend.all_students()
+    issues = backend.all_issues()
+    target_book = f'book-{n_books - 1}'
+    target_isbn = f'{9780000000000 + n_books - 1}'
+    target_user = f'user{n_students - 1}'
+    target_student = f'student-{n_students - 1}'
+
+    results = {
+        'book by id (scan)': timeit(lambda: next(b for b in books if b['id'] == target_book), repeat),
+        'book by id (index)': timeit(lambda: storage.get_book(target_book), repeat),
+        'isbn check (scan)': timeit(lambda: any(b['isbn'] == target_isbn for b in books), repeat),
+        'isbn check (index)': timeit(lambda: storage.find_book_by_isbn(target_isbn), repeat),
+        'username (scan)': timeit(lambda: any(s['username'] == target_user for s in students), repeat),
+        'username (index)': timeit(lambda: storage.find_student_by_username(target_user), repeat),
+        'student issues (scan)': timeit(
+            lambda: [i for i in issues if i['studentId'] == target_student], repeat),
+        'student issues (index)': timeit(lambda: storage.issues_for_student(target_student), repeat),
+    }
+
+    from app import app
+    app.extensions['library_storage'] = storage
+    admin = app.test_client()
+    admin.post('/login/admin', data={'username': 'admin', 'password': '123'})
+    student = app.test_client()
+    student.post('/login/student', data={'action': 'login', 'username': target_user, 'password': 'pw'})
+
+    results['GET /api/books/<id>'] = timeit(lambda: admin.get(f'/api/books/{target_book}'), repeat)
+    results['POST /login/student'] = timeit(
+        lambda: app.test_client().post('/login/student', data={
+            'action': 'login', 'username': target_user, 'password': 'pw'}), repeat)
+    results['POST add_book (dup isbn)'] = timeit(
+        lambda: admin.post('/dashboard/books/add', data={
+            'title': 't', 'author': 'a', 'isbn': target_isbn, 'genre': 'g'}), repeat)
+    results['GET /dashboard (student)'] = timeit(lambda: student.get('/dashboard'), repeat)
+    results['GET /dashboard/issued-books (student)'] = timeit(
+        lambda: student.get('/dashboard/issued-books'), repeat)
+
+    storage.close()
+    return load_ms, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--issues', type=int, default=1000000)
+    parser.add_argument('--steps', type=int, default=3,
+                        help='number of 10x scale steps up to the given size')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for step in reversed(range(args.steps)):
+        n_books = max(1, args.books // 10 ** step)
+        n_issues = max(1, args.issues // 10 ** step)
+        load_ms, results = bench_scale(n_books, n_issues, args.repeat)
+        print(f'\n{n_books} books, {n_issues} issues (index load {load_ms:.0f} ms)')
+        for name, ms in results.items():
+            print(f'  {name:<40} {ms:10.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Export time in the job pool, and web-side latency while a job runs.
+
+Writes --books synthetic titles, times a plain export_rows() in this
+process, then the same export run as a job with one worker and with
+--workers workers. While the last job runs it keeps timing a page of
+books from this process, the reads a web worker keeps serving: with the
+export out of process that latency should stay close to the idle one.
+
+    python benchmarks/bench_jobs.py --books 500000 --workers 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library import bulk, jobs
+from library.storage import SQLiteStorage
+
+GENRES = ('Fiction', 'History', 'Science', 'Fantasy', 'Biography')
+
+
+def generate(storage, n_books):
+    with storage.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO books (id, title, author, isbn, genre) VALUES (?, ?, ?, ?, ?)',
+            ((f'book-{i}', f'Title {i}', f'Author {i % 997}', f'{9780000000000 + i}',
+              GENRES[i % len(GENRES)]) for i in range(n_books)))
+
+
+def page_latency(storage, until):
+    # ms per first page of books, sampled until until() is true
+    samples = []
+    while not until():
+        started = time.perf_counter()
+        storage.page_books()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def run_job(runner, storage, fmt, sample=False):
+    started = time.perf_counter()
+    job_id = runner.submit(storage, 'export', {'entity': 'books', 'format': fmt})
+
+    def finished():
+        return runner.table.get(job_id)['status'] in ('done', 'failed')
+
+    if sample:
+        samples = page_latency(storage, finished)
+    else:
+        samples = []
+        while not finished():
+            time.sleep(0.01)
+    job = runner.table.get(job_id)
+    assert job['status'] == 'done', job['error']
+    return time.perf_counter() - started, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--format', choices=bulk.FORMATS, default='csv')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    storage = SQLiteStorage(path)
+    generate(storage, args.books)
+    print(f'{args.books:,} books, {args.workers} workers, {args.format}')
+
+    started = time.perf_counter()
+    for _ in bulk.export_rows(storage, 'books', args.format):
+        pass
+    print(f'  in process:             {time.perf_counter() - started:8.2f} s')
+
+    deadline = time.perf_counter() + 1
+    idle = page_latency(storage, lambda: time.perf_counter() > deadline)
+
+    table = jobs.JobTable(os.path.join(directory, 'jobs.db'))
+    for workers in sorted({1, args.workers}):
+        runner = jobs.JobRunner(table, f'sqlite:///{path}', os.path.join(directory, 'out'), workers)
+        # Starts the pool, so the timings below leave out process start-up
+        run_job(runner, storage, args.format)
+        seconds, samples = run_job(runner, storage, args.format, sample=workers == args.workers)
+        label = f'job, {workers} worker{"s" if workers > 1 else ""}:'
+        print(f'  {label:<23} {seconds:8.2f} s')
+        runner.shutdown()
+
+    print(f'\n  page of books, idle:    {statistics.median(idle):8.2f} ms median, '
+          f'{max(idle):.2f} ms max')
+    if samples:
+        print(f'  page of books, job on:  {statistics.median(samples):8.2f} ms median, '
+              f'{max(samples):.2f} ms max')
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Journal write throughput and index recovery time.
+
+Builds a catalog, then churns loans (issue, mark overdue, return: three
+journal events each) until --events events have been written, reporting
+events per second as the journal grows. The same churn runs first on a
+copy without the journal triggers, to show what journaling costs per write.
+
+Recovery compares a full index load from the tables with loading the
+latest snapshot and replaying the --tail events written after it.
+
+    python benchmarks/bench_journal.py --books 100000 --issues 1000000 --events 10000000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_index import generate
+from library import journal
+from library.index import CatalogIndex, IndexedStorage
+from library.storage import SQLiteStorage
+
+
+def churn(storage, n_events, n_books, n_students, batch=10000, start=0, report_every=None):
+    # Returns (events written, seconds). Each loan is on a fresh copy, so the
+    # writes never collide with the resident loans.
+    written, elapsed, loan = 0, 0.0, start
+    next_report = report_every
+    with storage.transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO copies (id, bookId, number) VALUES (?, ?, ?)',
+                         ((f'churn-copy-{i}', f'book-{i % n_books}', 1000 + i) for i in range(batch)))
+    while written < n_events:
+        loans = [(f'churn-{loan + i}', f'book-{(loan + i) % n_books}', f'student-{(loan + i) % n_students}',
+                  f'churn-copy-{i}') for i in range(batch)]
+        loan += batch
+        started = time.perf_counter()
+        with storage.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO issues (id, bookId, studentId, issueDate, returnDate, status, copyId) '
+                "VALUES (?, ?, ?, '2026-01-01', '2026-01-08', 'issued', ?)", loans)
+        with storage.transaction() as conn:
+            conn.executemany("UPDATE issues SET status = 'overdue', fine = 5 WHERE id = ?",
+                             ((issue_id,) for issue_id, *_ in loans))
+        with storage.transaction() as conn:
+            conn.executemany('DELETE FROM issues WHERE id = ?', ((issue_id,) for issue_id, *_ in loans))
+        elapsed += time.perf_counter() - started
+        written += 3 * batch
+        if next_report and written >= next_report:
+            print(f'    {written:>11,} events  {written / elapsed:10,.0f} events/s', flush=True)
+            next_report += report_every
+    return written, elapsed
+
+
+def drop_journal_triggers(storage):
+    with storage.transaction() as conn:
+        for name in journal.trigger_names(conn):
+            conn.execute(f'DROP TRIGGER {name}')
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--issues', type=int, default=1000000, help='resident loans')
+    parser.add_argument('--events', type=int, default=10000000)
+    parser.add_argument('--baseline-events', type=int, default=300000,
+                        help='churn without the journal, for comparison')
+    parser.add_argument('--tail', type=int, default=100000, help='events replayed after the snapshot')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    backend = SQLiteStorage(path)
+    _, seconds = timed(lambda: generate(backend, args.books, args.students, args.issues))
+    backend.rebuild_counters()
+    print(f'{args.books} books, {args.students} students, {args.issues} loans '
+          f'({backend.journal_head():,} journal events) in {seconds:.1f} s')
+
+    # Baseline on a copy without journal triggers (triggers are recreated
+    # when a storage opens the file, so drop them after opening)
+    backend.close()
+    baseline_path = os.path.join(directory, 'baseline.db')
+    shutil.copy(path, baseline_path)
+    baseline = SQLiteStorage(baseline_path)
+    drop_journal_triggers(baseline)
+    written, seconds = churn(baseline, args.baseline_events, args.books, args.students)
+    print(f'\n  churn without journal: {written / seconds:10,.0f} writes/s')
+    baseline.close()
+    os.unlink(baseline_path)
+
+    backend = SQLiteStorage(path)
+    print(f'  churn with journal, to {args.events:,} events:')
+    events = max(0, args.events - backend.journal_head() - args.tail)
+    written, seconds = churn(backend, events, args.books, args.students,
+                             report_every=max(30000, events // 10))
+    if written:
+        print(f'  overall: {written / seconds:10,.0f} events/s')
+    print(f'  database: {os.path.getsize(path) / 2 ** 20:,.0f} MiB, '
+          f'{backend.journal_head():,} events')
+
+    # Recovery
+    snapshot_path = path + '.snapshot'
+    storage, load_seconds = timed(lambda: IndexedStorage(backend))
+    print(f'\n  full load from tables:        {load_seconds:8.2f} s')
+    _, seconds = timed(lambda: storage.snapshot(snapshot_path))
+    print(f'  snapshot write:               {seconds:8.2f} s '
+          f'({os.path.getsize(snapshot_path) / 2 ** 20:,.0f} MiB)')
+    tail, _ = churn(backend, args.tail, args.books, args.students, start=10 ** 9)
+    recovered, seconds = timed(lambda: IndexedStorage(backend, snapshot_path))
+    assert recovered._seq == backend.journal_head(), 'recovery fell back to a full load'
+    print(f'  snapshot + {tail:,} event tail:  {seconds:8.2f} s')
+    index, seconds = timed(lambda: CatalogIndex.load(backend))
+    assert len(index.issues) == len(recovered._index.issues)
+    backend.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Student login throughput with hashed passwords at 100k accounts.
+
+Every account shares one precomputed hash: hashing 100k passwords one by one
+would take most of an hour and the per-login cost is the same either way.
+Reports the username lookup, the hash check for each method, end-to-end
+logins through Flask's test client, and how cheaply throttled attempts are
+turned away.
+
+    python benchmarks/bench_login.py --accounts 100000 --logins 200 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LIBRARY_STORAGE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'app.db'))
+os.environ.setdefault('LIBRARY_SCHEDULER', '0')
+
+from library.credentials import PasswordHasher
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+def generate(storage, n_accounts, password_hash):
+    with storage.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO students (id, name, username, password, rollNo) VALUES (?, ?, ?, ?, ?)',
+            ((f'student-{i}', f'Student {i}', f'user{i}', password_hash, f'R{i}')
+             for i in range(n_accounts)))
+
+
+def per_call_ms(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def logins_per_second(app, usernames, password, threads):
+    # Each thread logs in its share of the accounts with a fresh client
+    def worker(names):
+        for name in names:
+            response = app.test_client().post('/login/student', data={
+                'action': 'login', 'username': name, 'password': password})
+            assert response.status_code == 302, response.status_code
+
+    workers = [threading.Thread(target=worker, args=(usernames[i::threads],))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return len(usernames) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    from app import app, get_hasher
+    hasher = get_hasher()
+    password = 'correct horse battery staple'
+    backend = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    generate(backend, args.accounts, hasher.hash(password))
+    storage = IndexedStorage(backend)
+    app.extensions['library_storage'] = storage
+    students = storage.all_students()
+    target = f'user{args.accounts - 1}'
+
+    print(f'{args.accounts} accounts')
+    print(f'  {"username lookup (old linear scan)":<40} '
+          f'{per_call_ms(lambda: [s for s in students if s["username"] == target], 20):10.4f} ms')
+    print(f'  {"username lookup (index)":<40} '
+          f'{per_call_ms(lambda: storage.find_student_by_username(target), 1000):10.4f} ms')
+    for name, method in (('scrypt n=2**14', PasswordHasher('scrypt')),
+                         ('pbkdf2_sha256 600k', PasswordHasher('pbkdf2_sha256'))):
+        stored = method.hash(password)
+        print(f'  {"verify " + name:<40} {per_call_ms(lambda: method.verify(password, stored), 10):10.3f} ms')
+
+    usernames = [f'user{i * (args.accounts // args.logins)}' for i in range(args.logins)]
+    for threads in sorted({1, args.threads}):
+        rate = logins_per_second(app, usernames, password, threads)
+        print(f'  {f"POST /login/student, {threads} thread(s)":<40} {rate:10.1f} logins/s')
+
+    # Spend one account's bucket, then time the rejections
+    client = app.test_client()
+    bad = {'action': 'login', 'username': target, 'password': 'wrong'}
+    while client.post('/login/student', data=bad).status_code != 429:
+        pass
+    print(f'  {"throttled attempt":<40} '
+          f'{per_call_ms(lambda: client.post("/login/student", data=bad), 200):10.3f} ms')
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Memory per row of the compact records against the old row dicts.
+
+Loads books, students and loans from SQLite twice, once as the row dicts
+the backend returns and once as library.records types, and reports the
+traced bytes per row of each. Also times a full CatalogIndex load and an
+overdue scan over every loan through subscripts and through attributes.
+
+    python benchmarks/bench_records.py --books 100000 --issues 1000000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_index import generate
+from library.index import CatalogIndex
+from library.records import Book, Issue, Student
+from library.storage import SQLiteStorage
+
+
+def spread_dates(storage, days):
+    # One date for every loan would flatter the shared date objects
+    with storage.transaction() as conn:
+        conn.execute("UPDATE issues SET issueDate = date('2025-01-01', '+' || (rowid % ?) || ' days'), "
+                     "returnDate = date('2025-01-08', '+' || (rowid % ?) || ' days')", (days, days))
+
+
+def traced(build):
+    # (result, bytes still allocated by build once it returns)
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--issues', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=730, help='distinct loan dates')
+    args = parser.parse_args()
+
+    backend = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    generate(backend, args.books, args.students, args.issues)
+    spread_dates(backend, args.days)
+
+    print(f'{args.books} books, {args.students} students, {args.issues} loans')
+    print(f'  {"":<10} {"dict B/row":>12} {"record B/row":>14} {"saved":>8}')
+    for name, rows, record in (('books', backend.iter_books, Book),
+                               ('students', backend.iter_students, Student),
+                               ('issues', backend.iter_issues, Issue)):
+        dicts, dict_size = traced(lambda: list(rows()))
+        count = len(dicts)
+        del dicts
+        records, record_size = traced(lambda: [record.from_row(row) for row in rows()])
+        del records
+        if count:
+            print(f'  {name:<10} {dict_size / count:12.1f} {record_size / count:14.1f} '
+                  f'{1 - record_size / dict_size:8.1%}')
+
+    start = time.perf_counter()
+    index, size = traced(lambda: CatalogIndex.load(backend))
+    print(f'\n  CatalogIndex.load: {size / 2 ** 20:.1f} MiB traced, '
+          f'{time.perf_counter() - start:.2f} s (under tracemalloc)')
+
+    issues = list(index.issues.values())
+    today = date(2026, 1, 1)
+    today_text = today.isoformat()
+    start = time.perf_counter()
+    by_key = sum(1 for issue in issues if issue['returnDate'] < today_text)
+    key_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    by_attr = sum(1 for issue in issues if issue.returnDate < today)
+    attr_seconds = time.perf_counter() - start
+    assert by_key == by_attr
+    print(f'  overdue scan, subscripts:  {key_seconds * 1000:8.1f} ms ({by_key} overdue)')
+    print(f'  overdue scan, attributes:  {attr_seconds * 1000:8.1f} ms')
+    backend.close()
+
+
+if __name__ == '__main__':
+    main()
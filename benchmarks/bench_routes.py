@@ -0,0 +1,267 @@
+"""Throughput, p50/p99 latency and peak memory for every route.
+
+Generates a synthetic library at each requested scale, drives the routes
+through Flask's test client and writes the results as JSON, so runs from
+two commits can be compared:
+
+    python benchmarks/bench_routes.py --scales 10 1000 100000 --output before.json
+    python benchmarks/bench_routes.py --scales 10 1000 100000 --output after.json
+    python benchmarks/bench_routes.py --compare before.json after.json
+
+Scale N means N books, N students and N loans unless --students or
+--issues give other ratios. The response cache is off unless --cache is
+passed, so every request does the full work. Peak memory is measured
+separately under tracemalloc, which would distort the latencies.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('LIBRARY_STORAGE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'app.db'))
+os.environ.setdefault('LIBRARY_SCHEDULER', '0')
+# Logins are part of the setup, not what is being measured
+os.environ.setdefault('LIBRARY_LOGIN_ATTEMPTS', '1000000')
+
+from bench_index import generate
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+# (name, role, method, path, form or JSON body). Paths and bodies are
+# templates filled per request from the running counter i and the scale.
+ROUTES = [
+    ('dashboard (admin)', 'admin', 'GET', '/dashboard', None),
+    ('dashboard (student)', 'student', 'GET', '/dashboard', None),
+    ('books', 'admin', 'GET', '/dashboard/books', None),
+    ('books filtered', 'admin', 'GET', '/dashboard/books?title=Title+1&availability=available', None),
+    ('issued_books (admin)', 'admin', 'GET', '/dashboard/issued-books', None),
+    ('issued_books (student)', 'student', 'GET', '/dashboard/issued-books', None),
+    ('issued_books overdue', 'admin', 'GET', '/dashboard/issued-books?status=overdue', None),
+    ('users', 'admin', 'GET', '/dashboard/users', None),
+    ('users search', 'admin', 'GET', '/dashboard/users?q=Student+1', None),
+    ('issue_book form', 'admin', 'GET', '/dashboard/issue-book', None),
+    ('issue_book', 'admin', 'POST', '/dashboard/issue-book',
+     {'book': 'book-{free_book}', 'student': 'student-{student}', 'issue_date': '2026-01-01'}),
+    ('return_book', 'admin', 'POST', '/dashboard/return-book/issue-{loan}', None),
+    ('api books', 'admin', 'GET', '/api/books', None),
+    ('api books search', 'admin', 'GET', '/api/books/search?q=Title', None),
+    ('api book', 'admin', 'GET', '/api/books/book-{book}', None),
+    ('api student', 'admin', 'GET', '/api/students/student-{student}', None),
+    ('api books batch', 'admin', 'GET',
+     '/api/books?ids=' + ','.join(f'book-{{book{i}}}' for i in range(25)), None),
+    ('api issues (student)', 'student', 'GET', '/api/issues?include=books', None),
+    ('api circulation issue', 'admin', 'JSON', '/api/circulation/issue',
+     {'items': [{'bookId': 'book-{free_book}', 'studentId': 'student-{student}'}]}),
+]
+# Each of these uses up a free copy or a loan, so they get at most one
+# request per available book or loan
+CONSUMING = {'issue_book': 'free_book', 'api circulation issue': 'free_book', 'return_book': 'loan'}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fill(template, values):
+    if isinstance(template, str):
+        return template.format(**values)
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fill(value, values) for value in template]
+    return template
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Counters:
+    # Hands out book, student and loan numbers; free books and loans are
+    # shared by the routes that use them up
+
+    def __init__(self, n_books, n_students, n_issues):
+        self.sizes = {'book': n_books, 'student': n_students, 'free_book': n_books, 'loan': n_issues}
+        self.next = {name: 0 for name in self.sizes}
+
+    def remaining(self, name):
+        return self.sizes[name] - self.next[name]
+
+    def values(self, i):
+        values = {'book': i % self.sizes['book'], 'student': i % self.sizes['student']}
+        # 25 distinct books for the batch lookups
+        values.update((f'book{k}', (i * 25 + k) % self.sizes['book']) for k in range(25))
+        for name in ('free_book', 'loan'):
+            values[name] = self.next[name]
+        return values
+
+    def used(self, name):
+        self.next[name] += 1
+
+
+def run_route(clients, counters, route, requests, warmup, memory_samples):
+    name, role, method, path, body = route
+    client = clients[role]
+    consumes = CONSUMING.get(name)
+    if consumes:
+        requests = min(requests, max(0, counters.remaining(consumes) - warmup - memory_samples))
+        if requests == 0:
+            return {'skipped': f'no {consumes} left at this scale'}
+
+    def send(i):
+        values = counters.values(i)
+        if consumes:
+            counters.used(consumes)
+        url = fill(path, values)
+        if method == 'GET':
+            response = client.get(url)
+        elif method == 'JSON':
+            response = client.post(url, json=fill(body, values))
+        else:
+            response = client.post(url, data=fill(body, values) if body else None)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: {url} returned {response.status_code}')
+        return response
+
+    for i in range(warmup):
+        send(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        started = time.perf_counter()
+        send(warmup + i)
+        latencies.append(time.perf_counter() - started)
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    tracemalloc.start()
+    for i in range(memory_samples):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        send(warmup + requests + i)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'throughput': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def bench_scale(app, n_books, n_students, n_issues, args):
+    backend = SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    started = time.perf_counter()
+    generate(backend, n_books, n_students, n_issues)
+    backend.rebuild_counters()
+    storage = IndexedStorage(backend) if not args.no_index else backend
+    setup_seconds = time.perf_counter() - started
+    app.extensions['library_storage'] = storage
+    app.extensions.pop('library_cache', None)
+
+    clients = {'admin': app.test_client(), 'student': app.test_client()}
+    clients['admin'].post('/login/admin', data={'username': 'admin', 'password': '123'})
+    clients['student'].post('/login/student', data={
+        'action': 'login', 'username': 'user0', 'password': 'pw'})
+
+    counters = Counters(n_books, n_students, n_issues)
+    routes = {}
+    for route in ROUTES:
+        if args.routes and route[0] not in args.routes:
+            continue
+        routes[route[0]] = run_route(clients, counters, route, args.requests, args.warmup,
+                                     args.memory_samples)
+        print(f'  {route[0]:<28} {format_result(routes[route[0]])}', flush=True)
+    storage.close()
+    return {'books': n_books, 'students': n_students, 'issues': n_issues,
+            'setup_seconds': round(setup_seconds, 2), 'routes': routes}
+
+
+def format_result(result):
+    if 'skipped' in result:
+        return f'skipped ({result["skipped"]})'
+    return (f'{result["throughput"]:9.1f} req/s  p50 {result["p50_ms"]:8.3f} ms  '
+            f'p99 {result["p99_ms"]:8.3f} ms  peak {result["peak_memory_kb"]:9.1f} KiB')
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding='utf-8') as stream:
+        before = json.load(stream)
+    with open(after_path, encoding='utf-8') as stream:
+        after = json.load(stream)
+    print(f'{before.get("commit")} -> {after.get("commit")}  (p50 and p99 ratios, after / before)')
+    for scale, run in after['scales'].items():
+        old_run = before['scales'].get(scale)
+        if old_run is None:
+            continue
+        print(f'\nscale {scale}')
+        for name, result in run['routes'].items():
+            old = old_run['routes'].get(name)
+            if not old or 'skipped' in old or 'skipped' in result:
+                continue
+            p50 = result['p50_ms'] / old['p50_ms'] if old['p50_ms'] else float('inf')
+            p99 = result['p99_ms'] / old['p99_ms'] if old['p99_ms'] else float('inf')
+            flag = '  <-- slower' if p50 > 1.25 else ''
+            print(f'  {name:<28} p50 x{p50:6.2f}  p99 x{p99:6.2f}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--students', type=float, default=1.0, help='students per book')
+    parser.add_argument('--issues', type=float, default=1.0, help='loans per book')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--memory-samples', type=int, default=5)
+    parser.add_argument('--routes', nargs='*', help='only these route names')
+    parser.add_argument('--cache', action='store_true', help='leave the response cache on')
+    parser.add_argument('--no-index', action='store_true', help='serve reads from SQLite only')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    from app import app
+    app.config['CACHE_ENABLED'] = args.cache
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'requests': args.requests, 'cache': args.cache, 'index': not args.no_index},
+        'scales': {},
+    }
+    for scale in args.scales:
+        n_students = max(1, int(scale * args.students))
+        n_issues = int(scale * args.issues)
+        print(f'\n{scale} books, {n_students} students, {n_issues} loans', flush=True)
+        results['scales'][str(scale)] = bench_scale(app, scale, n_students, n_issues, args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            json.dump(results, stream, indent=2)
+        print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Cold start: import time, startup time and first-request latency.
+
+Each run is a fresh interpreter that imports the app, optionally preloads
+it as wsgi.py does, then times its first two page loads. Scenarios:
+
+  first boot        empty store (seeded on first use), no template cache
+  cold templates    --books titles in the store, empty template cache
+  cached templates  the same store with a warm bytecode cache
+  preloaded         warm cache, and preload() run before the first request
+
+    python benchmarks/bench_startup.py --books 100000 --repeat 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GENRES = ('Fiction', 'History', 'Science', 'Fantasy', 'Biography')
+PAGES = ('/', '/login/student')
+
+
+def child(preload):
+    # Runs in the fresh interpreter and prints its timings as JSON
+    started = time.perf_counter()
+    import app as library_app
+    timings = {'import': time.perf_counter() - started}
+    started = time.perf_counter()
+    if preload:
+        library_app.create_app()
+    timings['startup'] = time.perf_counter() - started
+    client = library_app.app.test_client()
+    for n, page in enumerate(PAGES, 1):
+        started = time.perf_counter()
+        assert client.get(page).status_code == 200
+        timings[f'request {n}'] = time.perf_counter() - started
+    print(json.dumps(timings))
+
+
+def generate(path, n_books):
+    from library.storage import SQLiteStorage
+    storage = SQLiteStorage(path)
+    with storage.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO books (id, title, author, isbn, genre) VALUES (?, ?, ?, ?, ?)',
+            ((f'book-{i}', f'Title {i}', f'Author {i % 997}', f'{9780000000000 + i}',
+              GENRES[i % len(GENRES)]) for i in range(n_books)))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded', '1')")
+    storage.close()
+
+
+def run(database, template_cache, preload):
+    env = dict(os.environ, LIBRARY_STORAGE_URL=f'sqlite:///{database}',
+               LIBRARY_TEMPLATE_CACHE=template_cache, LIBRARY_SCHEDULER='0')
+    args = [sys.executable, os.path.abspath(__file__), '--child'] + (['--preload'] if preload else [])
+    output = subprocess.run(args, env=env, cwd=ROOT, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=20000, help='titles in the store')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--preload', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.preload)
+
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'bench.db')
+    generate(database, args.books)
+    warm = os.path.join(directory, 'warm')
+    run(database, warm, False)
+
+    def first_boot():
+        fresh = tempfile.mkdtemp(dir=directory)
+        return run(os.path.join(fresh, 'new.db'), os.path.join(fresh, 'templates'), False)
+
+    scenarios = (
+        ('first boot', first_boot),
+        ('cold templates', lambda: run(database, tempfile.mkdtemp(dir=directory), False)),
+        ('cached templates', lambda: run(database, warm, False)),
+        ('preloaded', lambda: run(database, warm, True)),
+    )
+    print(f'{args.books:,} books, median of {args.repeat} runs, ms')
+    columns = ('import', 'startup', 'request 1', 'request 2')
+    print(f'  {"":<18}' + ''.join(f'{name:>11}' for name in columns) + f'{"to serve":>11}')
+    for name, scenario in scenarios:
+        runs = [scenario() for _ in range(args.repeat)]
+        medians = {column: statistics.median(timings[column] for timings in runs) * 1000 for column in columns}
+        ready = medians['import'] + medians['startup'] + medians['request 1']
+        print(f'  {name:<18}' + ''.join(f'{medians[column]:11.1f}' for column in columns)
+              + f'{ready:11.1f}')
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Concurrent issue/return stress test for atomic book reservation.
+
+Several worker processes, each with several threads and its own storage
+instance (as under a multi-worker WSGI server), race to reserve and return a
+small pool of books in one shared SQLite file. Exits non-zero if any copy
+ever had two active loans, or if the maintained counters or inventory drift.
+
+    python benchmarks/stress_circulation.py --processes 4 --threads 8 --ops 500 --copies 3
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+def open_store(path, indexed):
+    backend = SQLiteStorage(path)
+    return (IndexedStorage(backend) if indexed else backend), backend
+
+
+def worker(path, indexed, n_threads, n_ops, n_books, results):
+    storage, backend = open_store(path, indexed)
+    totals = {'reserved': 0, 'conflicts': 0, 'returned': 0, 'violations': 0}
+    lock = threading.Lock()
+
+    def run(seed):
+        rng = random.Random(seed)
+        held = []
+        local = dict.fromkeys(totals, 0)
+        for _ in range(n_ops):
+            if held and rng.random() < 0.5:
+                if storage.delete_issue(held.pop(rng.randrange(len(held)))):
+                    local['returned'] += 1
+                continue
+            book_id = f'book-{rng.randrange(n_books)}'
+            issue = {
+                'id': f'issue-{uuid.uuid4()}',
+                'bookId': book_id,
+                'studentId': f'student-{seed}',
+                'issueDate': '2026-01-01',
+                'returnDate': '2026-01-08',
+                'status': 'issued',
+            }
+            if storage.reserve_book(issue):
+                local['reserved'] += 1
+                held.append(issue['id'])
+                # Straight from the database: ours must be the only active
+                # loan on its copy
+                copy_id = backend.get_issue(issue['id'])['copyId']
+                active = [row['id'] for row in backend.issues_for_book(book_id)
+                          if row['copyId'] == copy_id and row['status'] in ('issued', 'requested', 'overdue')]
+                if active != [issue['id']]:
+                    local['violations'] += 1
+            else:
+                local['conflicts'] += 1
+        for issue_id in held:
+            if storage.delete_issue(issue_id):
+                local['returned'] += 1
+        with lock:
+            for key, value in local.items():
+                totals[key] += value
+
+    threads = [threading.Thread(target=run, args=(os.getpid() * 1000 + i,)) for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=250, help='operations per thread')
+    parser.add_argument('--books', type=int, default=20, help='size of the contended book pool')
+    parser.add_argument('--copies', type=int, default=1, help='copies of each book')
+    parser.add_argument('--no-index', action='store_true', help='use the SQLite backend directly')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    setup, _ = open_store(path, indexed=False)
+    setup.add_books([{'id': f'book-{i}', 'title': f'Book {i}', 'author': 'Stress',
+                      'isbn': str(i), 'genre': None} for i in range(args.books)])
+    for i in range(args.books):
+        setup.add_copies(f'book-{i}', args.copies - 1)
+
+    results = multiprocessing.Queue()
+    start = time.perf_counter()
+    processes = [multiprocessing.Process(target=worker, args=(
+        path, not args.no_index, args.threads, args.ops, args.books, results))
+        for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    totals = {}
+    for _ in processes:
+        for key, value in results.get().items():
+            totals[key] = totals.get(key, 0) + value
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    check = SQLiteStorage(path)
+    duplicates = check._all(
+        "SELECT copyId, COUNT(*) AS n FROM issues WHERE status IN ('issued', 'requested', 'overdue') "
+        'GROUP BY copyId HAVING n > 1')
+    drift = check.check_counters()
+    ops = args.processes * args.threads * args.ops
+
+    print(f'{args.processes} processes x {args.threads} threads x {args.ops} ops '
+          f'over {args.books} books x {args.copies} copies in {elapsed:.2f}s ({ops / elapsed:.0f} ops/s)')
+    for key in ('reserved', 'conflicts', 'returned', 'violations'):
+        print(f'  {key:<12} {totals.get(key, 0)}')
+    print(f'  active loans left   {check.count_issues()}')
+    print(f'  duplicate loans     {len(duplicates)}')
+    print(f'  counter mismatches  {len(drift)}')
+
+    if totals.get('violations') or duplicates or drift or check.count_issues():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.environ.get('LIBRARY_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('LIBRARY_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('LIBRARY_THREADS', '4'))
+worker_class = 'gthread'
+
+# Import the app in the master, so the catalog index and compiled templates
+# are built once and shared copy-on-write by every worker
+preload_app = True
+
+timeout = int(os.environ.get('LIBRARY_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound slow leaks; 0 turns it off
+max_requests = int(os.environ.get('LIBRARY_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
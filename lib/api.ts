@@ -0,0 +1,144 @@
+import type { Book, BookIssue, Branch, Student } from "@/types/library"
+
+// Client for the Flask JSON API. Requests carry the session cookie, so the
+// user must be logged in; batch lookups take up to 500 ids per call.
+
+export interface BatchResult<T> {
+  items: T[]
+  missing: string[]
+}
+
+export interface IssueList {
+  items: BookIssue[]
+  books?: Record<string, Book>
+  next?: string | null
+  prev?: string | null
+}
+
+export type BookWithStock = Book & {
+  available: boolean
+  copies: { total: number; available: number; onHold: number; queued: number }
+}
+
+async function getJson<T>(path: string, params: Record<string, string | string[] | undefined>): Promise<T> {
+  const query = new URLSearchParams()
+  for (const [key, value] of Object.entries(params)) {
+    if (value !== undefined && value.length > 0) {
+      query.set(key, Array.isArray(value) ? value.join(",") : value)
+    }
+  }
+  const response = await fetch(`${path}?${query}`, { credentials: "same-origin" })
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}))
+    throw new Error(body.error ?? `${path} returned ${response.status}`)
+  }
+  return response.json()
+}
+
+async function postJson<T>(path: string, body: unknown): Promise<T> {
+  const response = await fetch(path, {
+    method: "POST",
+    credentials: "same-origin",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body),
+  })
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}))
+    throw new Error(error.error ?? `${path} returned ${response.status}`)
+  }
+  return response.json()
+}
+
+export function fetchBooks(ids: string[], fields?: (keyof BookWithStock)[]) {
+  return getJson<BatchResult<BookWithStock>>("/api/books", { ids, fields })
+}
+
+export function fetchStudents(ids: string[], fields?: (keyof Student)[]) {
+  return getJson<BatchResult<Omit<Student, "password">>>("/api/students", { ids, fields })
+}
+
+export function fetchIssues(
+  options: {
+    studentIds?: string[]
+    status?: "issued" | "requested" | "overdue"
+    branch?: string
+    includeBooks?: boolean
+  } = {},
+) {
+  return getJson<IssueList>("/api/issues", {
+    studentId: options.studentIds,
+    status: options.status,
+    branch: options.branch,
+    include: options.includeBooks ? "books" : undefined,
+  })
+}
+
+export function fetchBranches() {
+  return getJson<{ items: Branch[] }>("/api/branches", {})
+}
+
+// Without a branch the search covers every branch
+export function searchBooks(query: string, options: { branch?: string; limit?: number } = {}) {
+  return getJson<{ query: string; items: BookWithStock[] }>("/api/books/search", {
+    q: query,
+    branch: options.branch,
+    limit: options.limit?.toString(),
+  })
+}
+
+export type ReportName = "mostBorrowed" | "genreWeeks" | "loanDuration" | "mostOverdue"
+
+export interface Reports {
+  asOf: string
+  loans: number
+  mostBorrowed?: { bookId: string; title: string; author: string; genre: string; loans: number }[]
+  genreWeeks?: { weeks: string[]; series: { genre: string; total: number; loans: number[] }[] }
+  loanDuration?: {
+    loans: number
+    averageDays: number | null
+    medianDays: number | null
+    byGenre: { genre: string; loans: number; averageDays: number }[]
+  }
+  mostOverdue?: { studentId: string; name: string; rollNo: string; overdueDays: number; overdueLoans: number }[]
+}
+
+// Admin only. since/until are ISO dates bounding the issue date.
+export function fetchReports(
+  options: { include?: ReportName[]; since?: string; until?: string; limit?: number; weeks?: number } = {},
+) {
+  return getJson<Reports>("/api/reports", {
+    include: options.include,
+    since: options.since,
+    until: options.until,
+    limit: options.limit?.toString(),
+    weeks: options.weeks?.toString(),
+  })
+}
+
+export type JobKind = "export" | "statements" | "overdue"
+
+export interface Job {
+  id: string
+  kind: JobKind
+  params: Record<string, string | number>
+  status: "queued" | "running" | "done" | "failed"
+  progress: { done: number; total: number }
+  result: { file?: string; counts: Record<string, number> } | null
+  error: string | null
+  owner: string | null
+  created: string
+  started: string | null
+  finished: string | null
+  // Set once a job that writes a file is done
+  download?: string
+}
+
+// Admin only. Jobs run in the background; poll fetchJob until the status
+// is done or failed, then fetch job.download for the file.
+export function startJob(kind: JobKind, params: Record<string, string | number> = {}) {
+  return postJson<Job>("/api/jobs", { kind, params })
+}
+
+export function fetchJob(id: string) {
+  return getJson<Job>(`/api/jobs/${encodeURIComponent(id)}`, {})
+}
@@ -0,0 +1,2 @@
+from library.storage import Storage, SQLiteStorage, open_storage
+from library.index import CatalogIndex, IndexedStorage
@@ -0,0 +1,289 @@
+import threading
+import time
+from datetime import date
+
+from library import journal
+
+# numpy is imported by available(), on first use: it is the slowest import
+# the app has, and most workers never serve a report
+np = None
+_imported = False
+
+# Circulation reports over every loan, returned or still out.
+#
+# Loans are held column-wise in numpy arrays, one element per loan: dates
+# as date.toordinal() day numbers and book, student and genre ids as small
+# integer codes into lookup lists. A report is then a handful of vectorized
+# passes (masks, bincount group-bys, a partial sort for the top entries)
+# instead of a Python loop over millions of rows, at 24 bytes per loan.
+#
+# Returned loans come from loan_history, which only ever grows, so only the
+# rows added since the last load are read. Loans still out are re-read on
+# every load. Reading every returned loan from SQLite runs at a few hundred
+# thousand rows a second, so the returned-loan columns can be saved to a
+# snapshot file and a new process resumes from it. numpy is optional:
+# without it available() is False and the reports are switched off. Call
+# available() before anything else here.
+
+COLUMNS = ('issued', 'due', 'closed', 'book', 'student')
+# closed day of a loan that is still out
+OPEN = -1
+UNCATEGORIZED = 'Uncategorized'
+
+
+def available():
+    global np, _imported
+    if not _imported:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        _imported = True
+    return np is not None
+
+
+def monday(ordinal):
+    # date.fromordinal(1) is a Monday
+    return ordinal - (ordinal - 1) % 7
+
+
+class LoanTable:
+    # An immutable snapshot of the columns; LoanColumns swaps in a new one
+    # on every load, so reports never see a half-finished one
+
+    def __init__(self, columns, book_ids, student_ids, genres, book_genre, as_of):
+        self.issued, self.due, self.closed, self.book, self.student = (
+            columns[name] for name in COLUMNS)
+        self.book_ids = book_ids
+        self.student_ids = student_ids
+        self.genres = genres
+        # genre code per book code, and per loan
+        self.book_genre = book_genre
+        self.genre = book_genre[self.book]
+        self.as_of = as_of
+
+    def __len__(self):
+        return len(self.issued)
+
+    def window(self, since=None, until=None):
+        # Mask of the loans issued between since and until (dates, inclusive),
+        # or None for all of them
+        mask = None
+        if since is not None:
+            mask = self.issued >= since.toordinal()
+        if until is not None:
+            before = self.issued <= until.toordinal()
+            mask = before if mask is None else mask & before
+        return mask
+
+
+def _codes(values, codes):
+    # Integer code per value, giving unseen values the next free codes
+    for value in set(values).difference(codes):
+        codes[value] = len(codes)
+    return np.fromiter(map(codes.__getitem__, values), np.int32, len(values))
+
+
+def _select(column, mask):
+    return column if mask is None else column[mask]
+
+
+def _bucket(codes, mask, spare):
+    # codes with the rows outside mask moved to the spare code, which is
+    # cheaper than copying out the rows inside it when most of them are
+    return codes if mask is None else np.where(mask, codes, spare)
+
+
+def _top(values, limit):
+    # Indices of the `limit` largest non-zero values, largest first, ties
+    # broken by index
+    if limit <= 0:
+        return []
+    candidates = np.flatnonzero(values > 0)
+    if len(candidates) > limit:
+        cut = np.partition(values[candidates], len(candidates) - limit)[len(candidates) - limit]
+        candidates = candidates[values[candidates] >= cut]
+    order = np.lexsort((candidates, -values[candidates]))
+    return candidates[order[:limit]].tolist()
+
+
+class LoanColumns:
+    # Loads loans from a storage and keeps the current LoanTable. Loads are
+    # incremental and at most one runs at a time.
+
+    def __init__(self):
+        self.table = None
+        self.generations = None
+        self.loaded = 0.0
+        self._lock = threading.Lock()
+        self._after = 0
+        self._closed = {name: np.empty(0, np.int32) for name in COLUMNS}
+        self._book_codes = {}
+        self._student_codes = {}
+        # Genre per book code, as of the books generation in _genres_at
+        self._book_genres = []
+        self._genres_at = None
+        self.saved_after = None
+
+    @property
+    def after(self):
+        # loan_history rowid the returned-loan columns run up to
+        return self._after
+
+    def refresh(self, storage, max_age=0):
+        # Current table, reloaded when books or issues have changed since
+        # the last load and that load is older than max_age seconds
+        if self.table is not None and not self._stale(storage, max_age):
+            return self.table
+        with self._lock:
+            if self.table is None or self._stale(storage, max_age):
+                self._load(storage)
+            return self.table
+
+    def _stale(self, storage, max_age):
+        if time.time() - self.loaded < max_age:
+            return False
+        return self._watched(storage) != self.generations
+
+    @staticmethod
+    def _watched(storage):
+        generations = storage.generations()
+        return generations.get('books'), generations.get('issues')
+
+    def _load(self, storage):
+        generations = self._watched(storage)
+        loaded = time.time()
+        book_codes, student_codes = self._book_codes, self._student_codes
+
+        chunks = {name: [self._closed[name]] for name in COLUMNS}
+        for rows in storage.closed_loans(self._after):
+            seqs, issued, due, closed, books, students = zip(*rows)
+            chunks['issued'].append(np.array(issued, np.int32))
+            chunks['due'].append(np.array(due, np.int32))
+            chunks['closed'].append(np.array(closed, np.int32))
+            chunks['book'].append(_codes(books, book_codes))
+            chunks['student'].append(_codes(students, student_codes))
+            self._after = seqs[-1]
+        if len(chunks['issued']) > 1:
+            self._closed = {name: np.concatenate(parts) for name, parts in chunks.items()}
+
+        current = {name: [self._closed[name]] for name in COLUMNS}
+        for rows in storage.open_loans():
+            issued, due, books, students = zip(*rows)
+            current['issued'].append(np.array(issued, np.int32))
+            current['due'].append(np.array(due, np.int32))
+            current['closed'].append(np.full(len(rows), OPEN, np.int32))
+            current['book'].append(_codes(books, book_codes))
+            current['student'].append(_codes(students, student_codes))
+        columns = {name: np.concatenate(parts) for name, parts in current.items()}
+
+        book_ids = list(book_codes)
+        # Only the books with loans are read, and only those new since the
+        # last load unless a book has changed since
+        if generations[0] != self._genres_at:
+            self._book_genres = []
+            self._genres_at = generations[0]
+        new = book_ids[len(self._book_genres):]
+        if new:
+            books = storage.get_books(new)
+            self._book_genres.extend((books[book_id]['genre'] if book_id in books else None)
+                                     or UNCATEGORIZED for book_id in new)
+        genres = {}
+        book_genre = np.fromiter((genres.setdefault(genre, len(genres)) for genre in self._book_genres),
+                                 np.int32, len(book_ids))
+        self.table = LoanTable(columns, book_ids, list(student_codes), list(genres), book_genre,
+                               loaded)
+        self.generations = generations
+        self.loaded = loaded
+
+    # Snapshots of the returned-loan columns, tagged with the database's
+    # journal id so they are never resumed against another database
+    def save(self, path, database_id):
+        with self._lock:
+            state = {'kind': 'loans', 'journal_id': database_id, 'after': self._after,
+                     'closed': self._closed, 'book_ids': list(self._book_codes),
+                     'student_ids': list(self._student_codes)}
+            journal.write_snapshot(path, state)
+            self.saved_after = self._after
+
+    def restore(self, path, database_id):
+        state = journal.read_snapshot(path)
+        if (state is None or state.get('kind') != 'loans' or database_id is None
+                or state.get('journal_id') != database_id):
+            return False
+        with self._lock:
+            self._after = self.saved_after = state['after']
+            self._closed = state['closed']
+            self._book_codes = {book_id: code for code, book_id in enumerate(state['book_ids'])}
+            self._student_codes = {student_id: code
+                                   for code, student_id in enumerate(state['student_ids'])}
+            self._book_genres = []
+            self.table = None
+        return True
+
+
+# Reports. Each takes a LoanTable and returns plain lists and dicts, ready
+# to be serialized; since and until are dates bounding the issue date.
+
+def most_borrowed(table, limit=10, since=None, until=None):
+    mask = table.window(since, until)
+    counts = np.bincount(_select(table.book, mask), minlength=len(table.book_ids))
+    return [{'bookId': table.book_ids[code],
+             'genre': table.genres[table.book_genre[code]],
+             'loans': int(counts[code])} for code in _top(counts, limit)]
+
+
+def loans_per_genre_per_week(table, weeks=12, until=None):
+    # Loans issued in each of the last `weeks` weeks (Monday to Sunday, the
+    # last one holding until), per genre, busiest genre first
+    last = until.toordinal() if until is not None else date.today().toordinal()
+    first = monday(last) - 7 * (weeks - 1)
+    mask = (table.issued >= first) & (table.issued <= last)
+    n_genres = len(table.genres)
+    week = (table.issued[mask] - first) // 7
+    keys = week * n_genres + table.genre[mask]
+    counts = np.bincount(keys, minlength=weeks * n_genres).reshape(weeks, n_genres)
+    totals = counts.sum(axis=0)
+    series = [{'genre': table.genres[code], 'total': int(totals[code]),
+               'loans': counts[:, code].tolist()} for code in _top(totals, n_genres)]
+    return {'weeks': [date.fromordinal(first + 7 * i).isoformat() for i in range(weeks)],
+            'series': series}
+
+
+def loan_duration(table, since=None, until=None):
+    # Days from issue to return over the returned loans, overall and per genre
+    mask = table.closed != OPEN
+    window = table.window(since, until)
+    if window is not None:
+        mask &= window
+    n_genres = len(table.genres)
+    genre = _bucket(table.genre, mask, n_genres)
+    days = np.maximum(table.closed - table.issued, 0)
+    counts = np.bincount(genre, minlength=n_genres + 1)[:n_genres]
+    sums = np.bincount(genre, weights=days, minlength=n_genres + 1)[:n_genres]
+    by_genre = [{'genre': table.genres[code], 'loans': int(counts[code]),
+                 'averageDays': round(float(sums[code] / counts[code]), 2)}
+                for code in _top(counts, n_genres)]
+    loans = int(counts.sum())
+    if not loans:
+        return {'loans': 0, 'averageDays': None, 'medianDays': None, 'byGenre': by_genre}
+    return {'loans': loans,
+            'averageDays': round(float(sums.sum() / loans), 2),
+            'medianDays': float(np.median(days[mask])),
+            'byGenre': by_genre}
+
+
+def most_overdue(table, limit=10, since=None, until=None, today=None):
+    # Students by total days their loans were (or still are) kept past the
+    # return date; loans still out count up to today
+    today = (today or date.today()).toordinal()
+    late = np.maximum(table.closed - table.due, 0)
+    still_out = np.flatnonzero(table.closed == OPEN)
+    late[still_out] = np.maximum(today - table.due[still_out], 0)
+    n_students = len(table.student_ids)
+    student = _bucket(table.student, table.window(since, until), n_students)
+    days = np.bincount(student, weights=late, minlength=n_students + 1)[:n_students]
+    loans = np.bincount(student[late > 0], minlength=n_students + 1)[:n_students]
+    return [{'studentId': table.student_ids[code], 'overdueDays': int(days[code]),
+             'overdueLoans': int(loans[code])} for code in _top(days, limit)]
+
@@ -0,0 +1,160 @@
+import csv
+import io
+import json
+import uuid
+
+from library.records import DEFAULT_BRANCH
+from library.storage import BOOK_FIELDS, STUDENT_FIELDS, ISSUE_FIELDS
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = {
+    'books': BOOK_FIELDS,
+    # Password hashes stay in the database
+    'students': tuple(field for field in STUDENT_FIELDS if field != 'password'),
+    'issues': ISSUE_FIELDS,
+}
+DEFAULT_BATCH_SIZE = 1000
+# Only the first errors are kept in the report; the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(filename=None, mimetype=None, default='csv'):
+    if filename:
+        if filename.endswith(('.jsonl', '.ndjson', '.json')):
+            return 'jsonl'
+        if filename.endswith('.csv'):
+            return 'csv'
+    if mimetype and ('json' in mimetype or 'ndjson' in mimetype):
+        return 'jsonl'
+    return default
+
+
+def read_rows(stream, fmt):
+    # Yields (line number, row dict or error message) from a text stream
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, f'Invalid JSON: {e}'
+                continue
+            yield line_num, row if isinstance(row, dict) else 'Expected a JSON object'
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errorsTruncated': self.failed > len(self.errors),
+        }
+
+
+def _clean_book(row, branch):
+    book = {field: str(row.get(field) or '').strip() for field in BOOK_FIELDS}
+    for field in ('title', 'author', 'isbn'):
+        if not book[field]:
+            return None, f'Missing {field}'
+    book['id'] = book['id'] or f'book-{uuid.uuid4()}'
+    book['genre'] = book['genre'] or None
+    book['branch'] = book['branch'] or branch
+    return book, None
+
+
+def import_books(storage, rows, batch_size=DEFAULT_BATCH_SIZE, branch=DEFAULT_BRANCH):
+    # Streams rows into storage in batches of batch_size, one transaction
+    # per batch. Memory use is bounded by the batch, not by the input size.
+    # Rows without a branch column go to `branch`; ISBNs are unique per branch.
+    report = ImportReport()
+    batch, batch_isbns, batch_ids = [], set(), set()
+    branches = {}
+
+    def flush():
+        if batch:
+            storage.add_books(batch)
+            report.imported += len(batch)
+            batch.clear()
+            batch_isbns.clear()
+            batch_ids.clear()
+
+    for line, row in rows:
+        if isinstance(row, str):
+            report.error(line, row)
+            continue
+        book, error = _clean_book(row, branch)
+        if error:
+            report.error(line, error)
+            continue
+        if book['branch'] not in branches:
+            branches[book['branch']] = storage.get_branch(book['branch']) is not None
+        if not branches[book['branch']]:
+            report.error(line, f'Unknown branch {book["branch"]}')
+            continue
+        key = (book['branch'], book['isbn'])
+        if key in batch_isbns or storage.find_book_by_isbn(book['isbn'], book['branch']):
+            report.error(line, f'A book with ISBN {book["isbn"]} already exists at this branch')
+            continue
+        if book['id'] in batch_ids or storage.get_book(book['id']):
+            report.error(line, f'A book with id {book["id"]} already exists')
+            continue
+        batch.append(book)
+        batch_isbns.add(key)
+        batch_ids.add(book['id'])
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return report
+
+
+def export_rows(storage, entity, fmt, chunk_rows=500, rows=None, header=True):
+    # Yields the export as text chunks while iterating a storage cursor.
+    # rows limits it to one part of storage.row_ranges(); parts after the
+    # first leave out the CSV header, so they can be concatenated.
+    if entity not in EXPORT_FIELDS:
+        raise ValueError(f'Unknown export: {entity}')
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported format: {fmt}')
+    return format_rows(getattr(storage, f'iter_{entity}')(rows), entity, fmt, chunk_rows, header)
+
+
+def format_rows(records, entity, fmt, chunk_rows=500, header=True):
+    fields = EXPORT_FIELDS[entity]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    if fmt == 'csv' and header:
+        writer.writeheader()
+    pending = 0
+    for record in records:
+        if fmt == 'csv':
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps({field: record.get(field) for field in fields}))
+            buffer.write('\n')
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
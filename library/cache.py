@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedResponse:
+    __slots__ = ('body', 'status', 'mimetype', 'etag', 'last_modified', 'tags', 'expires')
+
+    def __init__(self, body, status, mimetype, etag, last_modified, tags, expires):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.etag = etag
+        self.last_modified = last_modified
+        self.tags = tags
+        self.expires = expires
+
+
+class ResponseCache:
+    # Bounded LRU of rendered responses with a TTL. Each entry is tagged with
+    # the collections it was built from ('books', 'students', 'issues'), and
+    # invalidate() drops only the entries that depend on a changed collection.
+
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_tag = {}
+        self._generations = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def entry(self, body, status, mimetype, etag, last_modified, tags):
+        return CachedResponse(body, status, mimetype, etag, last_modified, tuple(tags),
+                              time.monotonic() + self.ttl)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._by_tag.pop(tag, ()):
+                    self._drop(key)
+
+    def sync(self, generations):
+        # Invalidates the tags whose storage generation moved since the last
+        # sync, which also catches writes made by other worker processes
+        if generations == self._generations:
+            return
+        previous, self._generations = self._generations, generations
+        if previous is None:
+            self.clear()
+            return
+        self.invalidate(*[tag for tag, value in generations.items() if previous.get(tag) != value])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tag.clear()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,184 @@
+import uuid
+from datetime import date, timedelta
+
+# Batch circulation for the desk client. Items name books by id or ISBN
+# (the barcode on the book) and students by id or roll number (the barcode
+# on the library card). Every item is resolved with one index lookup and a
+# batch is written in one transaction, so a batch costs O(batch) however
+# many loans the library holds.
+
+MAX_BATCH_SIZE = 5000
+DEFAULT_LOAN_DAYS = 7
+MAX_LOAN_DAYS = 365
+
+
+class BatchAborted(Exception):
+    pass
+
+
+class BatchReport:
+
+    def __init__(self, size):
+        self.results = [None] * size
+        self.committed = True
+
+    def ok(self, position, **fields):
+        self.results[position] = dict(item=position, ok=True, **fields)
+
+    def error(self, position, message):
+        self.results[position] = {'item': position, 'ok': False, 'error': message}
+
+    def abort(self):
+        self.committed = False
+        for position, result in enumerate(self.results):
+            if result is None or result['ok']:
+                self.error(position, 'Not applied: another item in the batch failed.')
+
+    @property
+    def failed(self):
+        return sum(result is not None and not result['ok'] for result in self.results)
+
+    def to_dict(self):
+        failed = self.failed
+        return {
+            'committed': self.committed,
+            'succeeded': len(self.results) - failed,
+            'failed': failed,
+            'results': self.results,
+        }
+
+
+def find_book(storage, item):
+    if item.get('bookId'):
+        return storage.get_book(str(item['bookId']))
+    if item.get('isbn'):
+        # An ISBN names a title at one branch, or at any when none is given
+        branch = str(item['branch']) if item.get('branch') else None
+        return storage.find_book_by_isbn(str(item['isbn']).strip(), branch)
+    return None
+
+
+def find_student(storage, item):
+    if item.get('studentId'):
+        return storage.get_student(str(item['studentId']))
+    if item.get('rollNo'):
+        return storage.find_student_by_roll_no(str(item['rollNo']).strip())
+    return None
+
+
+def _issue_id(item):
+    # A bare string is an issue id
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict) and item.get('issueId'):
+        return str(item['issueId'])
+    return None
+
+
+def _run(storage, report, apply, atomic):
+    # With atomic, one failed item rolls back the whole batch. Items that do
+    # not resolve abort it before anything is written; the rest can only
+    # fail while writing, and the rollback then just drops their pending
+    # index updates
+    if atomic and report.failed:
+        report.abort()
+        return report
+    try:
+        with storage.transaction():
+            apply()
+            if atomic and report.failed:
+                raise BatchAborted()
+    except BatchAborted:
+        report.abort()
+    return report
+
+
+def issue_books(storage, items, issue_date=None, loan_days=DEFAULT_LOAN_DAYS, atomic=False):
+    if not 1 <= loan_days <= MAX_LOAN_DAYS:
+        raise ValueError(f'loan_days must be between 1 and {MAX_LOAN_DAYS}')
+    issue_date = issue_date or date.today()
+    # OverflowError past date.max, before anything is written
+    return_date = (issue_date + timedelta(days=loan_days)).isoformat()
+    report = BatchReport(len(items))
+    pending = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            report.error(position, 'Expected a book and a student.')
+            continue
+        book = find_book(storage, item)
+        student = find_student(storage, item)
+        if book is None or student is None:
+            report.error(position, 'Book not found.' if book is None else 'Student not found.')
+            continue
+        pending.append((position, {
+            'id': f'issue-{uuid.uuid4()}',
+            'bookId': book['id'],
+            'studentId': student['id'],
+            'issueDate': issue_date.isoformat(),
+            'returnDate': return_date,
+            'status': 'issued',
+        }))
+
+    def apply():
+        reserved = storage.reserve_books([issue for _, issue in pending])
+        for (position, issue), ok in zip(pending, reserved):
+            if ok:
+                report.ok(position, issueId=issue['id'], bookId=issue['bookId'],
+                          studentId=issue['studentId'], returnDate=issue['returnDate'])
+            else:
+                report.error(position, 'No copy of this book is available.')
+    return _run(storage, report, apply, atomic)
+
+
+def _find_loan(storage, item):
+    # The student's loan of the book, for desks that scan the book and card
+    book = find_book(storage, item)
+    student = find_student(storage, item)
+    if book is None or student is None:
+        return None
+    for issue in storage.issues_for_student(student['id']):
+        if issue['bookId'] == book['id'] and issue['status'] != 'requested':
+            return issue['id']
+    return None
+
+
+def return_books(storage, items, atomic=False):
+    report = BatchReport(len(items))
+    pending = []
+    for position, item in enumerate(items):
+        issue_id = _issue_id(item)
+        if issue_id is None and isinstance(item, dict):
+            issue_id = _find_loan(storage, item)
+        if issue_id is None:
+            report.error(position, 'Loan not found.')
+            continue
+        pending.append((position, issue_id))
+
+    def apply():
+        returned = storage.delete_issues([issue_id for _, issue_id in pending])
+        for (position, issue_id), ok in zip(pending, returned):
+            if ok:
+                report.ok(position, issueId=issue_id)
+            else:
+                report.error(position, 'This book has already been returned.')
+    return _run(storage, report, apply, atomic)
+
+
+def approve_requests(storage, items, atomic=False):
+    report = BatchReport(len(items))
+    pending = []
+    for position, item in enumerate(items):
+        issue_id = _issue_id(item)
+        if issue_id is None:
+            report.error(position, 'Expected an issue id.')
+            continue
+        pending.append((position, issue_id))
+
+    def apply():
+        approved = storage.approve_requests([issue_id for _, issue_id in pending])
+        for (position, issue_id), ok in zip(pending, approved):
+            if ok:
+                report.ok(position, issueId=issue_id)
+            else:
+                report.error(position, 'Request not found.')
+    return _run(storage, report, apply, atomic)
@@ -0,0 +1,158 @@
+# Materialized counters for the dashboard and users pages. Triggers update
+# them inside the same transaction as the write that changes the underlying
+# rows, so they are never observed out of step with the data.
+#
+#   counters.books        books in the catalog
+#   counters.students     registered students
+#   counters.issues       issue records (issued loans and pending requests)
+#   counters.requests     pending requests
+#   counters.unavailable  catalog books with no copy free to lend
+#   student_counters      per-student issues and pending requests
+
+COUNTER_NAMES = ('books', 'students', 'issues', 'requests', 'unavailable')
+
+COUNTERS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS student_counters (
+    studentId TEXT PRIMARY KEY,
+    issues INTEGER NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS counters_books_insert AFTER INSERT ON books BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_books_delete AFTER DELETE ON books BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_students_insert AFTER INSERT ON students BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'students';
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_students_delete AFTER DELETE ON students BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'students';
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_issues_insert AFTER INSERT ON issues BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'issues';
+    UPDATE counters SET value = value + 1 WHERE name = 'requests' AND new.status = 'requested';
+    INSERT INTO student_counters (studentId, issues, requests)
+        VALUES (new.studentId, 1, new.status = 'requested')
+        ON CONFLICT (studentId) DO UPDATE SET
+            issues = issues + 1,
+            requests = requests + excluded.requests;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_issues_delete AFTER DELETE ON issues BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'issues';
+    UPDATE counters SET value = value - 1 WHERE name = 'requests' AND old.status = 'requested';
+    UPDATE student_counters SET
+        issues = issues - 1,
+        requests = requests - (old.status = 'requested')
+        WHERE studentId = old.studentId;
+    DELETE FROM student_counters WHERE studentId = old.studentId AND issues <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_issues_update
+AFTER UPDATE OF bookId, studentId, status ON issues
+WHEN old.bookId IS NOT new.bookId OR old.studentId IS NOT new.studentId
+    OR (old.status = 'requested') != (new.status = 'requested') BEGIN
+    UPDATE counters SET value = value
+        - (old.status = 'requested') + (new.status = 'requested')
+        WHERE name = 'requests';
+    UPDATE student_counters SET
+        issues = issues - 1,
+        requests = requests - (old.status = 'requested')
+        WHERE studentId = old.studentId;
+    INSERT INTO student_counters (studentId, issues, requests)
+        VALUES (new.studentId, 1, new.status = 'requested')
+        ON CONFLICT (studentId) DO UPDATE SET
+            issues = issues + 1,
+            requests = requests + excluded.requests;
+    DELETE FROM student_counters WHERE studentId = old.studentId AND issues <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_inventory_insert AFTER INSERT ON inventory BEGIN
+    UPDATE counters SET value = value + (new.available <= 0) WHERE name = 'unavailable';
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_inventory_delete AFTER DELETE ON inventory BEGIN
+    UPDATE counters SET value = value - (old.available <= 0) WHERE name = 'unavailable';
+END;
+
+CREATE TRIGGER IF NOT EXISTS counters_inventory_update AFTER UPDATE OF available ON inventory BEGIN
+    UPDATE counters SET value = value - (old.available <= 0) + (new.available <= 0)
+        WHERE name = 'unavailable';
+END;
+'''
+
+# Definitions from before copies existed, replaced on upgrade
+LEGACY_TRIGGERS = ('counters_books_insert', 'counters_books_delete', 'counters_issues_insert',
+                   'counters_issues_delete', 'counters_issues_update')
+
+# Ground truth the counters are checked and rebuilt against
+EXPECTED_SQL = {
+    'books': 'SELECT COUNT(*) FROM books',
+    'students': 'SELECT COUNT(*) FROM students',
+    'issues': 'SELECT COUNT(*) FROM issues',
+    'requests': "SELECT COUNT(*) FROM issues WHERE status = 'requested'",
+    'unavailable': 'SELECT COUNT(*) FROM books WHERE NOT EXISTS '
+                   '(SELECT 1 FROM inventory WHERE inventory.bookId = books.id '
+                   'AND inventory.available > 0)',
+}
+
+EXPECTED_STUDENT_SQL = '''
+SELECT studentId, COUNT(*) AS issues, SUM(status = 'requested') AS requests
+FROM issues GROUP BY studentId
+'''
+
+
+# Connections come from SQLiteStorage and return rows as dicts
+def _scalar(conn, sql):
+    return next(iter(conn.execute(sql).fetchone().values()))
+
+
+def _rows(conn, sql):
+    for row in conn.execute(sql):
+        yield tuple(row.values())
+
+
+def install(conn):
+    # Returns True when the counters were just created and need a rebuild
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counters'").fetchone()
+    conn.executescript(COUNTERS_SCHEMA)
+    return not exists
+
+
+def rebuild(conn):
+    for name, sql in EXPECTED_SQL.items():
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                     'ON CONFLICT (name) DO UPDATE SET value = excluded.value',
+                     (name, _scalar(conn, sql)))
+    conn.execute('DELETE FROM student_counters')
+    conn.execute(f'INSERT INTO student_counters (studentId, issues, requests) {EXPECTED_STUDENT_SQL}')
+
+
+def check(conn):
+    # Returns a list of (counter, stored, expected) for every mismatch
+    mismatches = []
+    stored = dict(_rows(conn, 'SELECT name, value FROM counters'))
+    for name, sql in EXPECTED_SQL.items():
+        expected = _scalar(conn, sql)
+        if stored.get(name) != expected:
+            mismatches.append((name, stored.get(name), expected))
+    stored = {sid: (issues, requests) for sid, issues, requests in
+              _rows(conn, 'SELECT studentId, issues, requests FROM student_counters')}
+    expected = {sid: (issues, requests) for sid, issues, requests in
+                _rows(conn, EXPECTED_STUDENT_SQL)}
+    for sid in sorted(set(stored) | set(expected)):
+        if stored.get(sid) != expected.get(sid):
+            mismatches.append((f'student {sid}', stored.get(sid), expected.get(sid)))
+    return mismatches
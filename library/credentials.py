@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Stored hashes are self-describing, so the cost can be raised without
+# invalidating existing passwords; they are rehashed at the next login.
+#
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+#
+# Anything else is a plaintext password from before hashing was added.
+
+HASH_METHODS = ('scrypt', 'pbkdf2_sha256')
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def _unb64(text):
+    return base64.b64decode(text.encode('ascii'))
+
+
+class PasswordHasher:
+
+    def __init__(self, method='scrypt', scrypt_n=2 ** 14, scrypt_r=8, scrypt_p=1,
+                 pbkdf2_iterations=600000):
+        if method not in HASH_METHODS:
+            raise ValueError(f'Unknown password hash: {method}')
+        self.method = method
+        self.scrypt_params = (scrypt_n, scrypt_r, scrypt_p)
+        self.pbkdf2_iterations = pbkdf2_iterations
+        self._dummy = None
+
+    def hash(self, password):
+        salt = os.urandom(SALT_BYTES)
+        if self.method == 'scrypt':
+            n, r, p = self.scrypt_params
+            digest = _scrypt(password, salt, n, r, p)
+            return f'scrypt${n}${r}${p}${_b64(salt)}${_b64(digest)}'
+        digest = _pbkdf2(password, salt, self.pbkdf2_iterations)
+        return f'pbkdf2_sha256${self.pbkdf2_iterations}${_b64(salt)}${_b64(digest)}'
+
+    def verify(self, password, stored):
+        if not password or not stored:
+            return False
+        parts = stored.split('$')
+        try:
+            if parts[0] == 'scrypt' and len(parts) == 6:
+                n, r, p = (int(value) for value in parts[1:4])
+                digest = _scrypt(password, _unb64(parts[4]), n, r, p)
+            elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+                digest = _pbkdf2(password, _unb64(parts[2]), int(parts[1]))
+            else:
+                return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest, _unb64(parts[-1]))
+
+    def verify_dummy(self, password):
+        # Spends the same time as a real check, so a missing account does
+        # not answer faster than a wrong password
+        if self._dummy is None:
+            self._dummy = self.hash('dummy password')
+        self.verify(password, self._dummy)
+        return False
+
+    def needs_rehash(self, stored):
+        parts = stored.split('$')
+        if self.method == 'scrypt':
+            return parts[0] != 'scrypt' or parts[1:4] != [str(value) for value in self.scrypt_params]
+        return parts[0] != 'pbkdf2_sha256' or parts[1:2] != [str(self.pbkdf2_iterations)]
+
+
+def is_hashed(stored):
+    return stored.split('$', 1)[0] in HASH_METHODS
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r, dklen=HASH_BYTES)
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations, HASH_BYTES)
+
+
+class RateLimiter:
+    # Token buckets keyed by anything hashable, such as a username or a
+    # client address. Each bucket holds up to capacity tokens and refills
+    # capacity tokens per period seconds. Only the max_keys most recently
+    # used buckets are kept; an evicted bucket starts over full, which is
+    # what an idle one would have refilled to anyway.
+
+    def __init__(self, capacity, period, max_keys=10000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _level(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def take(self, key):
+        # False, without taking anything, when the bucket is empty
+        now = time.monotonic()
+        with self._lock:
+            level = self._level(key, now)
+            allowed = level >= 1
+            self._buckets[key] = (level - 1 if allowed else level, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+    def give_back(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._buckets:
+                self._buckets[key] = (min(self.capacity, self._level(key, now) + 1), now)
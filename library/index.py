@@ -0,0 +1,718 @@
+import gc
+import threading
+from contextlib import contextmanager
+
+from library import journal
+from library.records import Book, Issue, Student
+from library.storage import Storage
+
+
+@contextmanager
+def _gc_paused():
+    # Bulk loads allocate millions of objects that all survive; letting the
+    # cyclic collector rescan them every few thousand allocations roughly
+    # doubles the load time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class CatalogIndex:
+    # In-process id-keyed maps plus the secondary lookups the routes need.
+    # Rows are kept as compact records (library.records), which read like
+    # the row dicts they replace.
+    #
+    # Per-branch views of the books and issues are built the first time a
+    # branch is asked for and kept up to date from then on, so a worker
+    # only pays for the branches it actually serves.
+
+    def __init__(self):
+        self.books = {}
+        # isbn -> {branch: book id}
+        self.book_by_isbn = {}
+        self.students = {}
+        self.student_by_username = {}
+        self.student_by_roll_no = {}
+        self.issues = {}
+        self.issues_by_book = {}
+        self.issues_by_student = {}
+        # branch -> ({book id: book}, {issue id: issue}), built on first use
+        self._branches = {}
+
+    def branch(self, branch):
+        partition = self._branches.get(branch)
+        if partition is None:
+            partition = self._branches[branch] = (
+                {book.id: book for book in self.books.values() if book.branch == branch},
+                {issue.id: issue for issue in self.issues.values() if issue.branch == branch})
+        return partition
+
+    @classmethod
+    def load(cls, backend):
+        index = cls()
+        with _gc_paused():
+            index._fill(map(Book.from_row, backend.all_books()),
+                        map(Student.from_row, backend.all_students()),
+                        map(Issue.from_row, backend.all_issues()))
+        return index
+
+    def _fill(self, books, students, issues):
+        # Bulk put_* into an empty index: ids are unique, so there is nothing
+        # to drop first
+        by_isbn = self.book_by_isbn
+        for book in books:
+            self.books[book.id] = book
+            bucket = by_isbn.get(book.isbn)
+            if bucket is None:
+                bucket = by_isbn[book.isbn] = {}
+            bucket[book.branch] = book.id
+        for student in students:
+            self.students[student.id] = student
+            self.student_by_username[student.username] = student.id
+            if student.rollNo:
+                self.student_by_roll_no[student.rollNo] = student.id
+        by_book, by_student = self.issues_by_book, self.issues_by_student
+        for issue in issues:
+            self.issues[issue.id] = issue
+            bucket = by_book.get(issue.bookId)
+            if bucket is None:
+                bucket = by_book[issue.bookId] = {}
+            bucket[issue.id] = issue
+            bucket = by_student.get(issue.studentId)
+            if bucket is None:
+                bucket = by_student[issue.studentId] = {}
+            bucket[issue.id] = issue
+
+    # Books
+    def put_book(self, book):
+        book = Book.from_row(book)
+        self.drop_book(book.id)
+        self.books[book.id] = book
+        self.book_by_isbn.setdefault(book.isbn, {})[book.branch] = book.id
+        partition = self._branches.get(book.branch)
+        if partition is not None:
+            partition[0][book.id] = book
+
+    def drop_book(self, book_id):
+        old = self.books.pop(book_id, None)
+        if old is None:
+            return
+        bucket = self.book_by_isbn.get(old.isbn)
+        if bucket is not None and bucket.get(old.branch) == book_id:
+            del bucket[old.branch]
+            if not bucket:
+                del self.book_by_isbn[old.isbn]
+        partition = self._branches.get(old.branch)
+        if partition is not None:
+            partition[0].pop(book_id, None)
+
+    # Students
+    def put_student(self, student):
+        student = Student.from_row(student)
+        self.drop_student(student.id)
+        self.students[student.id] = student
+        self.student_by_username[student.username] = student.id
+        if student.rollNo:
+            self.student_by_roll_no[student.rollNo] = student.id
+
+    def drop_student(self, student_id):
+        old = self.students.pop(student_id, None)
+        if old is None:
+            return
+        for lookup, key in ((self.student_by_username, old.username),
+                            (self.student_by_roll_no, old.rollNo)):
+            if lookup.get(key) == student_id:
+                del lookup[key]
+
+    # Issues
+    def put_issue(self, issue):
+        issue = Issue.from_row(issue)
+        self.drop_issue(issue.id)
+        self.issues[issue.id] = issue
+        self.issues_by_book.setdefault(issue.bookId, {})[issue.id] = issue
+        self.issues_by_student.setdefault(issue.studentId, {})[issue.id] = issue
+        partition = self._branches.get(issue.branch)
+        if partition is not None:
+            partition[1][issue.id] = issue
+
+    def drop_issue(self, issue_id):
+        old = self.issues.pop(issue_id, None)
+        if old is None:
+            return
+        partition = self._branches.get(old.branch)
+        if partition is not None:
+            partition[1].pop(issue_id, None)
+        for group, key in ((self.issues_by_book, old.bookId),
+                           (self.issues_by_student, old.studentId)):
+            bucket = group.get(key)
+            if bucket is not None:
+                bucket.pop(issue_id, None)
+                if not bucket:
+                    del group[key]
+
+    def replace_book_issues(self, book_id, issues):
+        for issue_id in list(self.issues_by_book.get(book_id, ())):
+            self.drop_issue(issue_id)
+        for issue in issues:
+            self.put_issue(issue)
+
+    # Journal replay and snapshots
+    ENTITIES = {'books': Book, 'students': Student, 'issues': Issue}
+
+    def replay(self, events):
+        for _, entity, op, record_id, values in events:
+            record = self.ENTITIES.get(entity)
+            if record is None:
+                continue
+            if op == 'put':
+                if len(values) != len(record.FIELDS):
+                    # Written before a column was added
+                    values = (list(values) + [None] * len(record.FIELDS))[:len(record.FIELDS)]
+                getattr(self, 'put_' + entity[:-1])(record._make(values))
+            else:
+                getattr(self, 'drop_' + entity[:-1])(record_id)
+
+    def rows(self):
+        # Point-in-time copy of the records; they are replaced, never
+        # changed in place, so the copy stays consistent without the lock
+        return {'books': list(self.books.values()), 'students': list(self.students.values()),
+                'issues': list(self.issues.values())}
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows maps entity -> [values tuple], as Record.to_tuple() gives them
+        index = cls()
+        with _gc_paused():
+            index._fill(*[map(record._make, rows[entity]) for entity, record in cls.ENTITIES.items()])
+        return index
+
+
+class IndexedStorage(Storage):
+    # Serves reads from a CatalogIndex and writes through to the backend.
+    #
+    # The backend bumps per-collection generation counters on every write.
+    # refresh() compares them with the generations the index was built from,
+    # so indexes held by other worker processes notice the change instead of
+    # serving stale data. They catch up by replaying the backend's journal
+    # from the seq they are at, and only reload everything when the journal
+    # no longer reaches back that far.
+    #
+    # With a snapshot_path, startup loads the latest snapshot and replays
+    # the journal tail written after it, instead of reading every row.
+
+    def __init__(self, backend, snapshot_path=None):
+        self.backend = backend
+        self.snapshot_path = snapshot_path
+        self._lock = threading.RLock()
+        self._index = None
+        self._generations = None
+        # Journal seq the index is at, or None when the backend has no journal
+        self._seq = None
+        # Index updates of the writes made inside transaction(), applied when
+        # it commits; None outside one
+        self._pending = None
+        if not (snapshot_path and self.recover()):
+            self.reload()
+
+    def reload(self):
+        with self._lock:
+            with self.backend.transaction():
+                generations = self.backend.generations()
+                seq = self.backend.journal_head()
+                index = CatalogIndex.load(self.backend)
+            self._index, self._generations, self._seq = index, generations, seq
+
+    def recover(self):
+        # Starts from the snapshot and replays the journal written since.
+        # Returns False, leaving the index alone, when there is no snapshot
+        # this database can use.
+        with _gc_paused():
+            state = journal.read_snapshot(self.snapshot_path)
+        if state is None or state.get('fields') != self._snapshot_fields():
+            return False
+        with self._lock:
+            with self.backend.transaction():
+                head = self.backend.journal_head()
+                if (state.get('journal_id') != self.backend.journal_id()
+                        or head is None or state['seq'] > head):
+                    return False
+                index = CatalogIndex.from_rows(state['rows'])
+                seq = self._replay(index, state['seq'])
+                if seq is None:
+                    return False
+                generations = self.backend.generations()
+            self._index, self._generations, self._seq = index, generations, seq
+        return True
+
+    def _replay(self, index, seq, batch_size=10000):
+        # Applies the events after seq; returns the last seq applied, or None
+        # if the journal no longer reaches back that far
+        with _gc_paused():
+            while True:
+                events = self.backend.journal_events(seq, batch_size)
+                if events is None:
+                    return None
+                if not events:
+                    return seq
+                index.replay(events)
+                seq = events[-1][0]
+
+    def refresh(self):
+        if self.backend.generations() != self._generations:
+            self.catch_up()
+
+    def catch_up(self):
+        # Replays what other processes wrote since this index was last in
+        # step, or reloads everything when the journal cannot say
+        with self._lock:
+            seq = None
+            if self._seq is not None:
+                try:
+                    with self.backend.transaction():
+                        seq = self._replay(self._index, self._seq)
+                        generations = self.backend.generations()
+                except BaseException:
+                    # The index may be part way through the tail
+                    self.reload()
+                    raise
+            if seq is None:
+                self.reload()
+            else:
+                self._generations, self._seq = generations, seq
+
+    def snapshot(self, path=None):
+        # Writes the index to the snapshot file and returns the journal seq it
+        # was taken at
+        path = path or self.snapshot_path
+        with self._lock:
+            self.refresh()
+            if self._seq is None:
+                raise RuntimeError('Snapshots need a storage backend with a journal')
+            rows, seq = self._index.rows(), self._seq
+            journal_id = self.backend.journal_id()
+        with _gc_paused():
+            journal.write_snapshot(path, {
+                'journal_id': journal_id,
+                'seq': seq,
+                'fields': self._snapshot_fields(),
+                'rows': {entity: [record.to_tuple() for record in records]
+                         for entity, records in rows.items()},
+            })
+        return seq
+
+    @staticmethod
+    def _snapshot_fields():
+        return {entity: record.FIELDS for entity, record in CatalogIndex.ENTITIES.items()}
+
+    def generations(self):
+        # As of the last refresh() or local write
+        return self._generations
+
+    def _write(self, apply_backend, apply_index):
+        with self._lock:
+            with self.backend.transaction():
+                before = self.backend.generations()
+                result = apply_backend()
+                after = self.backend.generations()
+                seq = self.backend.journal_head()
+            if self._pending is not None:
+                self._pending.append((before, result, apply_index, after, seq))
+            else:
+                self._apply(before, result, apply_index, after, seq)
+        return result
+
+    def _apply(self, before, result, apply_index, after, seq):
+        if before == self._generations:
+            # A backend write that returns False changed nothing
+            if result is not False:
+                apply_index(self._index)
+            self._generations, self._seq = after, seq
+        else:
+            # Another process wrote since our last refresh; the journal
+            # holds this write too
+            self.catch_up()
+
+    def _write_issues(self, book_ids, apply_backend):
+        # Copies and holds are assigned inside the backend transaction, so the
+        # books' issues are read back there rather than mirrored here
+        issues = {}
+
+        def write():
+            result = apply_backend()
+            for book_id in set(book_ids):
+                issues[book_id] = self.backend.issues_for_book(book_id)
+            return result
+
+        def apply_index(index):
+            for book_id, book_issues in issues.items():
+                index.replace_book_issues(book_id, book_issues)
+        return self._write(write, apply_index)
+
+    def _write_issue_rows(self, apply_backend):
+        # For backend writes that return the issue rows they changed
+        rows = []
+
+        def write():
+            rows.extend(apply_backend())
+            return rows
+
+        def apply_index(index):
+            for row in rows:
+                index.put_issue(row)
+        return self._write(write, apply_index)
+
+    @contextmanager
+    def transaction(self):
+        # Writes inside the transaction update the index when it commits, so
+        # a rollback only drops their pending updates. Reads inside it see
+        # the index as it was before the transaction.
+        with self._lock:
+            if self._pending is not None:
+                with self.backend.transaction() as conn:
+                    yield conn
+                return
+            self._pending = pending = []
+            try:
+                with self.backend.transaction() as conn:
+                    yield conn
+            finally:
+                self._pending = None
+            try:
+                for write in pending:
+                    self._apply(*write)
+            except BaseException:
+                # The index may be part way through the updates
+                self.reload()
+                raise
+
+    # Branches
+    def branches(self):
+        return self.backend.branches()
+
+    def get_branch(self, branch_id):
+        return self.backend.get_branch(branch_id)
+
+    def add_branch(self, branch):
+        return self._write(lambda: self.backend.add_branch(branch), lambda index: None)
+
+    # Books
+    def all_books(self, branch=None):
+        with self._lock:
+            if branch is not None:
+                return list(self._index.branch(branch)[0].values())
+            return list(self._index.books.values())
+
+    def get_book(self, book_id):
+        return self._index.books.get(book_id)
+
+    def get_books(self, book_ids):
+        books = self._index.books
+        return {book_id: books[book_id] for book_id in set(book_ids) if book_id in books}
+
+    def find_book_by_isbn(self, isbn, branch=None):
+        index = self._index
+        bucket = index.book_by_isbn.get(isbn)
+        if not bucket:
+            return None
+        book_id = bucket.get(branch) if branch is not None else next(iter(bucket.values()), None)
+        return index.books.get(book_id) if book_id is not None else None
+
+    def add_book(self, book):
+        return self._write(lambda: self.backend.add_book(book),
+                           lambda index: index.put_book(book))
+
+    def add_books(self, books):
+        def apply_index(index):
+            for book in books:
+                index.put_book(book)
+        return self._write(lambda: self.backend.add_books(books), apply_index)
+
+    def update_book(self, book):
+        def apply_index(index):
+            # Fields the update leaves out, such as the branch, are unchanged
+            old = index.books.get(book['id'])
+            index.put_book(dict(old, **book) if old is not None else book)
+        return self._write(lambda: self.backend.update_book(book), apply_index)
+
+    def delete_book(self, book_id):
+        return self._write(lambda: self.backend.delete_book(book_id),
+                           lambda index: index.drop_book(book_id))
+
+    def count_books(self, branch=None):
+        with self._lock:
+            if branch is not None:
+                return len(self._index.branch(branch)[0])
+            return len(self._index.books)
+
+    def page_books(self, sort='title', descending=False, filters=None,
+                   after=None, before=None, limit=25):
+        # Ordered range scans are what the backend's B-tree indexes are for
+        return self.backend.page_books(sort, descending, filters, after, before, limit)
+
+    def book_genres(self):
+        return self.backend.book_genres()
+
+    def search_books(self, query, limit=25, branch=None):
+        return self.backend.search_books(query, limit, branch)
+
+    def rebuild_search_index(self):
+        self.backend.rebuild_search_index()
+
+    # Students
+    def all_students(self):
+        with self._lock:
+            return list(self._index.students.values())
+
+    def get_student(self, student_id):
+        return self._index.students.get(student_id)
+
+    def get_students(self, student_ids):
+        students = self._index.students
+        return {student_id: students[student_id] for student_id in set(student_ids)
+                if student_id in students}
+
+    def find_student_by_username(self, username):
+        index = self._index
+        student_id = index.student_by_username.get(username)
+        return index.students.get(student_id) if student_id is not None else None
+
+    def find_student_by_roll_no(self, roll_no):
+        index = self._index
+        student_id = index.student_by_roll_no.get(roll_no)
+        return index.students.get(student_id) if student_id is not None else None
+
+    def add_student(self, student):
+        return self._write(lambda: self.backend.add_student(student),
+                           lambda index: index.put_student(student))
+
+    def update_student(self, student):
+        return self._write(lambda: self.backend.update_student(student),
+                           lambda index: index.put_student(student))
+
+    def delete_student(self, student_id):
+        return self._write(lambda: self.backend.delete_student(student_id),
+                           lambda index: index.drop_student(student_id))
+
+    def count_students(self):
+        return len(self._index.students)
+
+    def page_students(self, query=None, after=None, before=None, limit=25):
+        return self.backend.page_students(query, after, before, limit)
+
+    # Issues and requests
+    def all_issues(self, branch=None):
+        with self._lock:
+            if branch is not None:
+                return list(self._index.branch(branch)[1].values())
+            return list(self._index.issues.values())
+
+    def get_issue(self, issue_id):
+        return self._index.issues.get(issue_id)
+
+    def get_issues(self, issue_ids):
+        issues = self._index.issues
+        return {issue_id: issues[issue_id] for issue_id in set(issue_ids) if issue_id in issues}
+
+    def issues_for_student(self, student_id):
+        with self._lock:
+            return list(self._index.issues_by_student.get(student_id, {}).values())
+
+    def issues_for_students(self, student_ids):
+        with self._lock:
+            by_student = self._index.issues_by_student
+            return {student_id: list(by_student.get(student_id, {}).values())
+                    for student_id in student_ids}
+
+    def issues_for_book(self, book_id):
+        with self._lock:
+            return list(self._index.issues_by_book.get(book_id, {}).values())
+
+    def page_issues(self, student_id=None, status=None, today=None,
+                    after=None, before=None, limit=25, branch=None):
+        return self.backend.page_issues(student_id, status, today, after, before, limit, branch)
+
+    def add_issue(self, issue):
+        # The backend fills in the branch from the book
+        return self._write_issues([issue['bookId']], lambda: self.backend.add_issue(issue))
+
+    def reserve_book(self, issue):
+        return self._write_issues([issue['bookId']], lambda: self.backend.reserve_book(issue))
+
+    def reserve_books(self, issues):
+        return self._write_issues([issue['bookId'] for issue in issues],
+                                  lambda: self.backend.reserve_books(issues))
+
+    def request_book(self, request):
+        return self._write_issues([request['bookId']], lambda: self.backend.request_book(request))
+
+    def set_issue_status(self, issue_id, status):
+        def apply_index(index):
+            issue = index.issues.get(issue_id)
+            if issue is not None:
+                index.put_issue(dict(issue, status=status))
+        return self._write(lambda: self.backend.set_issue_status(issue_id, status), apply_index)
+
+    def delete_issue(self, issue_id):
+        return self.delete_issues([issue_id])[0]
+
+    def delete_issues(self, issue_ids):
+        # Read from the backend: inside a transaction the index may not hold
+        # loans made earlier in it yet
+        book_ids = []
+
+        def write():
+            book_ids.extend(issue['bookId'] for issue in self.backend.get_issues(issue_ids).values())
+            return self.backend.delete_issues(issue_ids)
+        return self._write_issues(book_ids, write)
+
+    def approve_requests(self, issue_ids):
+        results = []
+
+        def write():
+            results.extend(self.backend.approve_requests(issue_ids))
+            return results
+
+        def apply_index(index):
+            for issue_id, approved in zip(issue_ids, results):
+                issue = index.issues.get(issue_id)
+                if approved and issue is not None:
+                    index.put_issue(dict(issue, status='issued'))
+        return self._write(write, apply_index)
+
+    def count_issues(self, branch=None):
+        with self._lock:
+            if branch is not None:
+                return len(self._index.branch(branch)[1])
+            return len(self._index.issues)
+
+    # Availability comes from the backend's trigger-maintained inventory
+    def is_book_available(self, book_id):
+        return self.backend.is_book_available(book_id)
+
+    def available_books(self, branch=None):
+        return self.backend.available_books(branch)
+
+    def count_available_books(self, branch=None):
+        return self.backend.count_available_books(branch)
+
+    # Overdue sweeps
+    def mark_overdue(self, today, fine_per_day, fine_max, limit=1000):
+        return self._write_issue_rows(
+            lambda: self.backend.mark_overdue(today, fine_per_day, fine_max, limit))
+
+    def overdue_dates(self):
+        return self.backend.overdue_dates()
+
+    def update_fines(self, return_date, today, fine_per_day, fine_max):
+        return self._write_issue_rows(
+            lambda: self.backend.update_fines(return_date, today, fine_per_day, fine_max))
+
+    def queue_due_reminders(self, today, until, limit=1000):
+        return self._write_issue_rows(lambda: self.backend.queue_due_reminders(today, until, limit))
+
+    def claim_reminders(self, limit=500, lease=300):
+        return self.backend.claim_reminders(limit, lease)
+
+    def finish_reminders(self, claim_id):
+        return self.backend.finish_reminders(claim_id)
+
+    def release_reminders(self, claim_id):
+        return self.backend.release_reminders(claim_id)
+
+    # Copies and holds
+    def book_inventory(self, book_ids):
+        return self.backend.book_inventory(book_ids)
+
+    def add_copies(self, book_id, count):
+        return self._write_issues([book_id], lambda: self.backend.add_copies(book_id, count))
+
+    def remove_copies(self, book_id, count):
+        return self._write(lambda: self.backend.remove_copies(book_id, count), lambda index: None)
+
+    def transfer_copies(self, book_id, branch, count):
+        # The target title may be new, and holds on it may have been served
+        changed = {}
+
+        def write():
+            result = self.backend.transfer_copies(book_id, branch, count)
+            if result is not None:
+                target = result[0]
+                changed['book'] = self.backend.get_book(target)
+                changed['issues'] = self.backend.issues_for_book(target)
+            return result
+
+        def apply_index(index):
+            if changed:
+                index.put_book(changed['book'])
+                index.replace_book_issues(changed['book']['id'], changed['issues'])
+        return self._write(write, apply_index)
+
+    def get_hold(self, hold_id):
+        return self.backend.get_hold(hold_id)
+
+    def holds_for_student(self, student_id):
+        return self.backend.holds_for_student(student_id)
+
+    def delete_hold(self, hold_id):
+        return self._write(lambda: self.backend.delete_hold(hold_id), lambda index: None)
+
+    # Counters are maintained transactionally by the backend
+    def counters(self):
+        return self.backend.counters()
+
+    def student_counters(self, student_ids):
+        return self.backend.student_counters(student_ids)
+
+    def check_counters(self):
+        return self.backend.check_counters()
+
+    def rebuild_counters(self):
+        self.backend.rebuild_counters()
+
+    # Metadata
+    def get_meta(self, key, default=None):
+        return self.backend.get_meta(key, default)
+
+    def set_meta(self, key, value):
+        return self.backend.set_meta(key, value)
+
+    # Journal
+    def journal_id(self):
+        return self.backend.journal_id()
+
+    def journal_head(self):
+        return self.backend.journal_head()
+
+    def journal_events(self, after, limit=None):
+        return self.backend.journal_events(after, limit)
+
+    def prune_journal(self, through):
+        return self.backend.prune_journal(through)
+
+    def loan_history(self, student_id=None, book_id=None, limit=25):
+        return self.backend.loan_history(student_id, book_id, limit)
+
+    def closed_loans(self, after=0, batch_size=100000):
+        return self.backend.closed_loans(after, batch_size)
+
+    def open_loans(self, batch_size=100000):
+        return self.backend.open_loans(batch_size)
+
+    def iter_books(self, rows=None):
+        return self.backend.iter_books(rows)
+
+    def iter_students(self, rows=None):
+        return self.backend.iter_students(rows)
+
+    def iter_issues(self, rows=None):
+        return self.backend.iter_issues(rows)
+
+    def row_ranges(self, entity, parts):
+        return self.backend.row_ranges(entity, parts)
+
+    def close(self):
+        self.backend.close()
@@ -0,0 +1,167 @@
+# Per-title copy counts. Every catalog book has one inventory row that
+# triggers keep in step with its copies, their active loans and its hold
+# queue, so availability is a primary key lookup instead of a scan over
+# issues.
+#
+#   inventory.total      copies of the title
+#   inventory.available  copies with no active loan or request
+#   inventory.onHold     copies set aside for a request awaiting approval
+#   inventory.queued     students waiting in the hold queue
+
+INVENTORY_FIELDS = ('total', 'available', 'onHold', 'queued')
+
+ACTIVE_SQL = "status IN ('issued', 'requested', 'overdue')"
+
+# Copies of a title that are free to lend, lowest copy number first
+FREE_COPIES_SQL = f'''
+SELECT * FROM copies WHERE bookId = ? AND NOT EXISTS (
+    SELECT 1 FROM issues WHERE issues.copyId = copies.id AND issues.{ACTIVE_SQL})
+ORDER BY number
+'''
+
+INVENTORY_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS inventory (
+    bookId TEXT PRIMARY KEY,
+    total INTEGER NOT NULL DEFAULT 0,
+    available INTEGER NOT NULL DEFAULT 0,
+    onHold INTEGER NOT NULL DEFAULT 0,
+    queued INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS inventory_books_insert AFTER INSERT ON books BEGIN
+    INSERT OR IGNORE INTO inventory (bookId) VALUES (new.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_books_delete AFTER DELETE ON books BEGIN
+    DELETE FROM holds WHERE bookId = old.id;
+    DELETE FROM copies WHERE bookId = old.id;
+    DELETE FROM inventory WHERE bookId = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_students_delete AFTER DELETE ON students BEGIN
+    DELETE FROM holds WHERE studentId = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_copies_insert AFTER INSERT ON copies BEGIN
+    UPDATE inventory SET
+        total = total + 1,
+        available = available + NOT EXISTS
+            (SELECT 1 FROM issues WHERE copyId = new.id AND {ACTIVE_SQL}),
+        onHold = onHold + EXISTS
+            (SELECT 1 FROM issues WHERE copyId = new.id AND status = 'requested')
+        WHERE bookId = new.bookId;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_copies_delete AFTER DELETE ON copies BEGIN
+    UPDATE inventory SET
+        total = total - 1,
+        available = available - NOT EXISTS
+            (SELECT 1 FROM issues WHERE copyId = old.id AND {ACTIVE_SQL}),
+        onHold = onHold - EXISTS
+            (SELECT 1 FROM issues WHERE copyId = old.id AND status = 'requested')
+        WHERE bookId = old.bookId;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_issues_insert AFTER INSERT ON issues
+WHEN new.{ACTIVE_SQL} BEGIN
+    UPDATE inventory SET
+        available = available - 1,
+        onHold = onHold + (new.status = 'requested')
+        WHERE bookId = (SELECT bookId FROM copies WHERE id = new.copyId);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_issues_delete AFTER DELETE ON issues
+WHEN old.{ACTIVE_SQL} BEGIN
+    UPDATE inventory SET
+        available = available + 1,
+        onHold = onHold - (old.status = 'requested')
+        WHERE bookId = (SELECT bookId FROM copies WHERE id = old.copyId);
+END;
+
+-- Skipped for status changes that leave the counts alone, such as an
+-- issued loan becoming overdue
+CREATE TRIGGER IF NOT EXISTS inventory_issues_update AFTER UPDATE OF copyId, status ON issues
+WHEN old.copyId IS NOT new.copyId OR (old.{ACTIVE_SQL}) != (new.{ACTIVE_SQL})
+    OR (old.status = 'requested') != (new.status = 'requested') BEGIN
+    UPDATE inventory SET
+        available = available + 1,
+        onHold = onHold - (old.status = 'requested')
+        WHERE old.{ACTIVE_SQL} AND bookId = (SELECT bookId FROM copies WHERE id = old.copyId);
+    UPDATE inventory SET
+        available = available - 1,
+        onHold = onHold + (new.status = 'requested')
+        WHERE new.{ACTIVE_SQL} AND bookId = (SELECT bookId FROM copies WHERE id = new.copyId);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_holds_insert AFTER INSERT ON holds BEGIN
+    UPDATE inventory SET queued = queued + 1 WHERE bookId = new.bookId;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_holds_delete AFTER DELETE ON holds BEGIN
+    UPDATE inventory SET queued = queued - 1 WHERE bookId = old.bookId;
+END;
+'''
+
+# Ground truth the inventory is checked and rebuilt against
+EXPECTED_SQL = f'''
+SELECT books.id AS bookId,
+    COUNT(copies.id) AS total,
+    COUNT(copies.id) - COUNT(issues.id) AS available,
+    IFNULL(SUM(issues.status = 'requested'), 0) AS onHold,
+    (SELECT COUNT(*) FROM holds WHERE holds.bookId = books.id) AS queued
+FROM books
+LEFT JOIN copies ON copies.bookId = books.id
+LEFT JOIN issues ON issues.copyId = copies.id AND issues.{ACTIVE_SQL}
+GROUP BY books.id
+'''
+
+
+def install(conn):
+    # Returns True when the inventory was just created and needs a rebuild
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inventory'").fetchone()
+    conn.executescript(INVENTORY_SCHEMA)
+    return not exists
+
+
+def trigger_names(conn):
+    return [row['name'] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'inventory\\_%' "
+        "ESCAPE '\\'")]
+
+
+def backfill(conn):
+    # Upgrades a single-copy catalog: every book gets one copy, and active
+    # loans recorded before copies existed are tied to a copy of their book
+    conn.execute("INSERT INTO copies (id, bookId, number) "
+                 "SELECT 'copy-' || lower(hex(randomblob(16))), id, 1 FROM books "
+                 'WHERE NOT EXISTS (SELECT 1 FROM copies WHERE copies.bookId = books.id)')
+    loans = conn.execute(
+        'SELECT issues.id, issues.bookId FROM issues JOIN books ON books.id = issues.bookId '
+        f'WHERE issues.copyId IS NULL AND issues.{ACTIVE_SQL} ORDER BY issues.rowid').fetchall()
+    for loan in loans:
+        copy = conn.execute(FREE_COPIES_SQL + ' LIMIT 1', (loan['bookId'],)).fetchone()
+        if copy is None:
+            # More loans than copies: the old model allowed it, so add one
+            copy = conn.execute(
+                "INSERT INTO copies (id, bookId, number) "
+                "SELECT 'copy-' || lower(hex(randomblob(16))), ?, IFNULL(MAX(number), 0) + 1 "
+                'FROM copies WHERE bookId = ? RETURNING id',
+                (loan['bookId'], loan['bookId'])).fetchone()
+        conn.execute('UPDATE issues SET copyId = ? WHERE id = ?', (copy['id'], loan['id']))
+
+
+def rebuild(conn):
+    conn.execute('DELETE FROM inventory')
+    conn.execute(f'INSERT INTO inventory (bookId, {", ".join(INVENTORY_FIELDS)}) {EXPECTED_SQL}')
+
+
+def check(conn):
+    # Returns a list of (book, stored, expected) for every mismatch
+    stored = {row['bookId']: tuple(row[field] for field in INVENTORY_FIELDS)
+              for row in conn.execute('SELECT * FROM inventory')}
+    expected = {row['bookId']: tuple(row[field] for field in INVENTORY_FIELDS)
+                for row in conn.execute(EXPECTED_SQL)}
+    return [(f'inventory {book_id}', stored.get(book_id), expected.get(book_id))
+            for book_id in sorted(set(stored) | set(expected))
+            if stored.get(book_id) != expected.get(book_id)]
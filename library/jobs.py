@@ -0,0 +1,371 @@
+import csv
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import as_completed
+from contextlib import closing
+from datetime import date, datetime, timezone
+
+from library import bulk
+from library.overdue import sweep_overdue
+from library.storage import open_storage
+
+log = logging.getLogger(__name__)
+
+# Background jobs for admin work too heavy for a request: full exports,
+# per-student loan statements and overdue sweeps.
+#
+# A job is planned in the web process into parts (rowid ranges of the
+# collection it reads), and the parts run in a pool of worker processes,
+# several per core so a slow part does not leave cores idle. Each part
+# streams its rows to its own file; when all are done the parts are joined
+# in order into the job's file. A thread in the submitting process follows
+# the parts and records progress in a small SQLite job table next to the
+# files, which every web worker reads, so any of them can answer a poll.
+
+JOBS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    pid INTEGER,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created);
+'''
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+ACTIVE_STATUSES = ('queued', 'running')
+
+STATEMENT_FIELDS = ('studentId', 'name', 'rollNo', 'issueId', 'bookId', 'title', 'author',
+                    'issueDate', 'returnDate', 'status', 'fine')
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc).isoformat() if value else None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobTable:
+    # The job rows. A connection per call: polls are rare next to the work
+    # they report on, and it keeps the table safe to use from any thread.
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(JOBS_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return closing(conn)
+
+    def _execute(self, sql, params=()):
+        with self._connect() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def create(self, kind, params, owner=None):
+        job_id = f'job-{uuid.uuid4()}'
+        self._execute('INSERT INTO jobs (id, kind, params, status, owner, pid, created) '
+                      "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                      (job_id, kind, json.dumps(params), owner, os.getpid(), time.time()))
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def recent(self, limit=25):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT * FROM jobs ORDER BY created DESC LIMIT ?', (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    @staticmethod
+    def _job(row):
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'params': json.loads(row['params']),
+            'status': row['status'],
+            'progress': {'done': row['done'], 'total': row['total']},
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'owner': row['owner'],
+            'created': _timestamp(row['created']),
+            'started': _timestamp(row['started']),
+            'finished': _timestamp(row['finished']),
+        }
+
+    def start(self, job_id, total):
+        self._execute("UPDATE jobs SET status = 'running', total = ?, started = ? WHERE id = ?",
+                      (total, time.time(), job_id))
+
+    def advance(self, job_id, done):
+        self._execute('UPDATE jobs SET done = ? WHERE id = ?', (done, job_id))
+
+    def finish(self, job_id, result):
+        self._execute("UPDATE jobs SET status = 'done', done = total, result = ?, finished = ? "
+                      'WHERE id = ?', (json.dumps(result), time.time(), job_id))
+
+    def fail(self, job_id, error):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                      (error, time.time(), job_id))
+
+    def fail_orphans(self):
+        # Jobs whose submitting process has exited will never finish
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, pid FROM jobs WHERE status IN (?, ?)',
+                                ACTIVE_STATUSES).fetchall()
+        orphans = [row['id'] for row in rows if not _alive(row['pid'])]
+        for job_id in orphans:
+            self.fail(job_id, 'Interrupted: the process running it exited')
+        return len(orphans)
+
+    def prune(self, before):
+        # Deletes finished jobs older than `before` (a timestamp) and returns
+        # their results, whose files the caller removes
+        with self._connect() as conn:
+            rows = conn.execute('DELETE FROM jobs WHERE finished < ? RETURNING result',
+                                (before,)).fetchall()
+        return [json.loads(row['result']) for row in rows if row['result']]
+
+
+# Parts. Each runs in a worker process, opens the storage itself and writes
+# to its own file; they return plain dicts of counts, which are summed.
+_storages = {}
+
+
+def _storage(storage_url):
+    # One backend per worker process, reused by the parts it runs
+    storage = _storages.get(storage_url)
+    if storage is None:
+        storage = _storages[storage_url] = open_storage(storage_url)
+    return storage
+
+
+def export_part(storage_url, path, entity, fmt, rows, header):
+    stats = {'rows': 0}
+
+    def counted(records):
+        for record in records:
+            stats['rows'] += 1
+            yield record
+
+    records = counted(getattr(_storage(storage_url), f'iter_{entity}')(rows))
+    with open(path, 'w', encoding='utf-8', newline='') as stream:
+        for chunk in bulk.format_rows(records, entity, fmt, header=header):
+            stream.write(chunk)
+    return stats
+
+
+def statement_part(storage_url, path, fmt, rows, header, batch_size=500):
+    # Every student's current loans with the books' titles; students
+    # without loans are left out
+    storage = _storage(storage_url)
+    stats = {'students': 0, 'loans': 0}
+    with open(path, 'w', encoding='utf-8', newline='') as stream:
+        writer = csv.DictWriter(stream, fieldnames=STATEMENT_FIELDS)
+        if fmt == 'csv' and header:
+            writer.writeheader()
+        batch = []
+        for student in storage.iter_students(rows):
+            batch.append(student)
+            if len(batch) >= batch_size:
+                _write_statements(storage, batch, fmt, stream, writer, stats)
+                batch = []
+        _write_statements(storage, batch, fmt, stream, writer, stats)
+    return stats
+
+
+def _write_statements(storage, students, fmt, stream, writer, stats):
+    loans = storage.issues_for_students([student['id'] for student in students])
+    books = storage.get_books(issue['bookId'] for issues in loans.values() for issue in issues)
+    for student in students:
+        issues = loans[student['id']]
+        if not issues:
+            continue
+        lines = [{
+            'issueId': issue['id'],
+            'bookId': issue['bookId'],
+            'title': books.get(issue['bookId'], {}).get('title'),
+            'author': books.get(issue['bookId'], {}).get('author'),
+            'issueDate': issue['issueDate'],
+            'returnDate': issue['returnDate'],
+            'status': issue['status'],
+            'fine': issue['fine'] or 0,
+        } for issue in issues]
+        if fmt == 'csv':
+            for line in lines:
+                writer.writerow(dict(line, studentId=student['id'], name=student['name'],
+                                     rollNo=student['rollNo']))
+        else:
+            stream.write(json.dumps({
+                'studentId': student['id'], 'name': student['name'], 'rollNo': student['rollNo'],
+                'loans': lines, 'fines': sum(line['fine'] for line in lines),
+            }))
+            stream.write('\n')
+        stats['students'] += 1
+        stats['loans'] += len(lines)
+
+
+def overdue_part(storage_url, path, today, fine_per_day, fine_max, remind_days):
+    # Sweeps write, and SQLite takes one writer at a time, so this is a
+    # single part; it still keeps the sweep out of the web process
+    return sweep_overdue(_storage(storage_url), date.fromisoformat(today), fine_per_day,
+                         fine_max, remind_days)
+
+
+# Planners turn a job's params into (part function, args) pairs, raising
+# ValueError for params they cannot run. file is the extension of the
+# joined output, or None for jobs that only report counts.
+def plan_export(storage, params, parts):
+    entity, fmt = params.get('entity'), params.get('format', 'csv')
+    if entity not in bulk.EXPORT_FIELDS:
+        raise ValueError(f'Unknown export: {entity}')
+    if fmt not in bulk.FORMATS:
+        raise ValueError(f'Unsupported format: {fmt}')
+    ranges = storage.row_ranges(entity, parts) or [None]
+    return fmt, [(export_part, (entity, fmt, rows, i == 0)) for i, rows in enumerate(ranges)]
+
+
+def plan_statements(storage, params, parts):
+    fmt = params.get('format', 'csv')
+    if fmt not in bulk.FORMATS:
+        raise ValueError(f'Unsupported format: {fmt}')
+    ranges = storage.row_ranges('students', parts) or [None]
+    return fmt, [(statement_part, (fmt, rows, i == 0)) for i, rows in enumerate(ranges)]
+
+
+def plan_overdue(storage, params, parts):
+    try:
+        today = date.fromisoformat(params['today']) if params.get('today') else date.today()
+        fine_per_day = int(params.get('finePerDay', 5))
+        fine_max = int(params['fineMax']) if params.get('fineMax') else None
+        remind_days = int(params.get('remindDays', 1))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid today, finePerDay, fineMax or remindDays')
+    return None, [(overdue_part, (today.isoformat(), fine_per_day, fine_max, remind_days))]
+
+
+PLANNERS = {
+    'export': plan_export,
+    'statements': plan_statements,
+    'overdue': plan_overdue,
+}
+
+
+class JobRunner:
+    # Plans jobs, runs their parts in the process pool and records them in
+    # the job table. The pool starts with the first job.
+
+    def __init__(self, table, storage_url, directory, workers=None, parts_per_worker=4):
+        self.table = table
+        self.storage_url = storage_url
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.parts_per_worker = parts_per_worker
+        self._executor = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Imported here so web workers that never run a job skip
+                # multiprocessing at start-up
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Workers start from a fresh interpreter rather than a fork
+                # of this one, which holds threads and open connections
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods
+                                                      else 'spawn')
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+            return self._executor
+
+    def submit(self, storage, kind, params, owner=None):
+        # Returns the new job's id; ValueError for an unknown kind or params
+        planner = PLANNERS.get(kind)
+        if planner is None:
+            raise ValueError(f'Unknown job: {kind}')
+        extension, parts = planner(storage, params, self.workers * self.parts_per_worker)
+        job_id = self.table.create(kind, params, owner)
+        threading.Thread(target=self._run, args=(job_id, extension, parts),
+                         name=f'library-{job_id}', daemon=True).start()
+        return job_id
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _run(self, job_id, extension, parts):
+        part_paths = [self.path(f'.{job_id}.part{i}') for i in range(len(parts))]
+        try:
+            self.table.start(job_id, len(parts))
+            pool = self._pool()
+            futures = [pool.submit(fn, self.storage_url, path, *args)
+                       for (fn, args), path in zip(parts, part_paths)]
+            totals = {}
+            for done, future in enumerate(as_completed(futures), 1):
+                for key, value in future.result().items():
+                    totals[key] = totals.get(key, 0) + value
+                self.table.advance(job_id, done)
+            result = {'counts': totals}
+            if extension is not None:
+                name = f'{job_id}.{extension}'
+                self._join(part_paths, self.path(name))
+                result.update(file=name, bytes=os.path.getsize(self.path(name)))
+            self.table.finish(job_id, result)
+        except Exception as e:
+            log.exception('Job %s failed', job_id)
+            self.table.fail(job_id, f'{type(e).__name__}: {e}')
+        finally:
+            for path in part_paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def _join(self, part_paths, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as output:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, output, 1024 * 1024)
+        os.replace(tmp_path, path)
+
+    def prune(self, max_age):
+        # Drops jobs finished more than max_age seconds ago, and their files
+        removed = self.table.prune(time.time() - max_age)
+        for result in removed:
+            if result.get('file') and os.path.exists(self.path(result['file'])):
+                os.unlink(self.path(result['file']))
+        return len(removed)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,199 @@
+import json
+import os
+import pickle
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Append-only journal of every change to books, students and issues.
+# Triggers append one row per changed record in the same transaction as the
+# change, so the journal can never disagree with the tables:
+#
+#   journal       (seq, entity, op, id, data): op is 'put' with the record's
+#                 column values as a JSON array, or 'delete' with no data
+#   loan_history  every issue row as it was when deleted, so returned loans
+#                 and cancelled requests are kept after they leave issues
+#
+# The tables stay the source of truth. The journal lets an in-memory index
+# catch up by replaying the tail since the seq it last saw, and snapshots
+# (below) let a new process start from a file instead of reading every row.
+# New columns must be appended at the end of a table: put events are
+# decoded positionally against the current field list.
+
+JOURNAL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity TEXT NOT NULL,
+    op TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT,
+    at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
+
+CREATE TABLE IF NOT EXISTS loan_history (
+    id TEXT PRIMARY KEY,
+    bookId TEXT NOT NULL,
+    studentId TEXT NOT NULL,
+    copyId TEXT,
+    issueDate TEXT NOT NULL,
+    returnDate TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fine INTEGER,
+    closedDate TEXT NOT NULL,
+    branch TEXT NOT NULL DEFAULT 'main'
+);
+CREATE INDEX IF NOT EXISTS idx_loan_history_student ON loan_history(studentId, closedDate);
+CREATE INDEX IF NOT EXISTS idx_loan_history_book ON loan_history(bookId, closedDate);
+
+CREATE TRIGGER IF NOT EXISTS journal_loan_history AFTER DELETE ON issues BEGIN
+    INSERT OR REPLACE INTO loan_history
+        (id, bookId, studentId, copyId, issueDate, returnDate, status, fine, closedDate, branch)
+    VALUES (old.id, old.bookId, old.studentId, old.copyId, old.issueDate, old.returnDate,
+            old.status, old.fine, date('now'), old.branch);
+END;
+'''
+
+JOURNAL_TRIGGERS = '''
+CREATE TRIGGER IF NOT EXISTS journal_{table}_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO journal (entity, op, id, data) VALUES ('{table}', 'put', new.id, {new_values});
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_{table}_update AFTER UPDATE ON {table}
+WHEN {changed} BEGIN
+    INSERT INTO journal (entity, op, id) SELECT '{table}', 'delete', old.id WHERE old.id IS NOT new.id;
+    INSERT INTO journal (entity, op, id, data) VALUES ('{table}', 'put', new.id, {new_values});
+END;
+
+CREATE TRIGGER IF NOT EXISTS journal_{table}_delete AFTER DELETE ON {table} BEGIN
+    INSERT INTO journal (entity, op, id) VALUES ('{table}', 'delete', old.id);
+END;
+'''
+
+SNAPSHOT_VERSION = 1
+
+
+def triggers_sql(tables):
+    # tables maps table name -> field tuple, in column order
+    return ''.join(
+        JOURNAL_TRIGGERS.format(
+            table=table,
+            new_values='json_array(' + ', '.join(f'new.{field}' for field in fields) + ')',
+            changed=' OR '.join(f'old.{field} IS NOT new.{field}' for field in fields))
+        for table, fields in tables.items())
+
+
+def trigger_names(conn):
+    return [row['name'] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'journal_%'")]
+
+
+def install(conn, tables):
+    conn.executescript(JOURNAL_SCHEMA + triggers_sql(tables))
+    # Identifies this database, so a snapshot is never applied to another one
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('journal_id', ?)",
+                 (uuid.uuid4().hex,))
+
+
+def journal_id(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'journal_id'").fetchone()
+    return row['value'] if row else None
+
+
+def head(conn):
+    # seq of the newest event, or 0 before the first one
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+    return row['seq'] if row else 0
+
+
+def pruned_through(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'journal_pruned'").fetchone()
+    return int(row['value']) if row else 0
+
+
+def events(conn, after, limit=None):
+    # [(seq, entity, op, id, values)] after seq `after`, oldest first, or
+    # None when events after it have already been pruned
+    if after < pruned_through(conn):
+        return None
+    # Plain tuples: the tail can be long and dict rows would double the cost
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute('SELECT seq, entity, op, id, data FROM journal WHERE seq > ? ORDER BY seq'
+                          + (' LIMIT ?' if limit else ''), (after, limit) if limit else (after,))
+    loads = json.loads
+    result = [(seq, entity, op, record_id, loads(data) if data is not None else None)
+              for seq, entity, op, record_id, data in rows]
+    # seqs have no gaps, so a jump means a prune ran since the check above
+    if result and result[0][0] != after + 1:
+        return None
+    return result
+
+
+def prune(conn, through):
+    # Drops events up to and including seq `through`; readers further behind
+    # than that fall back to a full reload
+    if through <= pruned_through(conn):
+        return 0
+    deleted = conn.execute('DELETE FROM journal WHERE seq <= ?', (through,)).rowcount
+    conn.execute("INSERT INTO meta (key, value) VALUES ('journal_pruned', ?) "
+                 "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (str(through),))
+    return deleted
+
+
+# Snapshots: the index's rows as plain tuples at a journal seq, pickled.
+# Written to a temporary file and renamed over the old one, so a crash
+# mid-write leaves the previous snapshot in place.
+def write_snapshot(path, state):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            pickle.dump(dict(state, version=SNAPSHOT_VERSION), stream, protocol=pickle.HIGHEST_PROTOCOL)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+@contextmanager
+def snapshot_lock(path):
+    # Yields True to the one process that holds path's lock, False to the
+    # others; the lock goes with the process if it dies. Without fcntl
+    # (Windows) every caller gets True.
+    if fcntl is None:
+        yield True
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def read_snapshot(path):
+    # The saved state, or None if there is no usable snapshot
+    try:
+        with open(path, 'rb') as stream:
+            state = pickle.load(stream)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != SNAPSHOT_VERSION:
+        return None
+    return state
@@ -0,0 +1,185 @@
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+
+# Request instrumentation: histograms and counters kept in process memory
+# and rendered in the Prometheus text format. Each worker process has its
+# own registry, so scrape every worker (or sum in the Prometheus query).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (128, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts, then sum and count
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts)) for labels, counts in self._series.items())
+        for labels, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket'
+                             f'{_labels(self.label_names, labels, [("le", bound)])} {cumulative}')
+            label_text = _labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{label_text} {counts[-1]}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.label_names, labels)} {value}'
+                     for labels, value in values)
+        return lines
+
+
+class Gauge:
+    # Read from a callback at scrape time
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help = help_text
+        self.read = read
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge',
+                f'{self.name} {self.read()}']
+
+
+class Metrics:
+
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help_text, label_names, buckets))
+
+    def counter(self, name, help_text, label_names=()):
+        return self.add(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, read):
+        return self.add(Gauge(name, help_text, read))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class TimedStorage:
+    # Wraps a storage object and times each method call. record(method,
+    # seconds) is called after every call, including ones that raise.
+    # Context managers and iterators are passed through untimed, since
+    # their work happens after the call returns.
+
+    UNTIMED = frozenset({'transaction', 'iter_books', 'iter_students', 'iter_issues',
+                         'closed_loans', 'open_loans', 'close'})
+
+    def __init__(self, storage, record):
+        self._storage = storage
+        self._record = record
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if name in self.UNTIMED or name.startswith('_') or not callable(attr):
+            return attr
+        record = self._record
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        timed.__name__ = name
+        return timed
+
+
+class SlowRequestProfiler:
+    # Profiles a random sample of requests with cProfile and keeps the
+    # profiles of those slower than slow_seconds, for `python -m pstats` or
+    # snakeviz. Profiling makes the sampled requests slower, so keep the
+    # sample rate low in production.
+
+    def __init__(self, directory, sample_rate=0.01, slow_seconds=0.5):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        # Returns the running profiler, or None when this request is not sampled
+        if random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profiler
+
+    def stop(self, profiler, name, seconds):
+        # Returns the path of the saved profile, if the request was slow
+        profiler.disable()
+        if seconds < self.slow_seconds:
+            return None
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+        path = os.path.join(self.directory,
+                            f'{time.strftime("%Y%m%d-%H%M%S")}-{safe_name}-{int(seconds * 1000)}ms-'
+                            f'{os.getpid()}-{threading.get_ident()}.prof')
+        profiler.dump_stats(path)
+        return path
@@ -0,0 +1,50 @@
+import json
+import logging
+import os
+import threading
+
+
+class JsonlOutbox:
+    # Appends each reminder as one JSON line to a local file, standing in
+    # for a mail or SMS gateway that would tail it
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def send(self, messages):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as outbox:
+            for message in messages:
+                outbox.write(json.dumps(message) + '\n')
+            outbox.flush()
+            os.fsync(outbox.fileno())
+
+
+class LogOutbox:
+    # Logs each reminder; useful in development
+
+    def __init__(self, name=''):
+        self.logger = logging.getLogger(name or 'library.reminders')
+
+    def send(self, messages):
+        for message in messages:
+            self.logger.info(json.dumps(message))
+
+
+SINKS = {
+    'jsonl': JsonlOutbox,
+    'log': LogOutbox,
+}
+
+
+def open_outbox(url):
+    # Outbox URLs look like "jsonl:///relative/outbox.jsonl",
+    # "jsonl:////absolute/outbox.jsonl" or "log://logger.name". New sinks
+    # register in SINKS and only need a send(messages) method.
+    scheme, _, location = url.partition('://')
+    if scheme not in SINKS:
+        raise ValueError(f'Unknown outbox: {scheme}')
+    if scheme == 'jsonl' and location.startswith('/'):
+        location = location[1:]
+    return SINKS[scheme](location)
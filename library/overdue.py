@@ -0,0 +1,85 @@
+from datetime import date, timedelta
+
+# Loans are swept through the (status, returnDate) index in small batches,
+# each in its own short transaction, so a sweep over millions of loans never
+# holds the write lock long enough to stall request handling.
+DEFAULT_BATCH_SIZE = 1000
+
+
+def sweep_overdue(storage, today=None, fine_per_day=5, fine_max=500, remind_days=1,
+                  batch_size=DEFAULT_BATCH_SIZE):
+    # Marks newly overdue loans, refreshes fines once a day and queues due
+    # date reminders. Returns how many loans each step touched.
+    today = today or date.today()
+    today_str = today.isoformat()
+    stats = {'overdue': 0, 'fines': 0, 'reminders': 0}
+
+    while True:
+        marked = storage.mark_overdue(today_str, fine_per_day, fine_max, batch_size)
+        stats['overdue'] += len(marked)
+        if len(marked) < batch_size:
+            break
+
+    # Fines only change when the date does. Loans due on the same day share
+    # a fine, so each return date is one indexed update.
+    if storage.get_meta('fines_date') != today_str:
+        for return_date in storage.overdue_dates():
+            stats['fines'] += len(storage.update_fines(return_date, today_str,
+                                                       fine_per_day, fine_max))
+        storage.set_meta('fines_date', today_str)
+
+    if remind_days > 0:
+        until = (today + timedelta(days=remind_days)).isoformat()
+        while True:
+            queued = storage.queue_due_reminders(today_str, until, batch_size)
+            stats['reminders'] += len(queued)
+            if len(queued) < batch_size:
+                break
+    return stats
+
+
+def reminder_messages(storage, reminders):
+    issues = storage.get_issues(reminder['issueId'] for reminder in reminders)
+    books = storage.get_books(issue['bookId'] for issue in issues.values())
+    students = storage.get_students(issue['studentId'] for issue in issues.values())
+    messages = []
+    for reminder in reminders:
+        issue = issues.get(reminder['issueId'])
+        if issue is None:
+            # Returned before the reminder went out
+            continue
+        book = books.get(issue['bookId'], {})
+        student = students.get(issue['studentId'], {})
+        messages.append({
+            'kind': reminder['kind'],
+            'queued': reminder['created'],
+            'issueId': issue['id'],
+            'studentId': issue['studentId'],
+            'studentName': student.get('name'),
+            'rollNo': student.get('rollNo'),
+            'bookTitle': book.get('title'),
+            'returnDate': issue['returnDate'],
+            'fine': issue['fine'] or 0,
+        })
+    return messages
+
+
+def deliver_reminders(storage, sink, batch_size=500, lease=300):
+    # Hands queued reminders to the sink. Each batch is leased in one short
+    # transaction and sent outside any, so a slow sink never holds the write
+    # lock. A sink error hands the batch back for the next run, and a sender
+    # that dies leaves it to be claimed again once its lease runs out;
+    # either way a reminder may be sent twice, never lost.
+    sent = 0
+    while True:
+        claim_id, reminders = storage.claim_reminders(batch_size, lease)
+        if not reminders:
+            return sent
+        try:
+            messages = reminder_messages(storage, reminders)
+            sink.send(messages)
+        except BaseException:
+            storage.release_reminders(claim_id)
+            raise
+        storage.finish_reminders(claim_id)
+        sent += len(messages)
@@ -0,0 +1,63 @@
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class Page:
+    # One page of a keyset-paginated listing. next_cursor/prev_cursor are
+    # opaque strings to pass back as ?after= / ?before=, or None at the ends.
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def to_dict(self, items=None):
+        return {
+            'items': self.items if items is None else items,
+            'next': self.next_cursor,
+            'prev': self.prev_cursor,
+        }
+
+
+def encode_cursor(key):
+    raw = json.dumps(list(key), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(rows, limit, key, after=None, before=None):
+    # rows were fetched with limit + 1 in query order (reversed when paging
+    # backwards with `before`); trims the probe row and builds both cursors.
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+        next_cursor = encode_cursor(key(rows[-1])) if rows else None
+        prev_cursor = encode_cursor(key(rows[0])) if rows and has_more else None
+    else:
+        next_cursor = encode_cursor(key(rows[-1])) if rows and has_more else None
+        prev_cursor = encode_cursor(key(rows[0])) if rows and after is not None else None
+    return Page(rows, next_cursor, prev_cursor)
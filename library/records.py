@@ -0,0 +1,186 @@
+import sys
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import date, timedelta
+from enum import Enum
+from functools import lru_cache
+
+# Compact record types for the rows the catalog index keeps in memory.
+#
+# A row dict costs a hash table per record plus fresh strings for every
+# date and status. These classes use __slots__, share one date object per
+# distinct day and one enum member per status, and intern repeated text.
+#
+# Attributes hold the native values (datetime.date, Status). Subscripts,
+# get() and dict(record) still give the plain strings the dict layout had,
+# so code written against row dicts keeps working unchanged.
+
+
+class Status(str, Enum):
+    REQUESTED = 'requested'
+    ISSUED = 'issued'
+    OVERDUE = 'overdue'
+
+    # Compare and hash like the plain string, so sets and dict keys of
+    # status strings still match
+    __hash__ = str.__hash__
+
+    def __str__(self):
+        return self.value
+
+    __format__ = str.__format__
+
+
+# Branch of rows stored before branches existed
+DEFAULT_BRANCH = 'main'
+
+
+# Members hash and compare like their values, so this maps both the
+# strings and the members themselves
+_STATUSES = {status.value: status for status in Status}
+
+
+def parse_status(value):
+    status = _STATUSES.get(value)
+    if status is not None:
+        return status
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=65536)
+def parse_date(text):
+    # One shared date object per distinct day; text that is not an ISO date
+    # is kept as it was
+    if text is None or isinstance(text, date):
+        return text
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        return sys.intern(text)
+
+
+def loan_dates(issue_date, loan_days=7):
+    # ('YYYY-MM-DD', 'YYYY-MM-DD') for a loan starting on issue_date, or None
+    # when issue_date is not a valid ISO date
+    try:
+        start = date.fromisoformat(issue_date)
+    except (TypeError, ValueError):
+        return None
+    return start.isoformat(), (start + timedelta(days=loan_days)).isoformat()
+
+
+def _intern(text):
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+def _plain(value):
+    if value.__class__ is date:
+        return value.isoformat()
+    if value.__class__ is Status:
+        return value.value
+    return value
+
+
+class Record(Mapping):
+    # Read-only mapping view over the slots, with values as the row dicts
+    # had them. FIELDS is set by each subclass.
+    __slots__ = ()
+    FIELDS = ()
+    _keys = frozenset()
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return _plain(getattr(self, key))
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def to_dict(self):
+        return {key: _plain(getattr(self, key)) for key in self.FIELDS}
+
+    def to_tuple(self):
+        # Native values in FIELDS order; cls(*values) rebuilds the record
+        return tuple(getattr(self, key) for key in self.FIELDS)
+
+    @classmethod
+    def _make(cls, values):
+        return cls(*values)
+
+    @classmethod
+    def from_row(cls, row):
+        if row.__class__ is cls:
+            return row
+        return cls(*[row.get(key) for key in cls.FIELDS])
+
+
+@dataclass(slots=True, eq=False)
+class Book(Record):
+    id: str
+    title: str
+    author: str
+    isbn: str
+    genre: str = None
+    branch: str = DEFAULT_BRANCH
+
+    FIELDS = ('id', 'title', 'author', 'isbn', 'genre', 'branch')
+
+    def __post_init__(self):
+        self.genre = _intern(self.genre)
+        self.branch = _intern(self.branch or DEFAULT_BRANCH)
+
+
+@dataclass(slots=True, eq=False)
+class Student(Record):
+    id: str
+    name: str
+    username: str
+    password: str
+    rollNo: str = None
+
+    FIELDS = ('id', 'name', 'username', 'password', 'rollNo')
+
+
+@dataclass(slots=True, eq=False)
+class Issue(Record):
+    id: str
+    bookId: str
+    studentId: str
+    issueDate: date
+    returnDate: date
+    status: Status
+    copyId: str = None
+    fine: int = None
+    lastReminder: date = None
+    branch: str = DEFAULT_BRANCH
+
+    FIELDS = ('id', 'bookId', 'studentId', 'issueDate', 'returnDate', 'status', 'copyId',
+              'fine', 'lastReminder', 'branch')
+
+    def __post_init__(self):
+        self.issueDate = parse_date(self.issueDate)
+        self.returnDate = parse_date(self.returnDate)
+        self.status = parse_status(self.status)
+        self.lastReminder = parse_date(self.lastReminder)
+        self.branch = _intern(self.branch or DEFAULT_BRANCH)
+
+    @property
+    def due_ordinal(self):
+        # Day number of the return date, for cheap day arithmetic
+        return self.returnDate.toordinal()
+
+
+for _cls in (Book, Student, Issue):
+    _cls._keys = frozenset(_cls.FIELDS)
+
+
+def json_default(value):
+    # default= hook for json.dumps and Flask's JSON provider
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -0,0 +1,60 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler:
+    # Runs registered jobs one after another on a daemon thread, then sleeps
+    # for interval seconds. A failing job is logged and the rest still run.
+
+    def __init__(self, interval=300):
+        self.interval = interval
+        self.jobs = []
+        self.last_run = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, name, job):
+        self.jobs.append((name, job))
+
+    def run_pending(self):
+        # Returns {job name: result} for the jobs that succeeded
+        results = {}
+        with self._lock:
+            for name, job in self.jobs:
+                start = time.perf_counter()
+                try:
+                    results[name] = job()
+                except Exception:
+                    log.exception('Scheduled job %s failed', name)
+                    continue
+                self.last_run[name] = {
+                    'finished': time.time(),
+                    'seconds': time.perf_counter() - start,
+                    'result': results[name],
+                }
+        return results
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='library-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(self.interval)
@@ -0,0 +1,70 @@
+import re
+
+# Full-text index over the book fields edited in add_book/edit_book. It is an
+# FTS5 external-content table over books, kept in step by triggers so every
+# insert, update and delete is indexed incrementally in the same transaction.
+# Rows are matched on books.rowid, which VACUUM may renumber; run
+# rebuild_search_index() (or `flask rebuild-search-index`) after a VACUUM.
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, isbn, genre,
+    content='books', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author, isbn, genre)
+    VALUES (new.rowid, new.title, new.author, new.isbn, new.genre);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author, isbn, genre)
+    VALUES ('delete', old.rowid, old.title, old.author, old.isbn, old.genre);
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author, isbn, genre)
+    VALUES ('delete', old.rowid, old.title, old.author, old.isbn, old.genre);
+    INSERT INTO books_fts (rowid, title, author, isbn, genre)
+    VALUES (new.rowid, new.title, new.author, new.isbn, new.genre);
+END;
+'''
+
+# bm25 column weights: a title hit outranks an author hit, and so on
+RANK_SQL = 'bm25(books_fts, 10.0, 5.0, 2.0, 1.0)'
+
+SEARCH_SQL = f'''
+SELECT books.*, {RANK_SQL} AS score
+FROM books_fts JOIN books ON books.rowid = books_fts.rowid
+WHERE books_fts MATCH ?
+ORDER BY score
+LIMIT ?
+'''
+
+# Matches at one branch: (match, branch, limit)
+BRANCH_SEARCH_SQL = SEARCH_SQL.replace('MATCH ?', 'MATCH ? AND books.branch = ?')
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def install(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'").fetchone()
+    conn.executescript(SEARCH_SCHEMA)
+    if not exists:
+        # Index books that were stored before the search table existed
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+
+def rebuild(conn):
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+
+def fts_query(text):
+    # Every token must match as a word or word prefix. Tokens are quoted so
+    # user input can never form FTS5 operators.
+    tokens = _TOKEN.findall(text.lower())
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
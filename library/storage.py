@@ -0,0 +1,1310 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import warnings
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from library import counters, inventory, journal, search
+from library.pagination import decode_cursor, keyset_page
+from library.records import DEFAULT_BRANCH
+
+# Books, their copies and loans belong to one library branch. Students are
+# shared: a student can borrow at any branch.
+BOOK_FIELDS = ('id', 'title', 'author', 'isbn', 'genre', 'branch')
+STUDENT_FIELDS = ('id', 'name', 'username', 'password', 'rollNo')
+ISSUE_FIELDS = ('id', 'bookId', 'studentId', 'issueDate', 'returnDate', 'status', 'copyId',
+                'fine', 'lastReminder', 'branch')
+COPY_FIELDS = ('id', 'bookId', 'number', 'branch')
+BRANCH_FIELDS = ('id', 'name')
+# Tables whose changes are journaled, with their columns in order
+JOURNAL_TABLES = {'books': BOOK_FIELDS, 'students': STUDENT_FIELDS, 'issues': ISSUE_FIELDS}
+HOLD_FIELDS = ('id', 'bookId', 'studentId', 'requestDate', 'loanDays')
+
+BOOK_SORTS = ('title', 'author', 'genre')
+AVAILABILITY_FILTERS = ('available', 'issued')
+ISSUE_STATUS_FILTERS = ('requested', 'issued', 'overdue')
+ACTIVE_STATUSES = ('issued', 'requested', 'overdue')
+
+
+class Storage:
+    # Interface every storage backend implements. Records are plain dicts
+    # using the same keys the templates and JSON API already expect.
+
+    # Branches
+    def branches(self):
+        raise NotImplementedError
+
+    def get_branch(self, branch_id):
+        raise NotImplementedError
+
+    def add_branch(self, branch):
+        raise NotImplementedError
+
+    # Books. Methods taking branch=None cover every branch when it is None.
+    def all_books(self, branch=None):
+        raise NotImplementedError
+
+    def get_book(self, book_id):
+        raise NotImplementedError
+
+    def get_books(self, book_ids):
+        # Batch lookup: {book_id: book} for the ids that exist
+        books = {}
+        for book_id in set(book_ids):
+            book = self.get_book(book_id)
+            if book is not None:
+                books[book_id] = book
+        return books
+
+    def find_book_by_isbn(self, isbn, branch=None):
+        # With no branch, the copy of the title at any branch
+        raise NotImplementedError
+
+    def add_book(self, book):
+        raise NotImplementedError
+
+    def add_books(self, books):
+        with self.transaction():
+            for book in books:
+                self.add_book(book)
+
+    def update_book(self, book):
+        raise NotImplementedError
+
+    def delete_book(self, book_id):
+        raise NotImplementedError
+
+    def count_books(self, branch=None):
+        raise NotImplementedError
+
+    def page_books(self, sort='title', descending=False, filters=None,
+                   after=None, before=None, limit=25):
+        # Keyset-paginated listing; returns a library.pagination.Page.
+        # filters['branch'] limits it to one branch.
+        raise NotImplementedError
+
+    def book_genres(self):
+        raise NotImplementedError
+
+    def search_books(self, query, limit=25, branch=None):
+        # Ranked full-text matches over title, author, ISBN and genre
+        raise NotImplementedError
+
+    def rebuild_search_index(self):
+        pass
+
+    # Students
+    def all_students(self):
+        raise NotImplementedError
+
+    def get_student(self, student_id):
+        raise NotImplementedError
+
+    def get_students(self, student_ids):
+        students = {}
+        for student_id in set(student_ids):
+            student = self.get_student(student_id)
+            if student is not None:
+                students[student_id] = student
+        return students
+
+    def find_student_by_username(self, username):
+        raise NotImplementedError
+
+    def find_student_by_roll_no(self, roll_no):
+        raise NotImplementedError
+
+    def add_student(self, student):
+        raise NotImplementedError
+
+    def update_student(self, student):
+        raise NotImplementedError
+
+    def delete_student(self, student_id):
+        raise NotImplementedError
+
+    def count_students(self):
+        raise NotImplementedError
+
+    def page_students(self, query=None, after=None, before=None, limit=25):
+        # Keyset-paginated by name; query matches name, username or roll number
+        raise NotImplementedError
+
+    # Issues and requests. A loan belongs to the branch of its copy.
+    def all_issues(self, branch=None):
+        raise NotImplementedError
+
+    def get_issue(self, issue_id):
+        raise NotImplementedError
+
+    def get_issues(self, issue_ids):
+        issues = {}
+        for issue_id in set(issue_ids):
+            issue = self.get_issue(issue_id)
+            if issue is not None:
+                issues[issue_id] = issue
+        return issues
+
+    def issues_for_student(self, student_id):
+        raise NotImplementedError
+
+    def issues_for_students(self, student_ids):
+        # {student_id: [issues]} for every given student, in one query where
+        # the backend can
+        return {student_id: self.issues_for_student(student_id) for student_id in student_ids}
+
+    def issues_for_book(self, book_id):
+        raise NotImplementedError
+
+    def page_issues(self, student_id=None, status=None, today=None,
+                    after=None, before=None, limit=25, branch=None):
+        # Keyset-paginated by issue date. status is one of
+        # ISSUE_STATUS_FILTERS; 'overdue' also matches loans due before today
+        # that the overdue sweep has not marked yet.
+        raise NotImplementedError
+
+    def add_issue(self, issue):
+        raise NotImplementedError
+
+    def reserve_book(self, issue):
+        # Atomically adds the issue on a free copy of issue['bookId'].
+        # Returns False, changing nothing, if every copy is out.
+        raise NotImplementedError
+
+    def reserve_books(self, issues):
+        # reserve_book for each issue in one transaction; one result each
+        with self.transaction():
+            return [self.reserve_book(issue) for issue in issues]
+
+    def request_book(self, request):
+        # Sets a free copy aside for the request, or queues a hold when every
+        # copy is out. Returns 'requested', 'queued', 'unavailable' when the
+        # title has no copies to wait for, or None if the student already
+        # has the title on loan, requested or on hold.
+        raise NotImplementedError
+
+    def set_issue_status(self, issue_id, status):
+        raise NotImplementedError
+
+    def delete_issue(self, issue_id):
+        # Returning a copy hands it to the oldest hold on the title
+        raise NotImplementedError
+
+    def delete_issues(self, issue_ids):
+        with self.transaction():
+            return [self.delete_issue(issue_id) for issue_id in issue_ids]
+
+    def approve_requests(self, issue_ids):
+        # Issues the pending requests among issue_ids in one transaction.
+        # Returns one result per id: False if it was not a pending request.
+        raise NotImplementedError
+
+    def count_issues(self, branch=None):
+        raise NotImplementedError
+
+    def is_book_available(self, book_id):
+        raise NotImplementedError
+
+    def available_books(self, branch=None):
+        raise NotImplementedError
+
+    def count_available_books(self, branch=None):
+        raise NotImplementedError
+
+    # Overdue sweeps. Each call is one short transaction over at most limit
+    # loans and returns the issue rows it changed. Fines are days overdue
+    # times fine_per_day, capped at fine_max unless it is None.
+    def mark_overdue(self, today, fine_per_day, fine_max, limit=1000):
+        # Marks issued loans due before today overdue and queues a reminder
+        raise NotImplementedError
+
+    def overdue_dates(self):
+        # Distinct return dates of overdue loans, oldest first
+        raise NotImplementedError
+
+    def update_fines(self, return_date, today, fine_per_day, fine_max):
+        # Recomputes the fines of overdue loans due on return_date
+        raise NotImplementedError
+
+    def queue_due_reminders(self, today, until, limit=1000):
+        # Queues one reminder for issued loans due between today and until
+        raise NotImplementedError
+
+    def claim_reminders(self, limit=500, lease=300):
+        # Leases the oldest unclaimed reminders to the caller for lease
+        # seconds. Returns (claim id, reminders); pass the claim id to
+        # finish_reminders once they are sent, or release_reminders.
+        raise NotImplementedError
+
+    def finish_reminders(self, claim_id):
+        # Removes the claim's reminders; returns how many were still held
+        raise NotImplementedError
+
+    def release_reminders(self, claim_id):
+        # Hands the claim's reminders back for the next delivery
+        raise NotImplementedError
+
+    # Copies and holds
+    def book_inventory(self, book_ids):
+        # {book_id: {'total', 'available', 'onHold', 'queued'}} for the given books
+        raise NotImplementedError
+
+    def add_copies(self, book_id, count):
+        # Returns the number of copies added; queued holds are served first
+        raise NotImplementedError
+
+    def remove_copies(self, book_id, count):
+        # Removes up to count copies that are not out; returns how many
+        raise NotImplementedError
+
+    def transfer_copies(self, book_id, branch, count):
+        # Moves up to count copies of the book that are not out to the same
+        # title (by ISBN) at branch, adding the title there if it has none.
+        # Returns (target book id, copies moved), or None when the book or
+        # branch does not exist or the book is already at that branch.
+        raise NotImplementedError
+
+    def get_hold(self, hold_id):
+        raise NotImplementedError
+
+    def holds_for_student(self, student_id):
+        # Oldest first, each with its 1-based 'position' in the title's queue
+        raise NotImplementedError
+
+    def delete_hold(self, hold_id):
+        raise NotImplementedError
+
+    # Counters
+    def counters(self):
+        # {'books', 'students', 'issues', 'requests', 'unavailable'} totals
+        raise NotImplementedError
+
+    def student_counters(self, student_ids):
+        # {student_id: {'issues': n, 'requests': n}} for the given students
+        raise NotImplementedError
+
+    def check_counters(self):
+        return []
+
+    def rebuild_counters(self):
+        pass
+
+    # Change tracking
+    def generations(self):
+        # {'books': (generation, modified), 'students': ..., 'issues': ...}
+        # where generation grows with every write to that collection and
+        # modified is the unix time of the last write
+        raise NotImplementedError
+
+    # Journal. Backends without one return None and IndexedStorage falls
+    # back to full reloads.
+    def journal_id(self):
+        return None
+
+    def journal_head(self):
+        # seq of the newest event
+        return None
+
+    def journal_events(self, after, limit=None):
+        # [(seq, entity, op, id, values)] after seq `after`, oldest first, or
+        # None if they are no longer all available
+        return None
+
+    def prune_journal(self, through):
+        return 0
+
+    def loan_history(self, student_id=None, book_id=None, limit=25):
+        # Closed loans and requests, newest first
+        raise NotImplementedError
+
+    # Analytics. Loans (not requests) as lists of plain tuples, with dates
+    # as date.toordinal() day numbers; rows with unparseable dates are left
+    # out. See library.analytics.
+    def closed_loans(self, after=0, batch_size=100000):
+        # Batches of (seq, issued, due, closed, bookId, studentId) for the
+        # returned loans with seq > after, in seq order
+        raise NotImplementedError
+
+    def open_loans(self, batch_size=100000):
+        # Batches of (issued, due, bookId, studentId) for the loans still out
+        raise NotImplementedError
+
+    # Metadata
+    def get_meta(self, key, default=None):
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        raise NotImplementedError
+
+    # Streaming iteration for exports; backends should avoid building lists.
+    # rows is one of the parts row_ranges() returns, or None for every row.
+    def iter_books(self, rows=None):
+        return iter(self.all_books())
+
+    def iter_students(self, rows=None):
+        return iter(self.all_students())
+
+    def iter_issues(self, rows=None):
+        return iter(self.all_issues())
+
+    def row_ranges(self, entity, parts):
+        # Splits books, students or issues into about `parts` contiguous
+        # parts for iter_* to read separately, as background jobs do on
+        # several cores. Backends that cannot split return one part.
+        return [None]
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+    def seed_books(self, books):
+        self.add_books([dict(book) for book in books])
+
+    def close(self):
+        pass
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS branches (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+INSERT OR IGNORE INTO branches (id, name) VALUES ('main', 'Main Library');
+
+CREATE TABLE IF NOT EXISTS books (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    isbn TEXT NOT NULL,
+    genre TEXT,
+    branch TEXT NOT NULL DEFAULT 'main'
+);
+CREATE INDEX IF NOT EXISTS idx_books_isbn ON books(isbn);
+CREATE INDEX IF NOT EXISTS idx_books_title ON books(title COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_books_author ON books(author COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_books_genre ON books(IFNULL(genre, '') COLLATE NOCASE, id);
+
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password TEXT NOT NULL,
+    rollNo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_students_username ON students(username);
+CREATE INDEX IF NOT EXISTS idx_students_roll_no ON students(rollNo);
+CREATE INDEX IF NOT EXISTS idx_students_name ON students(name COLLATE NOCASE, id);
+
+CREATE TABLE IF NOT EXISTS issues (
+    id TEXT PRIMARY KEY,
+    bookId TEXT NOT NULL,
+    studentId TEXT NOT NULL,
+    issueDate TEXT NOT NULL,
+    returnDate TEXT NOT NULL,
+    status TEXT NOT NULL,
+    copyId TEXT,
+    fine INTEGER,
+    lastReminder TEXT,
+    branch TEXT NOT NULL DEFAULT 'main'
+);
+CREATE INDEX IF NOT EXISTS idx_issues_book ON issues(bookId);
+CREATE INDEX IF NOT EXISTS idx_issues_student ON issues(studentId, issueDate, id);
+CREATE INDEX IF NOT EXISTS idx_issues_date ON issues(issueDate, id);
+CREATE INDEX IF NOT EXISTS idx_issues_due ON issues(status, returnDate);
+
+CREATE TABLE IF NOT EXISTS copies (
+    id TEXT PRIMARY KEY,
+    bookId TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    branch TEXT NOT NULL DEFAULT 'main'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_copies_book ON copies(bookId, number);
+
+CREATE TABLE IF NOT EXISTS holds (
+    id TEXT PRIMARY KEY,
+    bookId TEXT NOT NULL,
+    studentId TEXT NOT NULL,
+    requestDate TEXT NOT NULL,
+    loanDays INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_holds_book ON holds(bookId);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_holds_student ON holds(studentId, bookId);
+
+-- Reminders waiting for delivery, written in the same transaction as the
+-- change that caused them. A sender leases a batch (claimId, leaseUntil)
+-- while it delivers it; a lapsed lease makes the batch claimable again.
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    issueId TEXT NOT NULL,
+    created TEXT NOT NULL,
+    claimId TEXT,
+    leaseUntil REAL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0,
+    modified INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO generations (name) VALUES ('books'), ('students'), ('issues');
+'''
+
+# Backstop for reserve_book: at most one active loan or request per copy,
+# enforced by the database for every process sharing the file
+ACTIVE_LOAN_INDEX = '''
+CREATE INDEX IF NOT EXISTS idx_issues_copy ON issues(copyId);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_issues_active_copy ON issues(copyId)
+WHERE status IN ('issued', 'requested', 'overdue');
+'''
+
+# Branch partitions: every per-branch listing and count is a range scan
+# over one of these, so it costs the size of that branch, not the library.
+# Created after upgrades, which add the branch columns to older databases.
+BRANCH_INDEXES = '''
+CREATE INDEX IF NOT EXISTS idx_books_branch_title ON books(branch, title COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_books_branch_author ON books(branch, author COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_books_branch_genre ON books(branch, IFNULL(genre, '') COLLATE NOCASE, id);
+CREATE INDEX IF NOT EXISTS idx_books_branch_isbn ON books(branch, isbn);
+CREATE INDEX IF NOT EXISTS idx_copies_branch ON copies(branch, bookId);
+CREATE INDEX IF NOT EXISTS idx_issues_branch ON issues(branch, issueDate, id);
+CREATE INDEX IF NOT EXISTS idx_issues_branch_status ON issues(branch, status, returnDate);
+'''
+
+# Bumped for schema changes that CREATE ... IF NOT EXISTS cannot make
+SCHEMA_VERSION = 4
+
+# date.toordinal() of an ISO date column; julianday() is x.5 at midnight
+ORDINAL_SQL = 'CAST(julianday({0}) - 1721424.5 AS INTEGER)'
+
+# Days overdue times :rate, capped at :cap unless it is NULL
+DAYS_OVERDUE_SQL = 'CAST(julianday(:today) - julianday(returnDate) AS INTEGER)'
+FINE_SQL = f'MIN({DAYS_OVERDUE_SQL} * :rate, IFNULL(:cap, {DAYS_OVERDUE_SQL} * :rate))'
+
+# Every write to a collection bumps its generation in the same transaction.
+# Branches and copies count as part of the catalog and holds as part of
+# circulation.
+GENERATION_TRIGGER = '''
+CREATE TRIGGER IF NOT EXISTS generation_{table}_{event} AFTER {event} ON {table} BEGIN
+    UPDATE generations SET value = value + 1, modified = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = '{collection}';
+END;
+'''
+GENERATION_TABLES = {
+    'branches': 'books',
+    'books': 'books',
+    'copies': 'books',
+    'students': 'students',
+    'issues': 'issues',
+    'holds': 'issues',
+}
+GENERATION_TRIGGERS = ''.join(
+    GENERATION_TRIGGER.format(table=table, collection=collection, event=event)
+    for table, collection in GENERATION_TABLES.items()
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+
+BOOK_SORT_SQL = {
+    'title': 'title COLLATE NOCASE',
+    'author': 'author COLLATE NOCASE',
+    'genre': "IFNULL(genre, '') COLLATE NOCASE",
+}
+
+AVAILABLE_SQL = ('EXISTS (SELECT 1 FROM inventory WHERE inventory.bookId = books.id '
+                 'AND inventory.available > 0)')
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _book_sort_key(sort):
+    if sort == 'genre':
+        return lambda book: (book['genre'] or '', book['id'])
+    return lambda book: (book[sort], book['id'])
+
+
+def _dict_factory(cursor, row):
+    return {column[0]: row[i] for i, column in enumerate(cursor.description)}
+
+
+class SQLiteStorage(Storage):
+    # Embedded SQLite backend. Each thread (and each forked worker process)
+    # gets its own connection; WAL mode lets readers run alongside a writer.
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA + GENERATION_TRIGGERS)
+        upgraded = self._upgrade()
+        conn.executescript(BRANCH_INDEXES)
+        try:
+            conn.executescript(ACTIVE_LOAN_INDEX)
+        except sqlite3.IntegrityError:
+            warnings.warn('Some copies already have more than one active loan; the one-loan-per-copy '
+                          'index was not created. Reservations are still checked inside a write '
+                          'transaction.')
+        search.install(conn)
+        created = [inventory.install(conn), counters.install(conn)]
+        journal.install(conn, JOURNAL_TABLES)
+        if upgraded or any(created):
+            self.rebuild_counters()
+
+    def _upgrade(self):
+        # Returns True when an existing database was migrated
+        with self.transaction() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()['user_version']
+            if version >= SCHEMA_VERSION:
+                return False
+            if version < 1:
+                # Multi-copy inventory: loans move from books to copies
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(issues)')}
+                if 'copyId' not in columns:
+                    conn.execute('ALTER TABLE issues ADD COLUMN copyId TEXT')
+                conn.execute('DROP INDEX IF EXISTS idx_issues_active_book')
+                for trigger in counters.LEGACY_TRIGGERS:
+                    conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                inventory.backfill(conn)
+            if version < 2:
+                # Overdue sweeps: fines, reminders, and 'overdue' as an active
+                # status, which the active-loan index and triggers must include
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(issues)')}
+                for column, definition in (('fine', 'INTEGER'), ('lastReminder', 'TEXT')):
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE issues ADD COLUMN {column} {definition}')
+                conn.execute('DROP INDEX IF EXISTS idx_issues_active_copy')
+                for trigger in inventory.trigger_names(conn) + ['counters_issues_update']:
+                    conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            if version < 3:
+                # Branches: existing rows belong to the main branch. The
+                # journal triggers record every column, so they are dropped
+                # here and recreated with the new one.
+                for table in ('books', 'copies', 'issues', 'loan_history'):
+                    columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+                    if columns and 'branch' not in columns:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN branch TEXT NOT NULL "
+                                     f"DEFAULT '{DEFAULT_BRANCH}'")
+                for trigger in journal.trigger_names(conn):
+                    conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+            if version < 4:
+                # Leased reminder delivery
+                columns = {row['name'] for row in conn.execute('PRAGMA table_info(outbox)')}
+                for column, definition in (('claimId', 'TEXT'), ('leaseUntil', 'REAL')):
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {definition}')
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            return True
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = _dict_factory
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _one(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchone()
+
+    def _all(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _iter(self, sql, params=(), chunk_size=500):
+        cursor = self._connection().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield from rows
+
+    def _batches(self, sql, params, batch_size):
+        # Lists of plain tuples, which cost far less than dict rows
+        cursor = self._connection().cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield rows
+
+    def _many(self, table, ids):
+        ids = list(set(ids))
+        result = {}
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in self._all(f'SELECT * FROM {table} WHERE id IN ({placeholders})', chunk):
+                result[row['id']] = row
+        return result
+
+    def _insert(self, table, fields, record):
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        with self.transaction() as conn:
+            conn.execute(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                         [record.get(field) for field in fields])
+        return record
+
+    def _update(self, table, fields, record):
+        assignments = ', '.join(f'{field} = ?' for field in fields if field != 'id')
+        values = [record.get(field) for field in fields if field != 'id']
+        with self.transaction() as conn:
+            conn.execute(f'UPDATE {table} SET {assignments} WHERE id = ?', values + [record['id']])
+        return record
+
+    def _delete(self, table, record_id):
+        with self.transaction() as conn:
+            return conn.execute(f'DELETE FROM {table} WHERE id = ?', (record_id,)).rowcount > 0
+
+    # Branches
+    def branches(self):
+        return self._all('SELECT * FROM branches ORDER BY name COLLATE NOCASE, id')
+
+    def get_branch(self, branch_id):
+        return self._one('SELECT * FROM branches WHERE id = ?', (branch_id,))
+
+    def add_branch(self, branch):
+        return self._insert('branches', BRANCH_FIELDS, branch)
+
+    # Books
+    def all_books(self, branch=None):
+        if branch is not None:
+            return self._all('SELECT * FROM books WHERE branch = ? ORDER BY rowid', (branch,))
+        return self._all('SELECT * FROM books ORDER BY rowid')
+
+    def get_book(self, book_id):
+        return self._one('SELECT * FROM books WHERE id = ?', (book_id,))
+
+    def get_books(self, book_ids):
+        return self._many('books', book_ids)
+
+    def find_book_by_isbn(self, isbn, branch=None):
+        if branch is not None:
+            return self._one('SELECT * FROM books WHERE branch = ? AND isbn = ?', (branch, isbn))
+        return self._one('SELECT * FROM books WHERE isbn = ? ORDER BY rowid LIMIT 1', (isbn,))
+
+    def add_book(self, book):
+        self.add_books([book])
+        return book
+
+    def add_books(self, books):
+        # Every new book starts with one copy; add_copies adds more
+        placeholders = ', '.join('?' for _ in BOOK_FIELDS)
+        with self.transaction() as conn:
+            conn.executemany(
+                f'INSERT INTO books ({", ".join(BOOK_FIELDS)}) VALUES ({placeholders})',
+                ([book.get(field) for field in BOOK_FIELDS[:-1]] + [book.get('branch') or DEFAULT_BRANCH]
+                 for book in books))
+            conn.executemany(
+                'INSERT INTO copies (id, bookId, number, branch) VALUES (?, ?, 1, ?)',
+                ((f'copy-{uuid.uuid4()}', book['id'], book.get('branch') or DEFAULT_BRANCH)
+                 for book in books))
+        return books
+
+    def update_book(self, book):
+        # A book changes branch only by transfer_copies
+        return self._update('books', BOOK_FIELDS[:-1], book)
+
+    def delete_book(self, book_id):
+        return self._delete('books', book_id)
+
+    def count_books(self, branch=None):
+        if branch is not None:
+            return self._one('SELECT COUNT(*) AS n FROM books WHERE branch = ?', (branch,))['n']
+        return self.counters()['books']
+
+    def page_books(self, sort='title', descending=False, filters=None,
+                   after=None, before=None, limit=25):
+        if sort not in BOOK_SORTS:
+            raise ValueError(f'Unknown sort field: {sort}')
+        filters = filters or {}
+        clauses, params = [], []
+        for field in ('title', 'author'):
+            if filters.get(field):
+                clauses.append(f"{field} LIKE ? ESCAPE '\\'")
+                params.append(_like_pattern(filters[field]))
+        if filters.get('genre'):
+            clauses.append("IFNULL(genre, '') = ? COLLATE NOCASE")
+            params.append(filters['genre'])
+        if filters.get('branch'):
+            clauses.append('branch = ?')
+            params.append(filters['branch'])
+        availability = filters.get('availability')
+        if availability == 'available':
+            clauses.append(AVAILABLE_SQL)
+        elif availability == 'issued':
+            clauses.append('NOT ' + AVAILABLE_SQL)
+
+        sort_sql = BOOK_SORT_SQL[sort]
+        # Walking backwards flips both the comparison and the ORDER BY
+        backwards = before is not None
+        reverse = descending != backwards
+        cursor = decode_cursor(before if backwards else after)
+        if cursor is not None:
+            clauses.append(f"({sort_sql}, id) {'<' if reverse else '>'} (?, ?)")
+            params.extend(cursor)
+        direction = 'DESC' if reverse else 'ASC'
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        rows = self._all(
+            f'SELECT * FROM books {where} ORDER BY {sort_sql} {direction}, id {direction} LIMIT ?',
+            params + [limit + 1])
+        return keyset_page(rows, limit, _book_sort_key(sort), after=after, before=before)
+
+    def search_books(self, query, limit=25, branch=None):
+        match = search.fts_query(query)
+        if match is None:
+            return []
+        if branch is not None:
+            rows = self._all(search.BRANCH_SEARCH_SQL, (match, branch, limit))
+        else:
+            rows = self._all(search.SEARCH_SQL, (match, limit))
+        for row in rows:
+            del row['score']
+        return rows
+
+    def rebuild_search_index(self):
+        with self.transaction() as conn:
+            search.rebuild(conn)
+
+    def book_genres(self):
+        return [row['genre'] for row in self._all(
+            "SELECT DISTINCT IFNULL(genre, '') COLLATE NOCASE AS genre FROM books "
+            "WHERE IFNULL(genre, '') != '' ORDER BY 1")]
+
+    # Students
+    def all_students(self):
+        return self._all('SELECT * FROM students ORDER BY rowid')
+
+    def get_student(self, student_id):
+        return self._one('SELECT * FROM students WHERE id = ?', (student_id,))
+
+    def get_students(self, student_ids):
+        return self._many('students', student_ids)
+
+    def find_student_by_username(self, username):
+        return self._one('SELECT * FROM students WHERE username = ?', (username,))
+
+    def find_student_by_roll_no(self, roll_no):
+        return self._one('SELECT * FROM students WHERE rollNo = ?', (roll_no,))
+
+    def add_student(self, student):
+        return self._insert('students', STUDENT_FIELDS, student)
+
+    def update_student(self, student):
+        return self._update('students', STUDENT_FIELDS, student)
+
+    def delete_student(self, student_id):
+        return self._delete('students', student_id)
+
+    def count_students(self):
+        return self.counters()['students']
+
+    def page_students(self, query=None, after=None, before=None, limit=25):
+        clauses, params = [], []
+        if query:
+            pattern = _like_pattern(query)
+            clauses.append("(name LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\' "
+                           "OR rollNo LIKE ? ESCAPE '\\')")
+            params.extend([pattern] * 3)
+        backwards = before is not None
+        cursor = decode_cursor(before if backwards else after)
+        if cursor is not None:
+            clauses.append(f"(name COLLATE NOCASE, id) {'<' if backwards else '>'} (?, ?)")
+            params.extend(cursor)
+        direction = 'DESC' if backwards else 'ASC'
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        rows = self._all(
+            f'SELECT * FROM students {where} '
+            f'ORDER BY name COLLATE NOCASE {direction}, id {direction} LIMIT ?',
+            params + [limit + 1])
+        return keyset_page(rows, limit, lambda student: (student['name'], student['id']),
+                           after=after, before=before)
+
+    # Issues and requests
+    def all_issues(self, branch=None):
+        if branch is not None:
+            return self._all('SELECT * FROM issues WHERE branch = ? ORDER BY rowid', (branch,))
+        return self._all('SELECT * FROM issues ORDER BY rowid')
+
+    def get_issue(self, issue_id):
+        return self._one('SELECT * FROM issues WHERE id = ?', (issue_id,))
+
+    def get_issues(self, issue_ids):
+        return self._many('issues', issue_ids)
+
+    def issues_for_student(self, student_id):
+        return self._all('SELECT * FROM issues WHERE studentId = ? ORDER BY rowid', (student_id,))
+
+    def issues_for_students(self, student_ids):
+        result = {student_id: [] for student_id in student_ids}
+        student_ids = list(result)
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(student_ids), 500):
+            chunk = student_ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in self._all(f'SELECT * FROM issues WHERE studentId IN ({placeholders}) '
+                                 'ORDER BY rowid', chunk):
+                result[row['studentId']].append(row)
+        return result
+
+    def issues_for_book(self, book_id):
+        return self._all('SELECT * FROM issues WHERE bookId = ? ORDER BY rowid', (book_id,))
+
+    def page_issues(self, student_id=None, status=None, today=None,
+                    after=None, before=None, limit=25, branch=None):
+        clauses, params = [], []
+        if student_id is not None:
+            clauses.append('studentId = ?')
+            params.append(student_id)
+        if branch is not None:
+            clauses.append('branch = ?')
+            params.append(branch)
+        if status == 'requested':
+            clauses.append("status = 'requested'")
+        elif status == 'issued':
+            clauses.append("status IN ('issued', 'overdue')")
+        elif status == 'overdue':
+            clauses.append("(status = 'overdue' OR (status = 'issued' AND returnDate < ?))")
+            params.append(today)
+        backwards = before is not None
+        cursor = decode_cursor(before if backwards else after)
+        if cursor is not None:
+            clauses.append(f"(issueDate, id) {'<' if backwards else '>'} (?, ?)")
+            params.extend(cursor)
+        direction = 'DESC' if backwards else 'ASC'
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        rows = self._all(
+            f'SELECT * FROM issues {where} ORDER BY issueDate {direction}, id {direction} LIMIT ?',
+            params + [limit + 1])
+        return keyset_page(rows, limit, lambda issue: (issue['issueDate'], issue['id']),
+                           after=after, before=before)
+
+    def add_issue(self, issue):
+        if not issue.get('branch'):
+            book = self.get_book(issue['bookId'])
+            issue = dict(issue, branch=book['branch'] if book else DEFAULT_BRANCH)
+        return self._insert('issues', ISSUE_FIELDS, issue)
+
+    def _reserve(self, conn, issue):
+        copy = conn.execute(inventory.FREE_COPIES_SQL + ' LIMIT 1', (issue['bookId'],)).fetchone()
+        if copy is None:
+            return False
+        # The loan is at the branch holding the copy
+        values = dict(issue, copyId=copy['id'], branch=copy['branch'])
+        placeholders = ', '.join('?' for _ in ISSUE_FIELDS)
+        conn.execute(f'INSERT INTO issues ({", ".join(ISSUE_FIELDS)}) VALUES ({placeholders})',
+                     [values.get(field) for field in ISSUE_FIELDS])
+        return True
+
+    def _serve_holds(self, conn, book_id):
+        # Free copies go to the oldest holds as requests awaiting approval
+        while True:
+            hold = conn.execute('SELECT * FROM holds WHERE bookId = ? ORDER BY rowid LIMIT 1',
+                                (book_id,)).fetchone()
+            if hold is None:
+                return
+            today = date.today()
+            if not self._reserve(conn, {
+                'id': hold['id'],
+                'bookId': book_id,
+                'studentId': hold['studentId'],
+                'issueDate': today.isoformat(),
+                'returnDate': (today + timedelta(days=hold['loanDays'])).isoformat(),
+                'status': 'requested',
+            }):
+                return
+            conn.execute('DELETE FROM holds WHERE id = ?', (hold['id'],))
+
+    def reserve_book(self, issue):
+        # BEGIN IMMEDIATE takes the database write lock before looking for a
+        # free copy, so the check and the insert are one atomic step across
+        # threads and worker processes
+        try:
+            with self.transaction() as conn:
+                return self._reserve(conn, issue)
+        except sqlite3.IntegrityError:
+            return False
+
+    def reserve_books(self, issues):
+        results = []
+        with self.transaction() as conn:
+            for issue in issues:
+                try:
+                    results.append(self._reserve(conn, issue))
+                except sqlite3.IntegrityError:
+                    # Only this statement is rolled back, not the batch
+                    results.append(False)
+        return results
+
+    def request_book(self, request):
+        loan_days = (date.fromisoformat(request['returnDate'])
+                     - date.fromisoformat(request['issueDate'])).days
+        with self.transaction() as conn:
+            if conn.execute(
+                    'SELECT 1 FROM issues WHERE bookId = ? AND studentId = ? '
+                    f'AND {inventory.ACTIVE_SQL} '
+                    'UNION ALL SELECT 1 FROM holds WHERE bookId = ? AND studentId = ?',
+                    (request['bookId'], request['studentId']) * 2).fetchone():
+                return None
+            if self._reserve(conn, request):
+                return 'requested'
+            if not conn.execute('SELECT 1 FROM copies WHERE bookId = ?',
+                                (request['bookId'],)).fetchone():
+                return 'unavailable'
+            conn.execute(
+                f'INSERT INTO holds ({", ".join(HOLD_FIELDS)}) VALUES (?, ?, ?, ?, ?)',
+                (request['id'], request['bookId'], request['studentId'],
+                 request['issueDate'], loan_days))
+            return 'queued'
+
+    def set_issue_status(self, issue_id, status):
+        with self.transaction() as conn:
+            return conn.execute('UPDATE issues SET status = ? WHERE id = ?',
+                                (status, issue_id)).rowcount > 0
+
+    def delete_issue(self, issue_id):
+        return self.delete_issues([issue_id])[0]
+
+    def delete_issues(self, issue_ids):
+        results = []
+        returned = {}
+        with self.transaction() as conn:
+            for issue_id in issue_ids:
+                copy = conn.execute('SELECT copies.bookId FROM issues JOIN copies '
+                                    'ON copies.id = issues.copyId WHERE issues.id = ?',
+                                    (issue_id,)).fetchone()
+                deleted = conn.execute('DELETE FROM issues WHERE id = ?', (issue_id,)).rowcount > 0
+                results.append(deleted)
+                if deleted and copy is not None:
+                    returned[copy['bookId']] = True
+            # Holds are served once per title, after all its copies are back
+            for book_id in returned:
+                self._serve_holds(conn, book_id)
+        return results
+
+    def approve_requests(self, issue_ids):
+        with self.transaction() as conn:
+            return [conn.execute("UPDATE issues SET status = 'issued' "
+                                 "WHERE id = ? AND status = 'requested'",
+                                 (issue_id,)).rowcount > 0
+                    for issue_id in issue_ids]
+
+    def count_issues(self, branch=None):
+        if branch is not None:
+            return self._one('SELECT COUNT(*) AS n FROM issues WHERE branch = ?', (branch,))['n']
+        return self.counters()['issues']
+
+    def is_book_available(self, book_id):
+        return self._one('SELECT 1 FROM inventory WHERE bookId = ? AND available > 0',
+                         (book_id,)) is not None
+
+    def available_books(self, branch=None):
+        if branch is not None:
+            return self._all('SELECT books.* FROM books JOIN inventory ON inventory.bookId = books.id '
+                             'WHERE books.branch = ? AND inventory.available > 0 ORDER BY books.rowid',
+                             (branch,))
+        return self._all('SELECT books.* FROM books JOIN inventory ON inventory.bookId = books.id '
+                         'WHERE inventory.available > 0 ORDER BY books.rowid')
+
+    def count_available_books(self, branch=None):
+        if branch is not None:
+            return self._one('SELECT COUNT(*) AS n FROM books JOIN inventory '
+                             'ON inventory.bookId = books.id '
+                             'WHERE books.branch = ? AND inventory.available > 0', (branch,))['n']
+        totals = self.counters()
+        return totals['books'] - totals['unavailable']
+
+    # Overdue sweeps
+    def _queue_reminders(self, conn, kind, issues, today):
+        conn.executemany('INSERT INTO outbox (kind, issueId, created) VALUES (?, ?, ?)',
+                         ((kind, issue['id'], today) for issue in issues))
+
+    def mark_overdue(self, today, fine_per_day, fine_max, limit=1000):
+        with self.transaction() as conn:
+            rows = conn.execute(
+                f"UPDATE issues SET status = 'overdue', fine = {FINE_SQL}, lastReminder = 'overdue' "
+                "WHERE id IN (SELECT id FROM issues WHERE status = 'issued' AND returnDate < :today "
+                'ORDER BY returnDate LIMIT :limit) RETURNING *',
+                {'today': today, 'rate': fine_per_day, 'cap': fine_max, 'limit': limit}).fetchall()
+            self._queue_reminders(conn, 'overdue', rows, today)
+        return rows
+
+    def overdue_dates(self):
+        return [row['returnDate'] for row in self._all(
+            "SELECT DISTINCT returnDate FROM issues WHERE status = 'overdue' ORDER BY returnDate")]
+
+    def update_fines(self, return_date, today, fine_per_day, fine_max):
+        with self.transaction() as conn:
+            return conn.execute(
+                f'UPDATE issues SET fine = {FINE_SQL} '
+                "WHERE status = 'overdue' AND returnDate = :due AND fine IS NOT "
+                f'{FINE_SQL} RETURNING *',
+                {'today': today, 'rate': fine_per_day, 'cap': fine_max, 'due': return_date}).fetchall()
+
+    def queue_due_reminders(self, today, until, limit=1000):
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "UPDATE issues SET lastReminder = 'due' WHERE id IN (SELECT id FROM issues "
+                "WHERE status = 'issued' AND returnDate BETWEEN ? AND ? AND lastReminder IS NULL "
+                'ORDER BY returnDate LIMIT ?) RETURNING *', (today, until, limit)).fetchall()
+            self._queue_reminders(conn, 'due', rows, today)
+        return rows
+
+    def claim_reminders(self, limit=500, lease=300):
+        claim_id, now = uuid.uuid4().hex, time.time()
+        with self.transaction() as conn:
+            rows = conn.execute(
+                'UPDATE outbox SET claimId = ?, leaseUntil = ? WHERE id IN (SELECT id FROM outbox '
+                'WHERE claimId IS NULL OR leaseUntil < ? ORDER BY id LIMIT ?) RETURNING *',
+                (claim_id, now + lease, now, limit)).fetchall()
+        rows.sort(key=lambda row: row['id'])
+        return claim_id, rows
+
+    def finish_reminders(self, claim_id):
+        with self.transaction() as conn:
+            return conn.execute('DELETE FROM outbox WHERE claimId = ?', (claim_id,)).rowcount
+
+    def release_reminders(self, claim_id):
+        with self.transaction() as conn:
+            conn.execute('UPDATE outbox SET claimId = NULL, leaseUntil = NULL WHERE claimId = ?',
+                         (claim_id,))
+
+    # Copies and holds
+    def book_inventory(self, book_ids):
+        result = {}
+        book_ids = list(book_ids)
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(book_ids), 500):
+            chunk = book_ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in self._all(f'SELECT * FROM inventory WHERE bookId IN ({placeholders})', chunk):
+                result[row.pop('bookId')] = row
+        return {book_id: result.get(book_id, dict.fromkeys(inventory.INVENTORY_FIELDS, 0))
+                for book_id in book_ids}
+
+    def add_copies(self, book_id, count):
+        with self.transaction() as conn:
+            book = self.get_book(book_id)
+            if count <= 0 or book is None:
+                return 0
+            row = conn.execute('SELECT IFNULL(MAX(number), 0) AS number FROM copies '
+                               'WHERE bookId = ?', (book_id,)).fetchone()
+            conn.executemany('INSERT INTO copies (id, bookId, number, branch) VALUES (?, ?, ?, ?)',
+                             ((f'copy-{uuid.uuid4()}', book_id, row['number'] + i, book['branch'])
+                              for i in range(1, count + 1)))
+            self._serve_holds(conn, book_id)
+            return count
+
+    def remove_copies(self, book_id, count):
+        # Highest-numbered free copies go first
+        with self.transaction() as conn:
+            return conn.execute(
+                f'DELETE FROM copies WHERE id IN (SELECT id FROM ({inventory.FREE_COPIES_SQL}) '
+                'ORDER BY number DESC LIMIT ?)', (book_id, max(count, 0))).rowcount
+
+    def transfer_copies(self, book_id, branch, count):
+        with self.transaction() as conn:
+            book = self.get_book(book_id)
+            if book is None or book['branch'] == branch or self.get_branch(branch) is None:
+                return None
+            target = self.find_book_by_isbn(book['isbn'], branch)
+            if target is None:
+                target = dict(book, id=f'book-{uuid.uuid4()}', branch=branch)
+                conn.execute(f'INSERT INTO books ({", ".join(BOOK_FIELDS)}) '
+                             f'VALUES ({", ".join("?" for _ in BOOK_FIELDS)})',
+                             [target[field] for field in BOOK_FIELDS])
+            # Highest-numbered free copies go, as with remove_copies. Copies
+            # keep their ids, so loan history still points at them.
+            moving = conn.execute(f'SELECT id FROM ({inventory.FREE_COPIES_SQL}) '
+                                  'ORDER BY number DESC LIMIT ?', (book_id, max(count, 0))).fetchall()
+            number = conn.execute('SELECT IFNULL(MAX(number), 0) AS number FROM copies '
+                                  'WHERE bookId = ?', (target['id'],)).fetchone()['number']
+            for i, copy in enumerate(moving, 1):
+                # Delete and insert rather than update, so the inventory
+                # triggers count the copy out of one title and into the other
+                conn.execute('DELETE FROM copies WHERE id = ?', (copy['id'],))
+                conn.execute('INSERT INTO copies (id, bookId, number, branch) VALUES (?, ?, ?, ?)',
+                             (copy['id'], target['id'], number + i, branch))
+            self._serve_holds(conn, target['id'])
+            return target['id'], len(moving)
+
+    def get_hold(self, hold_id):
+        return self._one('SELECT * FROM holds WHERE id = ?', (hold_id,))
+
+    def holds_for_student(self, student_id):
+        return self._all(
+            'SELECT holds.*, (SELECT COUNT(*) FROM holds AS ahead WHERE ahead.bookId = holds.bookId '
+            'AND ahead.rowid <= holds.rowid) AS position '
+            'FROM holds WHERE studentId = ? ORDER BY rowid', (student_id,))
+
+    def delete_hold(self, hold_id):
+        return self._delete('holds', hold_id)
+
+    # Counters
+    def counters(self):
+        totals = dict.fromkeys(counters.COUNTER_NAMES, 0)
+        totals.update((row['name'], row['value'])
+                      for row in self._all('SELECT name, value FROM counters'))
+        return totals
+
+    def student_counters(self, student_ids):
+        result = {}
+        student_ids = list(student_ids)
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(student_ids), 500):
+            chunk = student_ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in self._all(f'SELECT * FROM student_counters WHERE studentId IN ({placeholders})',
+                                 chunk):
+                result[row['studentId']] = {'issues': row['issues'], 'requests': row['requests']}
+        return {student_id: result.get(student_id, {'issues': 0, 'requests': 0})
+                for student_id in student_ids}
+
+    def check_counters(self):
+        with self.transaction() as conn:
+            return inventory.check(conn) + counters.check(conn)
+
+    def rebuild_counters(self):
+        # Inventory first: the unavailable counter is derived from it
+        with self.transaction() as conn:
+            inventory.rebuild(conn)
+            counters.rebuild(conn)
+
+    # Change tracking
+    def generations(self):
+        return {row['name']: (row['value'], row['modified'])
+                for row in self._all('SELECT name, value, modified FROM generations')}
+
+    # Journal
+    def journal_id(self):
+        return journal.journal_id(self._connection())
+
+    def journal_head(self):
+        return journal.head(self._connection())
+
+    def journal_events(self, after, limit=None):
+        return journal.events(self._connection(), after, limit)
+
+    def prune_journal(self, through):
+        with self.transaction() as conn:
+            return journal.prune(conn, through)
+
+    def loan_history(self, student_id=None, book_id=None, limit=25):
+        clauses, params = [], []
+        for column, value in (('studentId', student_id), ('bookId', book_id)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        return self._all(f'SELECT * FROM loan_history {where} '
+                         'ORDER BY closedDate DESC, rowid DESC LIMIT ?', params + [limit])
+
+    def closed_loans(self, after=0, batch_size=100000):
+        issued, due, closed = (ORDINAL_SQL.format(column)
+                               for column in ('issueDate', 'returnDate', 'closedDate'))
+        return self._batches(
+            f'SELECT rowid, {issued}, {due}, {closed}, bookId, studentId FROM loan_history '
+            f"WHERE rowid > ? AND status != 'requested' AND {issued} IS NOT NULL "
+            f'AND {due} IS NOT NULL AND {closed} IS NOT NULL ORDER BY rowid', (after,), batch_size)
+
+    def open_loans(self, batch_size=100000):
+        issued, due = (ORDINAL_SQL.format(column) for column in ('issueDate', 'returnDate'))
+        return self._batches(
+            f'SELECT {issued}, {due}, bookId, studentId FROM issues '
+            f"WHERE status != 'requested' AND {issued} IS NOT NULL AND {due} IS NOT NULL",
+            (), batch_size)
+
+    # Metadata
+    def get_meta(self, key, default=None):
+        row = self._one('SELECT value FROM meta WHERE key = ?', (key,))
+        return row['value'] if row else default
+
+    def set_meta(self, key, value):
+        with self.transaction() as conn:
+            conn.execute('INSERT INTO meta (key, value) VALUES (?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET value = excluded.value', (key, value))
+
+    def iter_books(self, rows=None):
+        return self._iter_rows('books', rows)
+
+    def iter_students(self, rows=None):
+        return self._iter_rows('students', rows)
+
+    def iter_issues(self, rows=None):
+        return self._iter_rows('issues', rows)
+
+    def _iter_rows(self, table, rows):
+        if rows is None:
+            return self._iter(f'SELECT * FROM {table} ORDER BY rowid')
+        return self._iter(f'SELECT * FROM {table} WHERE rowid BETWEEN ? AND ? ORDER BY rowid', rows)
+
+    def row_ranges(self, entity, parts):
+        # (first, last) rowid ranges of equal width. Deleted rows leave gaps,
+        # so the parts only roughly hold the same number of rows.
+        if entity not in ('books', 'students', 'issues'):
+            raise ValueError(f'Unknown collection: {entity}')
+        row = self._one(f'SELECT MIN(rowid) AS first, MAX(rowid) AS last FROM {entity}')
+        if row['first'] is None:
+            return []
+        first, last = row['first'], row['last']
+        width = max(1, -(-(last - first + 1) // max(1, parts)))
+        return [(start, min(start + width - 1, last)) for start in range(first, last + 1, width)]
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+BACKENDS = {
+    'sqlite': SQLiteStorage,
+}
+
+
+def open_storage(url):
+    # Storage URLs look like "sqlite:///relative/library.db" or
+    # "sqlite:////absolute/library.db". New backends register in BACKENDS.
+    scheme, _, location = url.partition('://')
+    if scheme not in BACKENDS:
+        raise ValueError(f'Unknown storage backend: {scheme}')
+    if scheme == 'sqlite' and location.startswith('/'):
+        location = location[1:]
+    return BACKENDS[scheme](location)
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'library.db')
+
+
+@pytest.fixture(params=['sqlite', 'indexed'])
+def storage(request, db_path):
+    backend = SQLiteStorage(db_path)
+    store = IndexedStorage(backend) if request.param == 'indexed' else backend
+    yield store
+    backend.close()
+
+
+def make_book(n, **fields):
+    return dict({'id': f'book-{n}', 'title': f'Title {n}', 'author': f'Author {n}',
+                 'isbn': f'{9780000000000 + n}', 'genre': 'Fiction'}, **fields)
+
+
+def make_student(n):
+    return {'id': f'student-{n}', 'name': f'Student {n}', 'username': f'user{n}',
+            'password': 'x', 'rollNo': f'R{n}'}
+
+
+def make_issue(issue_id, book_id, student_id, status='issued'):
+    return {'id': issue_id, 'bookId': book_id, 'studentId': student_id,
+            'issueDate': '2026-01-01', 'returnDate': '2026-01-08', 'status': status}
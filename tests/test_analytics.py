@@ -0,0 +1,36 @@
+import pytest
+
+from conftest import make_book, make_issue, make_student
+from library import analytics
+
+if not analytics.available():
+    pytest.skip('numpy is not installed', allow_module_level=True)
+
+
+def genres_by_book(table):
+    return {book_id: table.genres[table.book_genre[code]] for code, book_id in enumerate(table.book_ids)}
+
+
+def test_reloads_read_genres_of_loaned_books_only(storage, monkeypatch):
+    storage.add_books([make_book(n, genre='History' if n % 2 else None) for n in range(6)])
+    storage.add_student(make_student(0))
+    for n in range(3):
+        assert storage.reserve_book(make_issue(f'issue-{n}', f'book-{n}', 'student-0'))
+    storage.delete_issue('issue-0')
+
+    def whole_catalog(*args):
+        raise AssertionError('reports must not read the whole catalog')
+    monkeypatch.setattr(type(storage), 'all_books', whole_catalog)
+
+    columns = analytics.LoanColumns()
+    table = columns.refresh(storage)
+    assert genres_by_book(table) == {'book-0': analytics.UNCATEGORIZED, 'book-1': 'History',
+                                     'book-2': analytics.UNCATEGORIZED}
+
+    # A new loan reads just its book; an edited book is read again
+    assert storage.reserve_book(make_issue('issue-3', 'book-3', 'student-0'))
+    storage.update_book(dict(make_book(2), genre='Science'))
+    table = columns.refresh(storage)
+    assert genres_by_book(table) == {'book-0': analytics.UNCATEGORIZED, 'book-1': 'History',
+                                     'book-2': 'Science', 'book-3': 'History'}
+    assert analytics.most_borrowed(table, limit=1)[0]['loans'] == 1
@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+import app as library_app
+from conftest import make_book, make_issue, make_student
+from library import journal
+from library.records import Issue, Status
+
+app = library_app.app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A fresh store per test; the app's singletons are rebuilt on first use
+    monkeypatch.setitem(app.config, 'STORAGE_URL', f'sqlite:///{tmp_path}/library.db')
+    monkeypatch.setitem(app.config, 'SCHEDULER_ENABLED', False)
+    monkeypatch.setitem(app.config, 'CACHE_ENABLED', False)
+    monkeypatch.setitem(app.config, 'TEMPLATE_CACHE_DIR', None)
+    # Cheap hashes keep the tests fast
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH', 'pbkdf2_sha256')
+    monkeypatch.setitem(app.config, 'PBKDF2_ITERATIONS', 1000)
+    monkeypatch.setitem(app.config, 'ADMIN_PASSWORD_HASH', None)
+    for name in ('library_storage', 'library_cache', 'library_hasher', 'library_login_limiters'):
+        app.extensions.pop(name, None)
+    yield app.test_client()
+    storage = app.extensions.pop('library_storage', None)
+    if storage is not None:
+        storage.close()
+
+
+def register(client, **fields):
+    return client.post('/login/student', data=dict(action='register', **fields), follow_redirects=True)
+
+
+@pytest.mark.parametrize('fields', [
+    {},
+    {'name': 'Ann', 'username': 'ann'},
+    {'name': 'Ann', 'password': 'secret'},
+    {'username': 'ann', 'password': 'secret'},
+    {'name': '  ', 'username': 'ann', 'password': 'secret'},
+])
+def test_register_requires_name_username_and_password(client, fields):
+    response = register(client, **fields)
+    assert response.status_code == 200
+    assert b'Name, username and password are required.' in response.data
+    assert library_app.get_storage().count_students() == 0
+
+
+def test_register_then_login(client):
+    response = register(client, name='Ann', username='ann', password='secret', roll_no='R1')
+    assert b'Registration successful' in response.data
+    response = client.post('/login/student', data={'action': 'login', 'username': 'ann',
+                                                   'password': 'secret'})
+    assert response.status_code == 302
+
+
+def test_admin_login_checks_a_hash_for_unknown_usernames(client, monkeypatch):
+    calls = []
+    hasher = library_app.get_hasher()
+    verify_dummy = hasher.verify_dummy
+    monkeypatch.setattr(hasher, 'verify_dummy', lambda password: calls.append(password) or verify_dummy(password))
+
+    response = client.post('/login/admin', data={'username': 'someone', 'password': 'guess'})
+    assert response.status_code == 200 and b'Invalid credentials' in response.data
+    assert calls == ['guess']
+
+    response = client.post('/login/admin', data={'username': app.config['ADMIN_USERNAME'],
+                                                 'password': app.config['ADMIN_PASSWORD']})
+    assert response.status_code == 302
+    assert calls == ['guess']
+
+
+def test_snapshots_are_written_by_one_worker_at_a_time(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'SNAPSHOT_INTERVAL', 3600)
+    storage = library_app.get_storage()
+    path = storage.snapshot_path
+    with journal.snapshot_lock(path):
+        # Due, but another worker holds the lock
+        assert library_app.run_snapshot() is False
+    result = library_app.run_snapshot()
+    assert result['seq'] == storage.backend.journal_head()
+    # Fresh now, so the next worker skips it
+    assert library_app.run_snapshot() is None
+
+
+def log_in_as(client, student):
+    with client.session_transaction() as session:
+        session.update(user_id=student['id'], user_name=student['name'], user_role='student')
+
+
+def test_students_cannot_return_each_others_loans(client):
+    storage = library_app.get_storage()
+    storage.add_book(make_book(0))
+    owner, other = make_student(0), make_student(1)
+    storage.add_student(owner)
+    storage.add_student(other)
+    assert storage.reserve_book(make_issue('issue-0', 'book-0', owner['id']))
+
+    log_in_as(client, other)
+    response = client.post('/dashboard/return-book/issue-0', follow_redirects=True)
+    assert b'Loan not found.' in response.data
+    assert storage.get_issue('issue-0') is not None
+
+    log_in_as(client, owner)
+    response = client.post('/dashboard/return-book/issue-0', follow_redirects=True)
+    assert b'Book returned successfully!' in response.data
+    assert storage.get_issue('issue-0') is None
+
+
+def log_in_as_admin(client):
+    with client.session_transaction() as session:
+        session.update(user_id='admin', user_name='Admin', user_role='admin')
+
+
+@pytest.mark.parametrize('fields', [
+    {'loanDays': 0},
+    {'loanDays': 10 ** 9},
+    {'loanDays': 'soon'},
+    {'issueDate': '9999-12-30'},
+    {'issueDate': 'not-a-date'},
+])
+def test_issue_api_rejects_loan_periods_it_cannot_date(client, fields):
+    storage = library_app.get_storage()
+    storage.add_book(make_book(0))
+    storage.add_student(make_student(0))
+    log_in_as_admin(client)
+    response = client.post('/api/circulation/issue', json=dict(
+        items=[{'bookId': 'book-0', 'studentId': 'student-0'}], **fields))
+    assert response.status_code == 400 and 'error' in response.get_json()
+    assert storage.count_issues() == 0
+
+
+def test_books_keep_a_copy_and_their_hold_queue(client):
+    storage = library_app.get_storage()
+    storage.add_book(make_book(0))
+    storage.add_student(make_student(0))
+    log_in_as_admin(client)
+
+    response = client.post('/dashboard/books/edit/book-0', data=dict(make_book(0), copies=0),
+                           follow_redirects=True)
+    assert b'A book needs at least one copy.' in response.data
+    assert storage.book_inventory(['book-0'])['book-0']['total'] == 1
+
+    # A hold queued on a title whose copies were all removed
+    storage.remove_copies('book-0', 1)
+    backend = getattr(storage, 'backend', storage)
+    with backend.transaction() as conn:
+        conn.execute("INSERT INTO holds (id, bookId, studentId, requestDate, loanDays) "
+                     "VALUES ('hold-0', 'book-0', 'student-0', '2026-01-01', 7)")
+    response = client.post('/dashboard/books/delete/book-0', follow_redirects=True)
+    assert b'Students are waiting in its hold queue.' in response.data
+    assert storage.get_book('book-0') is not None and storage.get_hold('hold-0') is not None
+
+
+@pytest.mark.parametrize('fast', [False, True])
+def test_records_serialize_as_their_row_dicts(monkeypatch, fast):
+    monkeypatch.setitem(app.config, 'FAST_JSON', fast)
+    issue = Issue.from_row(make_issue('issue-0', 'book-0', 'student-0'))
+    payload = {'issue': issue, 'status': Status.OVERDUE, 'count': 1}
+    expected = {'issue': dict(issue), 'status': 'overdue', 'count': 1}
+    with app.app_context():
+        assert json.loads(app.json.dumps(payload, separators=(',', ':'))) == expected
+        assert json.loads(app.json.dumps(payload, indent=2)) == expected
+        response = app.json.response(payload)
+    assert response.get_json() == expected
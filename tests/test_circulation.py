@@ -0,0 +1,157 @@
+import random
+import threading
+
+import pytest
+
+from conftest import make_book, make_issue, make_student
+from library import circulation
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+def active_loans_per_copy(backend):
+    return backend._all(
+        "SELECT copyId, COUNT(*) AS n FROM issues WHERE status IN ('issued', 'requested', 'overdue') "
+        'GROUP BY copyId HAVING n > 1')
+
+
+def test_concurrent_reserves_give_one_active_loan_per_copy(db_path):
+    setup = SQLiteStorage(db_path)
+    setup.add_book(make_book(0))
+    setup.add_copies('book-0', 2)
+    n_threads = 12
+    results = [None] * n_threads
+    barrier = threading.Barrier(n_threads)
+
+    def reserve(n):
+        # Each thread is a separate worker with its own storage
+        backend = SQLiteStorage(db_path)
+        storage = IndexedStorage(backend) if n % 2 else backend
+        barrier.wait()
+        results[n] = storage.reserve_book(make_issue(f'issue-{n}', 'book-0', f'student-{n}'))
+        backend.close()
+
+    threads = [threading.Thread(target=reserve, args=(n,)) for n in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(bool(result) for result in results) == 3
+    assert active_loans_per_copy(setup) == []
+    assert setup.book_inventory(['book-0'])['book-0']['available'] == 0
+    assert setup.check_counters() == []
+
+
+def test_counters_match_inventory_after_mixed_circulation(storage):
+    rng = random.Random(7)
+    storage.add_books([make_book(n) for n in range(6)])
+    for n in range(6):
+        storage.add_copies(f'book-{n}', n % 3)
+    for n in range(10):
+        storage.add_student(make_student(n))
+
+    loans, requests = [], []
+    for step in range(300):
+        action = rng.random()
+        book_id, student_id = f'book-{rng.randrange(6)}', f'student-{rng.randrange(10)}'
+        if action < 0.35:
+            if storage.reserve_book(make_issue(f'issue-{step}', book_id, student_id)):
+                loans.append(f'issue-{step}')
+        elif action < 0.55:
+            result = storage.request_book(make_issue(f'issue-{step}', book_id, student_id, 'requested'))
+            if result == 'requested':
+                requests.append(f'issue-{step}')
+        elif action < 0.7 and requests:
+            issue_id = requests.pop(rng.randrange(len(requests)))
+            if storage.approve_requests([issue_id]) == [True]:
+                loans.append(issue_id)
+        elif loans:
+            storage.delete_issue(loans.pop(rng.randrange(len(loans))))
+
+    backend = getattr(storage, 'backend', storage)
+    assert backend.check_counters() == []
+    assert active_loans_per_copy(backend) == []
+
+    book_ids = [f'book-{n}' for n in range(6)]
+    inventory = backend.book_inventory(book_ids)
+    for book_id in book_ids:
+        copies = backend._one('SELECT COUNT(*) AS n FROM copies WHERE bookId = ?', (book_id,))['n']
+        out = backend._one("SELECT COUNT(*) AS n FROM issues WHERE bookId = ? "
+                           "AND status IN ('issued', 'requested', 'overdue')", (book_id,))['n']
+        assert inventory[book_id]['total'] == copies
+        assert inventory[book_id]['available'] == copies - out
+
+    totals = backend.counters()
+    assert totals['issues'] == len(backend.all_issues())
+    assert totals['requests'] == sum(issue['status'] == 'requested' for issue in backend.all_issues())
+    assert totals['unavailable'] == sum(stock['available'] <= 0 for stock in inventory.values())
+    # The index agrees with the tables
+    assert sorted(issue['id'] for issue in storage.all_issues()) == sorted(
+        issue['id'] for issue in backend.all_issues())
+
+
+def test_approving_twice_changes_nothing(storage):
+    storage.add_book(make_book(0))
+    storage.add_student(make_student(0))
+    assert storage.request_book(make_issue('r', 'book-0', 'student-0', 'requested')) == 'requested'
+    assert storage.approve_requests(['r', 'missing']) == [True, False]
+    assert storage.approve_requests(['r']) == [False]
+    assert storage.get_issue('r')['status'] == 'issued'
+
+
+def test_failed_atomic_batch_writes_nothing_and_keeps_the_index(storage, monkeypatch):
+    storage.add_books([make_book(0), make_book(1)])
+    storage.add_student(make_student(0))
+    monkeypatch.setattr(storage, 'reload', lambda: pytest.fail('full reload'), raising=False)
+    # The second loan of book-0 finds no free copy once the first is written
+    items = [{'bookId': 'book-0', 'studentId': 'student-0'},
+             {'bookId': 'book-1', 'studentId': 'student-0'},
+             {'bookId': 'book-0', 'rollNo': 'R0'}]
+    report = circulation.issue_books(storage, items, atomic=True)
+    assert not report.committed and report.failed == 3
+    assert storage.all_issues() == [] and storage.count_issues() == 0
+
+    report = circulation.issue_books(storage, items[:2], atomic=True)
+    assert report.committed
+    backend = getattr(storage, 'backend', storage)
+    assert sorted(issue['id'] for issue in storage.all_issues()) == sorted(
+        issue['id'] for issue in backend.all_issues())
+    assert len(storage.issues_for_book('book-1')) == 1
+
+
+def test_writes_inside_a_transaction_reach_the_index_on_commit(storage):
+    storage.add_book(make_book(0))
+    storage.add_student(make_student(0))
+    with storage.transaction():
+        assert storage.reserve_book(make_issue('issue-0', 'book-0', 'student-0'))
+        storage.delete_issues(['issue-0'])
+        assert storage.reserve_book(make_issue('issue-1', 'book-0', 'student-0'))
+    assert [issue['id'] for issue in storage.issues_for_book('book-0')] == ['issue-1']
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            storage.delete_issues(['issue-1'])
+            raise RuntimeError()
+    assert [issue['id'] for issue in storage.issues_for_book('book-0')] == ['issue-1']
+
+
+def test_issues_for_students_matches_one_lookup_per_student(storage):
+    storage.add_books([make_book(n) for n in range(3)])
+    for n in range(4):
+        storage.add_student(make_student(n))
+    for n in range(6):
+        storage.reserve_book(make_issue(f'issue-{n}', f'book-{n % 3}', f'student-{n % 3}'))
+    student_ids = [f'student-{n}' for n in range(4)] + ['missing']
+    loans = storage.issues_for_students(student_ids)
+    assert list(loans) == student_ids
+    for student_id in student_ids:
+        assert [dict(issue) for issue in loans[student_id]] == [
+            dict(issue) for issue in storage.issues_for_student(student_id)]
+
+
+def test_no_holds_on_a_title_without_copies(storage):
+    storage.add_book(make_book(0))
+    storage.add_student(make_student(0))
+    storage.remove_copies('book-0', 1)
+    assert storage.request_book(make_issue('r', 'book-0', 'student-0', 'requested')) == 'unavailable'
+    assert storage.book_inventory(['book-0'])['book-0']['queued'] == 0
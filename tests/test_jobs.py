@@ -0,0 +1,35 @@
+import csv
+import json
+
+from conftest import make_book, make_issue, make_student
+from library import jobs
+from library.storage import SQLiteStorage
+
+
+def test_statements_fetch_loans_per_batch(tmp_path, db_path, monkeypatch):
+    storage = SQLiteStorage(db_path)
+    storage.add_books([make_book(n) for n in range(8)])
+    for n in range(5):
+        storage.add_student(make_student(n))
+    for n in range(8):
+        assert storage.reserve_book(make_issue(f'issue-{n}', f'book-{n}', f'student-{n % 4}'))
+    storage.close()
+
+    def one_by_one(self, student_id):
+        raise AssertionError('statements must not look up loans one student at a time')
+    monkeypatch.setattr(SQLiteStorage, 'issues_for_student', one_by_one)
+    url = f'sqlite:///{db_path}'
+
+    path = str(tmp_path / 'statements.jsonl')
+    stats = jobs.statement_part(url, path, 'jsonl', None, True, batch_size=2)
+    assert stats == {'students': 4, 'loans': 8}
+    with open(path, encoding='utf-8') as stream:
+        lines = [json.loads(line) for line in stream]
+    assert sorted(line['studentId'] for line in lines) == [f'student-{n}' for n in range(4)]
+    assert all(len(line['loans']) == 2 and line['loans'][0]['title'] for line in lines)
+
+    path = str(tmp_path / 'statements.csv')
+    jobs.statement_part(url, path, 'csv', None, True)
+    with open(path, encoding='utf-8', newline='') as stream:
+        rows = list(csv.DictReader(stream))
+    assert len(rows) == 8 and {row['title'] for row in rows} == {f'Title {n}' for n in range(8)}
@@ -0,0 +1,95 @@
+import pytest
+
+from conftest import make_book, make_issue, make_student
+from library import journal
+from library.index import IndexedStorage
+from library.storage import SQLiteStorage
+
+
+@pytest.fixture
+def backend(db_path):
+    backend = SQLiteStorage(db_path)
+    backend.add_books([make_book(n) for n in range(5)])
+    backend.add_student(make_student(0))
+    yield backend
+    backend.close()
+
+
+def index_state(storage):
+    return ({book['id']: dict(book) for book in storage.all_books()},
+            {student['id']: dict(student) for student in storage.all_students()},
+            {issue['id']: dict(issue) for issue in storage.all_issues()})
+
+
+def no_reload(storage, monkeypatch):
+    def fail():
+        raise AssertionError('reloaded instead of replaying the journal')
+    monkeypatch.setattr(storage, 'reload', fail)
+
+
+def test_index_catches_up_from_the_journal(db_path, backend, monkeypatch):
+    # Two workers, each with its own connection and index
+    writer = IndexedStorage(SQLiteStorage(db_path))
+    reader = IndexedStorage(SQLiteStorage(db_path))
+    no_reload(reader, monkeypatch)
+
+    writer.add_book(make_book(10))
+    writer.update_book({'id': 'book-1', 'title': 'Renamed', 'author': 'A', 'isbn': '1', 'genre': None})
+    writer.delete_book('book-2')
+    assert writer.reserve_book(make_issue('issue-0', 'book-0', 'student-0'))
+    reader.refresh()
+
+    assert index_state(reader) == index_state(writer) == index_state(backend)
+    assert reader.get_book('book-1')['title'] == 'Renamed'
+    assert reader.get_book('book-2') is None
+    assert reader.issues_for_student('student-0')[0]['id'] == 'issue-0'
+
+
+def test_index_reloads_when_the_journal_was_pruned(db_path, backend):
+    reader = IndexedStorage(SQLiteStorage(db_path))
+    backend.add_book(make_book(10))
+    backend.prune_journal(backend.journal_head())
+    reader.refresh()
+    assert index_state(reader) == index_state(backend)
+
+
+def test_recovery_from_a_snapshot_replays_the_tail(tmp_path, db_path, backend, monkeypatch):
+    snapshot = str(tmp_path / 'library.snapshot')
+    first = IndexedStorage(SQLiteStorage(db_path), snapshot)
+    first.snapshot()
+    # Written after the snapshot, so only the journal has them
+    first.add_book(make_book(10))
+    assert first.reserve_book(make_issue('issue-0', 'book-3', 'student-0'))
+    first.delete_book('book-4')
+
+    monkeypatch.setattr(IndexedStorage, 'reload', lambda self: pytest.fail('full reload'))
+    recovered = IndexedStorage(SQLiteStorage(db_path), snapshot)
+    assert index_state(recovered) == index_state(backend)
+    assert recovered.get_issue('issue-0')['bookId'] == 'book-3'
+
+
+def test_snapshot_of_another_database_is_ignored(tmp_path, db_path, backend):
+    snapshot = str(tmp_path / 'library.snapshot')
+    IndexedStorage(SQLiteStorage(db_path), snapshot).snapshot()
+
+    other = SQLiteStorage(str(tmp_path / 'other.db'))
+    other.add_book(make_book(99))
+    storage = IndexedStorage(other, snapshot)
+    assert [book['id'] for book in storage.all_books()] == ['book-99']
+    other.close()
+
+
+def test_corrupt_snapshot_falls_back_to_a_full_load(tmp_path, db_path, backend):
+    snapshot = tmp_path / 'library.snapshot'
+    snapshot.write_bytes(b'not a pickle')
+    storage = IndexedStorage(SQLiteStorage(db_path), str(snapshot))
+    assert index_state(storage) == index_state(backend)
+
+
+def test_one_holder_of_the_snapshot_lock(tmp_path):
+    path = str(tmp_path / 'library.snapshot')
+    with journal.snapshot_lock(path) as first:
+        with journal.snapshot_lock(path) as second:
+            assert first and not second
+    with journal.snapshot_lock(path) as again:
+        assert again
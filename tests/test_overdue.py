@@ -0,0 +1,104 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from conftest import make_book, make_issue, make_student
+from library import overdue
+from library.storage import SQLiteStorage
+
+TODAY = date(2026, 1, 10)
+
+
+class Sink:
+    def __init__(self, send=None):
+        self.sent = []
+        self._send = send
+
+    def send(self, messages):
+        if self._send is not None:
+            self._send(messages)
+        self.sent.extend(messages)
+
+
+@pytest.fixture
+def loans(storage):
+    # Three loans due on 2026-01-08, overdue by TODAY
+    storage.add_books([make_book(n) for n in range(3)])
+    storage.add_student(make_student(0))
+    for n in range(3):
+        assert storage.reserve_book(make_issue(f'issue-{n}', f'book-{n}', 'student-0'))
+    assert overdue.sweep_overdue(storage, TODAY)['overdue'] == 3
+    return storage
+
+
+def queued(storage):
+    backend = getattr(storage, 'backend', storage)
+    return backend._all('SELECT issueId, claimId FROM outbox ORDER BY id')
+
+
+def test_delivered_reminders_leave_the_outbox(loans):
+    sink = Sink()
+    assert overdue.deliver_reminders(loans, sink, batch_size=2) == 3
+    assert [message['issueId'] for message in sink.sent] == ['issue-0', 'issue-1', 'issue-2']
+    assert queued(loans) == []
+
+
+def test_failed_send_hands_the_batch_back(loans):
+    def fail(messages):
+        raise OSError('sink down')
+    with pytest.raises(OSError):
+        overdue.deliver_reminders(loans, Sink(fail))
+    assert [(row['issueId'], row['claimId']) for row in queued(loans)] == [
+        ('issue-0', None), ('issue-1', None), ('issue-2', None)]
+    assert overdue.deliver_reminders(loans, Sink()) == 3
+
+
+def test_send_runs_outside_the_write_transaction(db_path, loans):
+    other = SQLiteStorage(db_path)
+    other._connection().execute('PRAGMA busy_timeout = 0')
+
+    def write_while_sending(messages):
+        # Would raise "database is locked" if the claim were still open
+        other.add_book(make_book(9))
+    try:
+        assert overdue.deliver_reminders(loans, Sink(write_while_sending)) == 3
+    finally:
+        other.close()
+    assert getattr(loans, 'backend', loans).get_book('book-9') is not None
+
+
+def test_lapsed_lease_can_be_claimed_again(loans):
+    claim_id, reminders = loans.claim_reminders(2, lease=-1)
+    assert [row['issueId'] for row in reminders] == ['issue-0', 'issue-1']
+    # The first sender died; its lease has run out
+    retry_id, retried = loans.claim_reminders(5)
+    assert retry_id != claim_id
+    assert [row['issueId'] for row in retried] == ['issue-0', 'issue-1', 'issue-2']
+    assert loans.claim_reminders(5)[1] == []
+    # The late sender finds nothing left to remove
+    assert loans.finish_reminders(retry_id) == 3
+    assert loans.finish_reminders(claim_id) == 0
+
+
+def test_held_lease_is_skipped(loans):
+    claim_id, reminders = loans.claim_reminders(2)
+    assert [row['issueId'] for row in loans.claim_reminders(5)[1]] == ['issue-2']
+    loans.release_reminders(claim_id)
+    assert [row['issueId'] for row in loans.claim_reminders(5)[1]] == ['issue-0', 'issue-1']
+
+
+def test_upgrade_adds_the_lease_columns(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE outbox (id INTEGER PRIMARY KEY, kind TEXT NOT NULL, '
+                 'issueId TEXT NOT NULL, created TEXT NOT NULL)')
+    conn.execute("INSERT INTO outbox (kind, issueId, created) VALUES ('due', 'issue-0', '2026-01-01')")
+    conn.execute('PRAGMA user_version = 3')
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(db_path)
+    claim_id, reminders = storage.claim_reminders()
+    assert [row['issueId'] for row in reminders] == ['issue-0']
+    assert storage.finish_reminders(claim_id) == 1
+    storage.close()
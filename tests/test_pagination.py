@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import make_book
+
+TITLES = ('alpha', 'Alpha', 'ALPHA', 'beta', 'Beta', 'gamma')
+
+
+@pytest.fixture
+def books(storage):
+    # Titles that tie under NOCASE, so the id decides their order
+    books = [make_book(n, title=TITLES[n % len(TITLES)]) for n in range(23)]
+    storage.add_books(books)
+    return books
+
+
+def walk(storage, limit, descending=False):
+    pages, cursor = [], None
+    while True:
+        page = storage.page_books('title', descending, after=cursor, limit=limit)
+        pages.append([book['id'] for book in page.items])
+        cursor = page.next_cursor
+        if cursor is None:
+            return pages, page
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 4, 5, 23])
+def test_forward_pages_follow_nocase_title_then_id(storage, books, limit, descending):
+    expected = [book['id'] for book in sorted(books, key=lambda book: (book['title'].lower(), book['id']),
+                                              reverse=descending)]
+    pages, _ = walk(storage, limit, descending)
+    assert [book_id for page in pages for book_id in page] == expected
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+@pytest.mark.parametrize('limit', [3, 5])
+def test_backward_pages_retrace_the_forward_ones(storage, books, limit):
+    pages, last = walk(storage, limit)
+    backward = [[book['id'] for book in last.items]]
+    cursor = last.prev_cursor
+    while cursor is not None:
+        page = storage.page_books('title', before=cursor, limit=limit)
+        backward.append([book['id'] for book in page.items])
+        cursor = page.prev_cursor
+    assert backward[::-1] == pages
+
+
+def test_first_page_has_no_prev_cursor(storage, books):
+    page = storage.page_books('title', limit=5)
+    assert page.prev_cursor is None and page.next_cursor is not None
+    again = storage.page_books('title', before=storage.page_books(
+        'title', after=page.next_cursor, limit=5).prev_cursor, limit=5)
+    assert [book['id'] for book in again.items] == [book['id'] for book in page.items]
+    assert again.prev_cursor is None
+
+
+def test_invalid_cursor_is_rejected(storage, books):
+    with pytest.raises(ValueError):
+        storage.page_books('title', after='not-a-cursor')
@@ -4,6 +4,12 @@ export interface Book {
   author: string
   isbn: string
   genre?: string
+  branch: string
+}
+
+export interface Branch {
+  id: string
+  name: string
 }
 
 export interface Student {
@@ -26,5 +32,9 @@ export interface BookIssue {
   studentId: string
   issueDate: string
   returnDate: string
-  status: "issued" | "requested"
+  status: "issued" | "requested" | "overdue"
+  copyId?: string | null
+  fine?: number | null
+  lastReminder?: string | null
+  branch: string
 }
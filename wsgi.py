@@ -0,0 +1,44 @@
+"""WSGI entry point for production.
+
+    LIBRARY_SECRET_KEY=... gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn (pip install gunicorn) runs several worker processes, each with a
+few threads, forked from a master that has already loaded the catalog.
+`flask --app app compile-templates` at build time writes the templates'
+bytecode cache, so even the master skips compiling them.
+For small installs without it, `python wsgi.py` serves the same app from a
+threaded server in the standard library.
+
+Configuration comes from the environment: LIBRARY_SECRET_KEY,
+LIBRARY_STORAGE_URL, LIBRARY_BIND, LIBRARY_WORKERS, LIBRARY_THREADS,
+LIBRARY_PROXY_COUNT, and the other LIBRARY_* settings read in app.py.
+"""
+import os
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from app import create_app
+
+app = create_app(production=os.environ.get('LIBRARY_ENV', 'production') == 'production')
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, code='-', size='-'):
+        if os.environ.get('LIBRARY_ACCESS_LOG', '1') == '1':
+            super().log_request(code, size)
+
+
+def serve():
+    host, _, port = os.environ.get('LIBRARY_BIND', '127.0.0.1:8000').rpartition(':')
+    with make_server(host or '127.0.0.1', int(port), app, ThreadingWSGIServer, QuietHandler) as server:
+        print(f'Serving on http://{host or "127.0.0.1"}:{port}')
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve()